@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - Content Analysis
+Decodes a few short windows spread across a file with idet, cropdetect and
+silencedetect, and decides whether the encode needs to deinterlace, crop
+or keep the audio.
+"""
+
+import re
+import subprocess
+from collections import Counter
+
+from mts_probe import probe_media
+
+ANALYSIS_WINDOWS = 5
+WINDOW_SECONDS = 2.0
+# Audio quieter than this in every window is treated as silent
+SILENCE_THRESHOLD = '-60dB'
+
+IDET_RE = re.compile(r'Multi frame detection:\s*TFF:\s*(\d+)\s*BFF:\s*(\d+)\s*Progressive:\s*(\d+)')
+CROP_RE = re.compile(r'crop=(\d+):(\d+):(\d+):(\d+)')
+SILENCE_DURATION_RE = re.compile(r'silence_duration:\s*([0-9.]+)')
+SILENCE_START_RE = re.compile(r'silence_start:\s*(-?[0-9.]+)')
+
+
+def window_starts(duration, windows=ANALYSIS_WINDOWS, length=WINDOW_SECONDS):
+    """Spread analysis windows evenly, away from the very start and end"""
+    if not duration or duration <= length:
+        return [0.0]
+    usable = duration - length
+    return [usable * (i + 1) / (windows + 1) for i in range(windows)]
+
+
+def analyze_window(input_file, start, length=WINDOW_SECONDS, has_audio=True):
+    """Decode one window and return the raw filter statistics"""
+    cmd = [
+        'ffmpeg', '-hide_banner', '-nostats', '-ss', f"{start:.3f}", '-t', f"{length:.3f}",
+        '-i', input_file, '-vf', 'idet,cropdetect=round=2:reset=0'
+    ]
+    if has_audio:
+        cmd += ['-af', f'silencedetect=n={SILENCE_THRESHOLD}:d={length * 0.9:.3f}']
+    else:
+        cmd += ['-an']
+    cmd += ['-f', 'null', '-']
+    result = subprocess.run(cmd, capture_output=True, text=True, errors='replace')
+    log = result.stderr
+
+    stats = {'tff': 0, 'bff': 0, 'progressive': 0, 'crop': None, 'silent': False}
+    idet = IDET_RE.findall(log)
+    if idet:
+        tff, bff, progressive = idet[-1]
+        stats.update(tff=int(tff), bff=int(bff), progressive=int(progressive))
+    crops = CROP_RE.findall(log)
+    if crops:
+        stats['crop'] = ':'.join(crops[-1])
+
+    silence = sum(float(d) for d in SILENCE_DURATION_RE.findall(log))
+    # A silence that is still running at the end of the window has no duration line
+    open_silence = len(SILENCE_START_RE.findall(log)) > len(SILENCE_DURATION_RE.findall(log))
+    stats['silent'] = has_audio and (silence >= length * 0.9 or (open_silence and silence == 0))
+    return stats
+
+
+def analyze_content(input_file, media):
+    """Sample the file described by probe data and return encode decisions as a dict"""
+    has_audio = any(codec_type == 'audio' for codec_type, _ in media.get('streams', []))
+    width, height = media.get('width'), media.get('height')
+    samples = [analyze_window(input_file, start, has_audio=has_audio)
+               for start in window_starts(media.get('duration'))]
+
+    tff = sum(s['tff'] for s in samples)
+    bff = sum(s['bff'] for s in samples)
+    progressive = sum(s['progressive'] for s in samples)
+    interlaced = tff + bff > progressive
+
+    # Only crop when every window agrees on the same smaller picture
+    crop = None
+    crops = Counter(s['crop'] for s in samples)
+    if len(crops) == 1 and None not in crops:
+        crop = next(iter(crops))
+        crop_width, crop_height = (int(v) for v in crop.split(':')[:2])
+        if not width or not height or (crop_width >= width and crop_height >= height):
+            crop = None
+
+    return {
+        'deinterlace': interlaced,
+        'field_order': ('tff' if tff >= bff else 'bff') if interlaced else None,
+        'crop': crop,
+        'drop_audio': has_audio and all(s['silent'] for s in samples),
+    }
+
+
+def analyze_file(input_file, cache=None):
+    """Probe and analyse a file, reusing decisions cached with its probe data"""
+    decisions = cache.get(input_file, 'analysis') if cache else None
+    if decisions is None:
+        media = probe_media(input_file, cache)
+        if media is None:
+            return None
+        decisions = analyze_content(input_file, media)
+        if cache:
+            cache.set(input_file, 'analysis', decisions)
+    return decisions
+
+
+def analysis_video_filter(decisions):
+    """Turn analysis decisions into a -vf chain, or None if nothing is needed"""
+    filters = []
+    if decisions.get('deinterlace'):
+        parity = decisions.get('field_order') or 'auto'
+        filters.append(f"yadif=parity={parity}")
+    if decisions.get('crop'):
+        filters.append(f"crop={decisions['crop']}")
+    return ','.join(filters) or None
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - Archive Sources
+Lists MTS members of tar and zip archives so they can be streamed into
+ffmpeg without extracting them to disk first.
+"""
+
+import os
+import struct
+import tarfile
+import zipfile
+import threading
+from pathlib import PurePosixPath
+
+from mts_discovery import MTS_EXTENSIONS
+
+ARCHIVE_SUFFIXES = ('.tar', '.zip', '.tgz', '.gz', '.bz2', '.xz')
+
+# Fixed part of a zip local file header, see APPNOTE.TXT 4.3.7
+ZIP_LOCAL_HEADER = struct.Struct('<4s2B4HL2L2H')
+ZIP_LOCAL_SIGNATURE = b'PK\x03\x04'
+
+
+def is_archive(path):
+    """Check whether path is a tar or zip archive"""
+    if not os.path.isfile(path):
+        return False
+    return zipfile.is_zipfile(path) or tarfile.is_tarfile(path)
+
+
+def is_compressed_tar(path):
+    """Check whether path is a compressed tar, which can only be read front to back"""
+    if not is_archive(path) or zipfile.is_zipfile(path):
+        return False
+    try:
+        with tarfile.open(path, 'r:'):
+            return False
+    except tarfile.ReadError:
+        return True
+
+
+def archive_output_dir(archive_path):
+    """Default output directory for an archive: its path without archive suffixes"""
+    name = archive_path.name
+    while name.lower().endswith(ARCHIVE_SUFFIXES):
+        name = name[:name.rindex('.')]
+    return archive_path.parent / (name or archive_path.name)
+
+
+def safe_member_path(name):
+    """Turn an archive member name into a relative path that stays inside the output"""
+    parts = [part for part in PurePosixPath(name).parts if part not in ('/', '.', '..')]
+    return PurePosixPath(*parts) if parts else None
+
+
+class ArchiveMember:
+    def __init__(self, archive_path, name, size, kind, data_offset=None, reader=None):
+        self.archive_path = archive_path
+        self.name = name
+        self.size = size
+        self.kind = kind
+        # Offset of the member bytes when they are stored uncompressed
+        self.data_offset = data_offset
+        # SequentialTar shared by the members of a compressed tar
+        self.reader = reader
+
+    @property
+    def display_name(self):
+        return f"{os.path.basename(self.archive_path)}:{self.name}"
+
+    def raw_range(self):
+        """Return (path, offset, length) when the member can be read in place"""
+        if self.data_offset is None:
+            return None
+        return self.archive_path, self.data_offset, self.size
+
+    def open(self):
+        """Open the member for sequential reading with its own archive handle"""
+        if self.kind == 'zip':
+            archive = zipfile.ZipFile(self.archive_path)
+            return _OwnedStream(archive.open(self.name), archive.close)
+        if self.reader is not None:
+            return self.reader.open(self.name)
+        archive = tarfile.open(self.archive_path)
+        return _OwnedStream(archive.extractfile(self.name), archive.close)
+
+
+class SequentialTar:
+    """One front-to-back pass over a compressed tar, shared by its members
+
+    A compressed tar cannot seek, so extracting a member by name
+    decompresses everything before it. Members opened in archive order
+    are read from the same pass instead, one at a time; a member the pass
+    has already gone beyond, such as a retry, gets a handle of its own.
+    """
+
+    def __init__(self, archive_path):
+        self.archive_path = archive_path
+        # Held from opening a member until its stream is closed
+        self.lock = threading.Lock()
+        self.archive = None
+        self.passed = set()
+
+    def open(self, name):
+        self.lock.acquire()
+        try:
+            if name not in self.passed:
+                if self.archive is None:
+                    self.archive = tarfile.open(self.archive_path, 'r|*')
+                while True:
+                    info = self.archive.next()
+                    if info is None:
+                        break
+                    self.passed.add(info.name)
+                    if info.name == name and info.isreg():
+                        return _OwnedStream(self.archive.extractfile(info), self.lock.release)
+        except BaseException:
+            self.lock.release()
+            raise
+        self.lock.release()
+        archive = tarfile.open(self.archive_path)
+        return _OwnedStream(archive.extractfile(name), archive.close)
+
+
+class _OwnedStream:
+    """File object wrapper that also releases what the stream came from, e.g. closes its archive"""
+
+    def __init__(self, stream, release):
+        self.stream = stream
+        self.release = release
+
+    def readinto(self, buffer):
+        return self.stream.readinto(buffer)
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+    def close(self):
+        self.stream.close()
+        self.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def list_members(archive_path):
+    """Return the MTS members of a tar or zip archive"""
+    if zipfile.is_zipfile(archive_path):
+        return _list_zip_members(archive_path)
+    return _list_tar_members(archive_path)
+
+
+def _list_tar_members(archive_path):
+    # Only plain tars can be read in place, compressed ones go through tarfile
+    try:
+        archive = tarfile.open(archive_path, 'r:')
+        compressed = False
+    except tarfile.ReadError:
+        archive = tarfile.open(archive_path)
+        compressed = True
+
+    members = []
+    reader = SequentialTar(archive_path) if compressed else None
+    with archive:
+        for info in archive:
+            if not info.isreg() or not info.name.lower().endswith(MTS_EXTENSIONS):
+                continue
+            offset = None if compressed or info.issparse() else info.offset_data
+            members.append(ArchiveMember(archive_path, info.name, info.size, 'tar', offset, reader))
+    return members
+
+
+def _list_zip_members(archive_path):
+    members = []
+    with zipfile.ZipFile(archive_path) as archive, open(archive_path, 'rb') as raw:
+        for info in archive.infolist():
+            if info.is_dir() or not info.filename.lower().endswith(MTS_EXTENSIONS):
+                continue
+            offset = None
+            if info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1:
+                offset = _zip_data_offset(raw, info)
+            members.append(ArchiveMember(archive_path, info.filename, info.file_size, 'zip', offset))
+    return members
+
+
+def _zip_data_offset(raw, info):
+    """Return where a stored zip member's data starts, or None if unreadable"""
+    raw.seek(info.header_offset)
+    header = raw.read(ZIP_LOCAL_HEADER.size)
+    if len(header) != ZIP_LOCAL_HEADER.size:
+        return None
+    fields = ZIP_LOCAL_HEADER.unpack(header)
+    if fields[0] != ZIP_LOCAL_SIGNATURE:
+        return None
+    name_length, extra_length = fields[-2], fields[-1]
+    return info.header_offset + ZIP_LOCAL_HEADER.size + name_length + extra_length
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - FFmpeg Capabilities
+Queries the version, encoders, muxers and filters of the ffmpeg on PATH
+once and keeps them in the user cache, keyed by the binary's path, size
+and mtime, so later runs start without spawning ffmpeg at all.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+
+from mts_paths import user_cache_dir
+
+CAPABILITIES_FILE = 'ffmpeg_capabilities.json'
+# ffmpeg option listing each capability table
+CAPABILITY_TABLES = {'encoders': '-encoders', 'muxers': '-muxers', 'filters': '-filters'}
+
+
+def _table_names(text):
+    """Names from an ffmpeg listing such as -encoders
+
+    -encoders and -muxers put their entries below a dashed separator;
+    -filters has none, but each of its entries names the pads as 'A->V'.
+    """
+    names = []
+    in_table = False
+    for line in text.splitlines():
+        fields = line.split()
+        if in_table and len(fields) > 1 or len(fields) > 2 and '->' in fields[2]:
+            names.append(fields[1])
+        elif fields and set(fields[0]) == {'-'}:
+            in_table = True
+    return names
+
+
+def query_capabilities(binary):
+    """Run ffmpeg to list its capabilities, return None if it does not run"""
+    options = {'version': '-version', **CAPABILITY_TABLES}
+    try:
+        # The listings are independent, so let them start up in parallel
+        processes = {key: subprocess.Popen([binary, '-hide_banner', option], stdout=subprocess.PIPE,
+                                           stderr=subprocess.DEVNULL, text=True)
+                     for key, option in options.items()}
+    except OSError:
+        return None
+    outputs = {}
+    for key, process in processes.items():
+        outputs[key] = process.communicate()[0]
+        if process.returncode != 0:
+            outputs[key] = None
+    if outputs['version'] is None:
+        return None
+
+    first_line = outputs['version'].splitlines()[0] if outputs['version'] else ''
+    # 'ffmpeg version 6.1.1-3ubuntu5 Copyright ...'
+    fields = first_line.split()
+    capabilities = {'version': fields[2] if len(fields) > 2 and fields[1] == 'version' else None}
+    for key in CAPABILITY_TABLES:
+        capabilities[key] = _table_names(outputs[key]) if outputs[key] else []
+    return capabilities
+
+
+def _cache_path():
+    try:
+        return os.path.join(user_cache_dir(), CAPABILITIES_FILE)
+    except OSError:
+        return None
+
+
+def get_capabilities(refresh=False):
+    """Capabilities of the ffmpeg on PATH, from the cache while the binary is unchanged
+
+    Returns a dict with 'path', 'version' and the 'encoders', 'muxers' and
+    'filters' name lists, or None when ffmpeg is missing or broken.
+    """
+    binary = shutil.which('ffmpeg')
+    if binary is None:
+        return None
+    binary = os.path.realpath(binary)
+    try:
+        info = os.stat(binary)
+    except OSError:
+        return None
+    key = f"{binary}|{info.st_size}|{info.st_mtime_ns}"
+
+    path = _cache_path()
+    entries = {}
+    if path:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = {}
+    if not refresh and key in entries:
+        return entries[key]
+
+    capabilities = query_capabilities(binary)
+    if capabilities is None:
+        return None
+    capabilities['path'] = binary
+    if path:
+        # Forget older builds at the same path, then write atomically
+        entries = {k: v for k, v in entries.items() if not k.startswith(binary + '|')}
+        entries[key] = capabilities
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(entries, f)
+            os.replace(temp_path, path)
+        except OSError:
+            pass
+    return capabilities
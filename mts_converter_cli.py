@@ -9,196 +9,1141 @@ import os
 import sys
 import subprocess
 import argparse
-import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from contextlib import ExitStack
 from pathlib import Path
 
+from mts_analysis import analysis_video_filter, analyze_file
+from mts_capabilities import get_capabilities
+from mts_dedup import find_duplicates, link_output, unshare_output
+from mts_discovery import iter_mts_files
+from mts_encoders import (DEFAULT_ENCODER, ENCODERS, PRESETS, TUNES, available_encoders, check_crf,
+                          default_crf, describe_encoder, encoder_args)
+from mts_extras import EXTRA_OUTPUTS, existing_extra_outputs, plan_extras
+from mts_failures import LOG_TAIL_LINES, classify_failure, describe_attempts, plan_retry
+from mts_history import SpeedHistory, profile_key
+from mts_hls import (HLS_FORMATS, MASTER_PLAYLIST, VARIANT_PLAYLIST, finish_master_playlist, hls_output_args,
+                     hls_output_dir, measure_variant, plan_variants)
+from mts_index import get_index
+from mts_integrity import MAX_DAMAGED_FRACTION, RESILIENT_INPUT_ARGS, scan_file
+from mts_ladder import DEFAULT_LADDER, ladder_filtergraph, ladder_output_args, parse_ladder, rung_output_path
+from mts_limits import JOB_CLASSES, CorePool, parse_limits, parse_size, pin_command
+from mts_output_cache import DEFAULT_CACHE_SIZE, OutputCache, cache_key, cache_settings, source_digest
+from mts_prefetch import ReadAhead
+from mts_probe import ProbeCache, native_probe, probe_media, read_sps
+from mts_quality import find_target_crf, parse_target
+from mts_scheduler import (BatchJob, DeviceScheduler, SCHEDULING_POLICIES, estimate_output_bytes,
+                           order_jobs)
+from mts_staging import ScratchStager
+from mts_stream import FRAGMENTED_MP4_FLAGS, HeldOutput, PeekedInput, enlarge_pipe, feed_source, peek_head
+from mts_throughput import BatchMeter, ThroughputMeter, format_duration, parse_stats
+from mts_tiers import live_replacement_path, preview_attempts
+from mts_trim import (audio_window, concat_list, keyframe_offset, matching_encoder_args, measure_duration,
+                      parse_time, piece_slice, plan_cut, trim_input_args)
+from mts_ts import TransportStream, TransportStreamError
+
+# Seconds between progress lines when not redrawing a terminal status line
+PROGRESS_LOG_INTERVAL = 30
+
+
+def output_duration(duration, start=None, end=None):
+    """Duration of the output of a file lasting duration seconds, trimmed to start and end"""
+    if (start or end is not None) and (duration or end is not None):
+        return min(filter(None, (end, duration))) - (start or 0)
+    return duration
+
+
 class MTSConverterCLI:
-    def __init__(self):
-        self.check_ffmpeg()
+    def __init__(self, scratch_dir=None, limits=None, refresh_capabilities=False, output_cache=None):
+        self.check_ffmpeg(refresh=refresh_capabilities)
+        self.stager = ScratchStager(scratch_dir) if scratch_dir else None
+        # Shared OutputCache of finished conversions, or None
+        self.output_cache = output_cache
+        self.probe_cache = ProbeCache()
+        self.speed_history = SpeedHistory()
+        # ProcessLimits per job class, and the CPU cores of the current batch worker
+        self.limits = limits if limits is not None else parse_limits(None)
+        self.core_pool = None
+        # Per worker thread: its CPU cores, batch job and output cache entry
+        self.worker = threading.local()
+        # Redraw one status line in place on a terminal, print log lines otherwise
+        self.live_progress = sys.stdout.isatty()
+        self.batch_meter = None
 
-    def check_ffmpeg(self):
-        """Check if ffmpeg is available"""
-        try:
-            subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
-        except (subprocess.CalledProcessError, FileNotFoundError):
+    def check_ffmpeg(self, refresh=False):
+        """Check if ffmpeg is available and note what it can do"""
+        self.capabilities = get_capabilities(refresh=refresh)
+        if self.capabilities is None:
             print("Error: FFmpeg is not installed or not in PATH.")
             print("Please install FFmpeg first. See INSTALLATION_AND_USAGE.md for instructions.")
             sys.exit(1)
 
-    def get_video_info(self, input_file):
-        """Get video information using ffprobe"""
+    def get_video_info(self, input_file, settings=None):
+        """Show video information, from the probe cache when the file is unchanged
+
+        settings (copy_streams, encoder, preset, crf) adds the encode time
+        and output size the speed history predicts for them.
+        """
+        info = probe_media(input_file, self.probe_cache)
+        if info is None:
+            print(f"Warning: Could not retrieve video information for {input_file}")
+            return
+        print(f"Video information for {input_file}:")
+
+        duration = info.get('duration')
+        if duration is not None:
+            print(f"  Duration: {duration:.2f} seconds ({duration/60:.2f} minutes)")
+        else:
+            print("  Duration: Unknown")
+        if info.get('width') and info.get('height'):
+            print(f"  Resolution: {info['width']}x{info['height']}")
+        for codec_type, codec_name in info.get('streams', []):
+            print(f"  Stream: {codec_type} ({codec_name or 'unknown'})")
+
+        file_size = os.path.getsize(input_file) / (1024 * 1024 * 1024)  # GB
+        print(f"  File size: {file_size:.2f} GB")
+
+        if settings is not None:
+            prediction = self.predict_conversion(info, duration, **settings)
+            if prediction:
+                print(f"  Predicted: {self.describe_prediction(prediction)}")
+            else:
+                print("  Predicted: no earlier runs with these settings on this machine")
+
+    def predict_conversion(self, info, duration, copy_streams=False, encoder=DEFAULT_ENCODER, preset='medium',
+                           crf=None):
+        """Encode time and output size predicted from the speed history, or None"""
+        if crf is None:
+            crf = default_crf(encoder)
+        key = profile_key(info, encoder, preset, crf, copy_streams)
+        return self.speed_history.predict(key, duration)
+
+    def describe_prediction(self, prediction):
+        return (f"{format_duration(prediction['seconds'])} at {prediction['speed']:.2f}x, "
+                f"{prediction['bytes'] / (1024 * 1024):.0f} MB "
+                f"(median of {prediction['samples']} earlier run{'s' if prediction['samples'] > 1 else ''})")
+
+    def show_keyframe_index(self, input_file, rebuild=False):
+        """Build or load the keyframe index of a file and summarise it"""
         try:
-            cmd = [
-                'ffprobe', '-v', 'quiet', '-print_format', 'json',
-                '-show_format', '-show_streams', input_file
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            print(f"Video information for {input_file}:")
+            index, path = get_index(input_file, rebuild=rebuild)
+        except (OSError, ValueError) as e:
+            print(f"Error: Could not index {input_file}: {e}")
+            return False
 
-            # Extract basic info using ffprobe
-            cmd_simple = ['ffprobe', '-v', 'quiet', '-show_entries', 
-                         'format=duration,size,bit_rate', '-of', 'csv=p=0', input_file]
-            result_simple = subprocess.run(cmd_simple, capture_output=True, text=True, check=True)
+        print(f"Keyframe index for {input_file}:")
+        print(f"  Keyframes: {len(index)}")
+        if len(index) > 1:
+            span = index.seconds(len(index) - 1)
+            print(f"  Last keyframe: {span:.2f} seconds")
+            print(f"  Average GOP: {span / (len(index) - 1):.2f} seconds")
+        print(f"  Saved to: {path}" if path else "  Not saved (no writable index location)")
+        return True
 
-            duration_cmd = ['ffprobe', '-v', 'quiet', '-show_entries', 'format=duration',
-                           '-of', 'default=noprint_wrappers=1:nokey=1', input_file]
-            duration_result = subprocess.run(duration_cmd, capture_output=True, text=True, check=True)
+    def check_integrity(self, input_file, verbose=False):
+        """Scan a transport stream for damage and print a summary, return the report or None"""
+        try:
+            report = scan_file(input_file)
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not scan {input_file}: {e}")
+            return None
 
-            try:
-                duration = float(duration_result.stdout.strip())
-                print(f"  Duration: {duration:.2f} seconds ({duration/60:.2f} minutes)")
-            except ValueError:
-                print("  Duration: Unknown")
+        if not report.damaged:
+            print(f"Integrity: {report.packet_count} packets, no damage found")
+            return report
+        print(f"Integrity: {len(report.ranges)} damaged range(s), "
+              f"{report.damaged_bytes / (1024 * 1024):.2f} MB ({report.damaged_fraction:.2%} of the file)")
+        ranges = report.ranges if verbose else report.ranges[:5]
+        for damaged in ranges:
+            print(f"  {damaged.describe()}")
+        if len(ranges) < len(report.ranges):
+            print(f"  ... and {len(report.ranges) - len(ranges)} more")
+        return report
 
-            file_size = os.path.getsize(input_file) / (1024 * 1024 * 1024)  # GB
-            print(f"  File size: {file_size:.2f} GB")
+    def convert_file(self, input_file, output_file, crf=None, preset='medium', copy_streams=False, verbose=False,
+                     source=None, extras=None, ladder=None, analyze=False, preflight=None, start=None, end=None,
+                     attempts=None, encoder=DEFAULT_ENCODER, tune=None, threads=None, replace_live=False,
+                     job_class=None, target_quality=None, hls=None):
+        """Convert MTS to MP4, reading from source (e.g. an archive member) when given
 
-        except subprocess.CalledProcessError:
-            print(f"Warning: Could not retrieve video information for {input_file}")
+        preflight ('repair' or 'skip') scans the input for damage first and
+        either decodes it with error-tolerant options or skips it. start and
+        end (seconds) trim the output, by smart cut where possible. Every
+        ffmpeg attempt, including automatic retries, is appended to attempts.
+        encoder names one of the ENCODERS backends, crf defaults to its own
+        default quality. replace_live keeps an existing output (the preview
+        tier) in place until the new file is complete. job_class picks the
+        resource limits ffmpeg runs under, by default copy or encode.
+        target_quality, a (metric, value) pair, replaces crf with the highest
+        CRF that meets it on sampled windows of the input. hls ('ts' or
+        'fmp4') packages the input as HLS into the directory output_file,
+        with a variant per ladder rung. Single MP4 outputs of seekable files
+        go through the output cache when one is configured.
+        """
+        if crf is None:
+            crf = default_crf(encoder)
+        if (self.output_cache is not None and getattr(self.worker, 'cache_entry', None) is None
+                and not (extras or ladder or hls or source) and '-' not in (input_file, output_file)):
+            settings = cache_settings(copy_streams, encoder, crf, preset, tune, analyze, preflight, start, end,
+                                      target_quality)
+            return self.convert_cached(input_file, output_file, settings, lambda: self.convert_file(
+                input_file, output_file, crf, preset, copy_streams, verbose, source, extras, ladder, analyze,
+                preflight, start, end, attempts, encoder, tune, threads, replace_live, job_class,
+                target_quality, hls))
+        if job_class is None:
+            job_class = 'copy' if copy_streams else 'encode'
+        input_args = []
+        resilient = False
+        if preflight and input_file != '-' and source is None:
+            report = self.check_integrity(input_file, verbose)
+            if report is not None and report.damaged:
+                if preflight == 'skip' or report.damaged_fraction > MAX_DAMAGED_FRACTION:
+                    print(f"✗ Skipping damaged file: {input_file}")
+                    return False
+                print("Using error-tolerant decoding for damaged input")
+                input_args = RESILIENT_INPUT_ARGS
+                resilient = True
 
-    def parse_progress(self, line, total_duration):
-        """Parse ffmpeg output for progress"""
-        time_match = re.search(r'time=([0-9:.]+)', line)
-        if time_match and total_duration:
-            time_str = time_match.group(1)
-            try:
-                time_parts = time_str.split(':')
-                if len(time_parts) == 3:
-                    hours = float(time_parts[0])
-                    minutes = float(time_parts[1])
-                    seconds = float(time_parts[2])
-                    current_time = hours * 3600 + minutes * 60 + seconds
-                    progress = (current_time / total_duration) * 100
-                    return min(progress, 100)
-            except (ValueError, IndexError):
-                pass
-        return None
+        if target_quality and not copy_streams:
+            if input_file == '-' or source is not None:
+                print(f"Quality search needs a seekable file, using CRF {crf}")
+            else:
+                crf = self.target_crf(input_file, target_quality, encoder, preset, tune, threads, analyze,
+                                      verbose) or crf
 
-    def convert_file(self, input_file, output_file, crf=18, preset='medium', copy_streams=False, verbose=False):
-        """Convert MTS to MP4"""
-        print(f"Converting: {input_file}")
+        trimming = bool(start) or end is not None
+        if trimming:
+            # Copied GOPs cannot take filters or change codec, so only plain H.264 encodes of files are smart cut
+            if not (copy_streams or extras or ladder or analyze or source or hls or encoder != 'h264'
+                    or '-' in (input_file, output_file)):
+                result = self.smart_cut(input_file, output_file, start, end, crf, preset, verbose, input_args,
+                                        replace_live, job_class)
+                if result is not None:
+                    return result
+                print("Smart cut not possible for this input, trimming with a full re-encode")
+            input_args = [*input_args, *trim_input_args(start, end)]
+
+        if hls:
+            return self.convert_hls(input_file, output_file, hls, ladder, crf, preset, verbose, source, input_args,
+                                    encoder, tune, threads, job_class, start, end)
+        if ladder:
+            return self.convert_ladder(input_file, output_file, ladder, preset, verbose, source, input_args,
+                                       encoder, tune, threads, job_class)
+
+        print(f"Converting: {source.display_name if source else input_file}")
         print(f"Output: {output_file}")
 
-        # Get duration for progress tracking
-        total_duration = None
-        try:
-            cmd = ['ffprobe', '-v', 'quiet', '-show_entries', 'format=duration',
-                   '-of', 'default=noprint_wrappers=1:nokey=1', input_file]
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            total_duration = float(result.stdout.strip())
-        except (subprocess.CalledProcessError, ValueError):
-            pass
-
-        # Build command
-        if copy_streams:
-            cmd = [
-                'ffmpeg', '-i', input_file, '-c', 'copy', '-f', 'mp4',
-                '-movflags', '+faststart', '-y', output_file
-            ]
-            print("Using lossless copy mode...")
-        else:
+        # '-' streams MTS in on stdin and fragmented MP4 out on stdout
+        stream_input = input_file == '-' or source is not None
+        stream_output = output_file == '-'
+        if input_file == '-':
+            enlarge_pipe(sys.stdin.fileno())
+            if copy_streams and stream_output:
+                # Fragmented MP4 needs to know whether copied audio is ADTS AAC
+                source = PeekedInput(sys.stdin.buffer)
+        movflags = FRAGMENTED_MP4_FLAGS if stream_output else '+faststart'
+        input_arg = 'pipe:0' if stream_input else input_file
+
+        # Encode into scratch space and publish once finished
+        final_output = output_file
+        staged = self.stager is not None and not stream_output
+        if staged:
+            output_file = self.stager.stage_path(final_output)
+            if verbose:
+                print(f"Staging to: {output_file}")
+        elif replace_live and not stream_output:
+            output_file = live_replacement_path(final_output)
+
+        output_arg = 'pipe:1' if stream_output else output_file
+        if output_file == final_output and not stream_output:
+            unshare_output(output_file)
+
+        # Get duration for progress tracking, and the frame size for the encoder's tiling
+        info = None if stream_input else probe_media(input_file, self.probe_cache)
+        total_duration = output_duration(info['duration'] if info else None, start, end)
+        height = info.get('height') if info else None
+
+        # Extra outputs slow the encode down, so only plain conversions feed the speed history
+        history_key = None
+        prediction = None
+        if info and not extras and not stream_output:
+            history_key = profile_key(info, encoder, preset, crf, copy_streams)
+            prediction = self.speed_history.predict(history_key, total_duration)
+            if prediction:
+                print(f"Expected: {self.describe_prediction(prediction)}")
+
+        # Only runs with the machine to themselves feed the history: resource limits or
+        # parallel batch jobs would pull the medians down
+        record_history = (history_key is not None and not self.limits.get(job_class)
+                          and not (self.batch_meter and self.batch_meter.workers > 1))
+
+        # Sample the content to decide on deinterlacing, cropping and audio
+        video_filter = None
+        drop_audio = False
+        if analyze and not copy_streams and not stream_input:
+            print("Analyzing content...")
+            decisions = analyze_file(input_file, self.probe_cache)
+            if decisions:
+                video_filter = analysis_video_filter(decisions)
+                drop_audio = decisions['drop_audio']
+                print(f"Analysis: {'interlaced' if decisions['deinterlace'] else 'progressive'}, "
+                      f"crop {decisions['crop'] or 'none'}, "
+                      f"audio {'silent, dropped' if drop_audio else 'kept'}")
+        # Filters and dropped audio change the speed as well
+        record_history = record_history and not (video_filter or drop_audio)
+        audio_args = ['-an'] if drop_audio else ['-c:a', 'aac', '-b:a', '192k']
+        # Copied ADTS AAC needs its headers moved into the MP4 sample description, which
+        # the muxer only does by itself for non-fragmented files
+        audio_codecs = {codec for codec_type, codec in self.stream_layout(info, source) if codec_type == 'audio'}
+        copy_audio_args = ['-bsf:a', 'aac_adtstoasc'] if audio_codecs == {'aac'} else []
+
+        if extras and stream_output:
+            print("Extra outputs need an output file, skipping them")
+            extras = None
+
+        def build_command(strategy):
+            """ffmpeg command for one attempt, with the extras plan it writes"""
+            copy_video = strategy != 'transcode'
+            # Extra outputs are split off the same decode as the main encode
+            extras_plan = None
+            graph_args = ['-vf', video_filter] if video_filter and not copy_video else []
+            if extras:
+                extras_plan = plan_extras(final_output, extras, total_duration, copy_video, video_filter)
+                graph_args = ['-filter_complex', extras_plan.filtergraph,
+                              '-map', extras_plan.main_label or '0:v:0']
+                if not drop_audio:
+                    graph_args += ['-map', '0:a:0?']
+
+            if strategy == 'copy':
+                codec_args = ['-c', 'copy', *copy_audio_args]
+                print("Using lossless copy mode...")
+            elif strategy == 'copy-video':
+                codec_args = ['-c:v', 'copy', *audio_args]
+                print("Copying video and re-encoding audio...")
+            else:
+                codec_args = [*encoder_args(encoder, crf, preset, threads, tune, height), *audio_args]
+                print(f"Using re-encoding mode: {describe_encoder(encoder, crf, preset, tune)}")
+
             cmd = [
-                'ffmpeg', '-i', input_file,
-                '-c:v', 'libx264', '-crf', str(crf), '-preset', preset,
-                '-c:a', 'aac', '-b:a', '192k',
-                '-movflags', '+faststart', '-y', output_file
+                'ffmpeg', *input_args, '-i', input_arg, *graph_args, *codec_args,
+                '-f', 'mp4', '-movflags', movflags, '-y', output_arg
             ]
-            print(f"Using re-encoding mode: CRF {crf}, preset {preset}")
+            if extras_plan:
+                cmd += extras_plan.output_args
+                print(f"Also writing: {', '.join(extras)}")
+            return cmd
 
-        if verbose:
-            print(f"Command: {' '.join(cmd)}")
+        # Failed copies fall back to cheaper strategies than a full transcode; stdin can only
+        # be read once, and stdout only takes a retry while the failed attempt's output is held back
+        strategy = 'copy' if copy_streams else 'transcode'
+        can_retry = input_file != '-'
+        if attempts is None:
+            attempts = []
 
         try:
-            print("Starting conversion...")
-            process = subprocess.Popen(
-                cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                text=True, universal_newlines=True
-            )
+            while True:
+                cmd = build_command(strategy)
+                if verbose:
+                    print(f"Command: {' '.join(cmd)}")
 
-            last_progress = 0
-            for line in iter(process.stdout.readline, ''):
-                line = line.strip()
-                if verbose and line:
-                    print(f"FFmpeg: {line}")
-
-                # Show progress
-                if total_duration:
-                    progress = self.parse_progress(line, total_duration)
-                    if progress is not None and progress - last_progress >= 5:  # Update every 5%
-                        print(f"Progress: {progress:.1f}%")
-                        last_progress = progress
+                print("Starting conversion...")
+                log_tail = deque(maxlen=LOG_TAIL_LINES)
+                started = time.monotonic()
+                held_output = HeldOutput(sys.__stdout__.fileno()) if stream_output and can_retry else None
+                returncode = self.run_ffmpeg(cmd, total_duration, verbose, source, stream_output, log_tail,
+                                             job_class, prediction['speed'] if prediction else None,
+                                             held_output)
+                elapsed = time.monotonic() - started
+                failure = None if returncode == 0 else classify_failure(log_tail)
+                attempts.append({'strategy': strategy, 'resilient': resilient,
+                                 'returncode': returncode, 'failure': failure})
+                if returncode == 0:
+                    break
 
-            process.wait()
+                print(f"✗ Conversion failed with return code: {returncode} ({failure})")
+                if not verbose:
+                    for line in list(log_tail)[-3:]:
+                        print(f"  {line}")
+                retry = None
+                if can_retry and not (held_output and held_output.released):
+                    retry = plan_retry(strategy, failure, resilient)
+                if retry is None:
+                    break
+                if retry[1] and not resilient:
+                    input_args = [*RESILIENT_INPUT_ARGS, *input_args]
+                strategy, resilient = retry
+                print(f"Retrying: {strategy}{' with error-tolerant decoding' if resilient else ''}")
 
-            if process.returncode == 0:
+            if returncode == 0:
                 print("✓ Conversion completed successfully!")
+                if len(attempts) > 1:
+                    print(f"Recovered after retrying: {describe_attempts(attempts)}")
 
                 # Show output file info
-                if os.path.exists(output_file):
+                if os.path.isfile(output_file):
                     output_size = os.path.getsize(output_file) / (1024 * 1024)  # MB
                     print(f"Output file size: {output_size:.2f} MB")
 
-                    if not copy_streams:
-                        input_size = os.path.getsize(input_file) / (1024 * 1024)  # MB
+                    if strategy != 'copy' and input_file != '-':
+                        input_bytes = source.size if source else os.path.getsize(input_file)
+                        input_size = input_bytes / (1024 * 1024)  # MB
                         compression_ratio = ((input_size - output_size) / input_size) * 100
                         print(f"Size reduction: {compression_ratio:.1f}%")
 
+                    # A fallback strategy ran with other settings than the profile describes
+                    if record_history and strategy == ('copy' if copy_streams else 'transcode'):
+                        self.speed_history.record(history_key, total_duration, elapsed,
+                                                  os.path.getsize(output_file))
+
+                if extras:
+                    for path in existing_extra_outputs(final_output, extras):
+                        print(f"Extra output: {path}")
+
+                self.settle_output(output_file, final_output, True)
                 return True
             else:
-                print(f"✗ Conversion failed with return code: {process.returncode}")
+                self.settle_output(output_file, final_output, False)
                 return False
 
         except KeyboardInterrupt:
             print("\n✗ Conversion cancelled by user")
-            process.terminate()
+            self.settle_output(output_file, final_output, False)
             return False
         except Exception as e:
             print(f"✗ Error during conversion: {e}")
+            self.settle_output(output_file, final_output, False)
             return False
 
-    def batch_convert(self, input_dir, output_dir=None, **kwargs):
-        """Convert all MTS files in a directory"""
+    def convert_cached(self, input_file, output_file, settings, convert):
+        """Deliver output_file from the output cache, or run convert() and cache its output
+
+        Waits while another process converts the same source with the same
+        settings, then takes its result.
+        """
+        try:
+            digest = source_digest(input_file, self.probe_cache)
+        except OSError as e:
+            print(f"Warning: Could not hash {input_file} for the output cache: {e}")
+            return convert()
+        key = cache_key(digest, settings)
+        with ExitStack() as stack:
+            try:
+                entry = stack.enter_context(self.output_cache.claim(
+                    key, {'source': os.path.basename(input_file), 'settings': settings},
+                    lambda: print("Waiting for another conversion of the same source and settings...")))
+            except OSError as e:
+                print(f"Warning: Output cache unavailable: {e}")
+                return convert()
+
+            method = entry.deliver(output_file)
+            if method:
+                print(f"✓ Output cache hit: {method} of {entry.path}")
+                print(f"Output: {output_file}")
+                return True
+            self.worker.cache_entry = entry
+            try:
+                return convert()
+            finally:
+                self.worker.cache_entry = None
+
+    def target_crf(self, input_file, target, encoder=DEFAULT_ENCODER, preset='medium', tune=None, threads=None,
+                   analyze=False, verbose=False):
+        """Highest CRF meeting a (metric, value) target on sampled windows, None if the search fails"""
+        media = probe_media(input_file, self.probe_cache)
+        if media is None:
+            print("✗ Could not probe the input for the quality search")
+            return None
+        video_filter = None
+        if analyze:
+            # Sample encodes go through the same deinterlacing and cropping as the real one
+            decisions = analyze_file(input_file, self.probe_cache)
+            video_filter = analysis_video_filter(decisions) if decisions else None
+
+        metric, value = target
+        print(f"Searching for the highest CRF with {metric} >= {value:g}...")
+        started = time.monotonic()
+        result = find_target_crf(input_file, media, target, encoder, preset, tune, threads, video_filter,
+                                 self.probe_cache, print if verbose else None)
+        if result is None:
+            print("✗ Quality search failed, keeping the configured CRF")
+            return None
+        how = ('cached' if result.get('cached') else
+               f"{result['tested']} candidates in {time.monotonic() - started:.1f}s")
+        print(f"Target quality: CRF {result['crf']} ({metric} {result['score']:.4g}, {how})")
+        return result['crf']
+
+    def settle_output(self, output_file, final_output, success):
+        """Publish or discard an encode written away from its final path, caching a finished one"""
+        entry = getattr(self.worker, 'cache_entry', None)
+        if success and entry is not None and os.path.isfile(output_file):
+            if entry.store(output_file):
+                print("Added to the output cache")
+        if output_file == final_output:
+            return
+        if not success:
+            try:
+                os.remove(output_file)
+            except OSError:
+                pass
+        elif self.stager:
+            self.stager.publish(output_file, final_output)
+        else:
+            # Replaces a live preview in one rename
+            os.replace(output_file, final_output)
+
+    def convert_ladder(self, input_file, output_file, rungs, preset='medium', verbose=False, source=None,
+                       input_args=(), encoder=DEFAULT_ENCODER, tune=None, threads=None, job_class='encode'):
+        """Encode several resolutions of one input from a single decode"""
+        print(f"Converting: {source.display_name if source else input_file}")
+        stream_input = input_file == '-' or source is not None
+        if input_file == '-':
+            enlarge_pipe(sys.stdin.fileno())
+
+        final_outputs = [rung_output_path(output_file, rung) for rung in rungs]
+        if self.stager:
+            outputs = [self.stager.stage_path(path) for path in final_outputs]
+        else:
+            outputs = final_outputs
+        for rung, path in zip(rungs, final_outputs):
+            print(f"Output ({rung['name']}, CRF {rung['crf']}): {path}")
+
+        total_duration = None if stream_input else self.get_duration(input_file)
+        cmd = [
+            'ffmpeg', *input_args, '-i', 'pipe:0' if stream_input else input_file,
+            '-filter_complex', ladder_filtergraph(rungs), '-y',
+            *ladder_output_args(rungs, outputs, preset, encoder, threads, tune)
+        ]
+        print(f"Using rendition ladder: {', '.join(rung['name'] for rung in rungs)}, "
+              f"{ENCODERS[encoder]['label']}, preset {preset}")
+        if verbose:
+            print(f"Command: {' '.join(cmd)}")
+
+        try:
+            print("Starting conversion...")
+            returncode = self.run_ffmpeg(cmd, total_duration, verbose, source, job_class=job_class)
+        except KeyboardInterrupt:
+            print("\n✗ Conversion cancelled by user")
+            returncode = None
+        except Exception as e:
+            print(f"✗ Error during conversion: {e}")
+            returncode = None
+
+        if returncode != 0:
+            if returncode is not None:
+                print(f"✗ Conversion failed with return code: {returncode}")
+            if self.stager:
+                for path in outputs:
+                    self.stager.discard(path)
+            return False
+
+        print("✓ Conversion completed successfully!")
+        for rung, path, final_path in zip(rungs, outputs, final_outputs):
+            if os.path.isfile(path):
+                size = os.path.getsize(path) / (1024 * 1024)  # MB
+                print(f"  {rung['name']:>6}: {size:10.2f} MB  {final_path}")
+            if self.stager:
+                self.stager.publish(path, final_path)
+        return True
+
+    def convert_hls(self, input_file, output_dir, hls_format='ts', rungs=None, crf=18, preset='medium',
+                    verbose=False, source=None, input_args=(), encoder=DEFAULT_ENCODER, tune=None, threads=None,
+                    job_class=None, start=None, end=None):
+        """Package a file as HLS in one pass, stream copying H.264 video into the top variant
+
+        input_args already trim the input to start and end, which only set
+        the expected duration here.
+        """
+        print(f"Converting: {source.display_name if source else input_file}")
+        stream_input = input_file == '-' or source is not None
+        if input_file == '-':
+            enlarge_pipe(sys.stdin.fileno())
+
+        with ExitStack() as opened:
+            # Piped input and compressed archive members are peeked to find out which audio they carry
+            if input_file == '-':
+                source = PeekedInput(sys.stdin.buffer)
+            elif source is not None and peek_head(source) is None:
+                source = PeekedInput(opened.enter_context(source.open()), display_name=source.display_name)
+            media = None if stream_input else probe_media(input_file, self.probe_cache)
+            sps = None if stream_input else read_sps(input_file)
+            variants = plan_variants(media, sps, rungs, crf)
+            layout = self.stream_layout(media, source)
+            # A stream too damaged to read the layout from most likely carries AVCHD's AC-3
+            audio = [name for codec_type, name in layout if codec_type == 'audio'] if layout else ['ac3']
+            if job_class is None:
+                job_class = 'copy' if all(variant['copy'] for variant in variants) else 'encode'
+
+            # Write next to the destination and rename into place once every playlist is complete
+            parent, name = os.path.split(os.path.abspath(output_dir))
+            work_dir = os.path.join(parent, f".{name}.{os.getpid()}.tmp")
+            shutil.rmtree(work_dir, ignore_errors=True)
+            os.makedirs(work_dir)
+            cmd = [
+                'ffmpeg', *input_args, '-i', 'pipe:0' if stream_input else input_file, '-y',
+                *hls_output_args(variants, work_dir, hls_format, bool(audio), audio[:1] == ['aac'], preset,
+                                 encoder, threads, tune)
+            ]
+            print(f"Output: {os.path.join(output_dir, MASTER_PLAYLIST)}")
+            described = [f"{variant['name']} (copy)" if variant['copy']
+                         else f"{variant['name']} (CRF {variant['crf']})" for variant in variants]
+            print(f"Packaging HLS ({hls_format}): {', '.join(described)}")
+            if verbose:
+                print(f"Command: {' '.join(cmd)}")
+
+            try:
+                print("Starting conversion...")
+                total_duration = output_duration(media['duration'] if media else None, start, end)
+                returncode = self.run_ffmpeg(cmd, total_duration, verbose, source, job_class=job_class)
+                if returncode == 0:
+                    finish_master_playlist(work_dir, variants, bool(audio))
+                    # Move an older package aside rather than deleting it first, so an
+                    # interruption never leaves the destination without either one
+                    old_dir = os.path.join(parent, f".{name}.{os.getpid()}.old")
+                    shutil.rmtree(old_dir, ignore_errors=True)
+                    if os.path.isdir(output_dir):
+                        os.replace(output_dir, old_dir)
+                    os.replace(work_dir, output_dir)
+                    shutil.rmtree(old_dir, ignore_errors=True)
+            except KeyboardInterrupt:
+                print("\n✗ Conversion cancelled by user")
+                returncode = None
+            except Exception as e:
+                print(f"✗ Error during conversion: {e}")
+                returncode = None
+        if returncode != 0:
+            if returncode is not None:
+                print(f"✗ Conversion failed with return code: {returncode}")
+            shutil.rmtree(work_dir, ignore_errors=True)
+            return False
+
+        print("✓ Conversion completed successfully!")
+        for variant in variants:
+            playlist = os.path.join(output_dir, variant['name'], VARIANT_PLAYLIST)
+            peak, average = measure_variant(playlist)
+            print(f"  {variant['name']:>8}: {average / 1000000:6.2f} Mbit/s average, "
+                  f"{peak / 1000000:6.2f} Mbit/s peak")
+        return True
+
+    def smart_cut(self, input_file, output_file, start, end, crf=18, preset='medium', verbose=False,
+                  input_args=(), replace_live=False, job_class='encode'):
+        """Trim by re-encoding only the partial GOPs at the cut points and copying the rest
+
+        Returns None when the input cannot be smart cut, so the caller can
+        fall back to a full re-encode.
+        """
+        media = native_probe(input_file)
+        sps = read_sps(input_file)
+        if media is None or sps is None:
+            return None
+        try:
+            index, _ = get_index(input_file)
+            with TransportStream.open(input_file) as ts:
+                prefix = ts.psi_packets(4 * 1024 * 1024)
+            # Cut times count from the file start, the index from the first keyframe
+            offset = keyframe_offset(index, media['start_time'])
+            start = max(0.0, (start or 0.0) - offset)
+            end = None if end is None else max(0.0, end - offset)
+            pieces = plan_cut(index, start, end)
+        except ValueError as e:
+            if verbose:
+                print(f"Smart cut: {e}")
+            return None
+        if prefix is None:
+            return None
+        size = os.path.getsize(input_file)
+        has_audio = any(codec_type == 'audio' for codec_type, _ in media['streams'])
+
+        print(f"Converting: {input_file}")
+        print(f"Output: {output_file}")
+        print(f"Using smart cut: {len(pieces)} piece(s), "
+              f"{sum(1 for piece in pieces if piece['mode'] == 'copy')} stream-copied")
+
+        final_output = output_file
+        if self.stager:
+            output_file = self.stager.stage_path(final_output)
+        elif replace_live:
+            output_file = live_replacement_path(final_output)
+        work_parent = self.stager.scratch_dir if self.stager else (os.path.dirname(final_output) or '.')
+        work_dir = tempfile.mkdtemp(prefix='.smartcut-', dir=work_parent)
+        success = False
+        try:
+            paths = []
+            for i, piece in enumerate(pieces):
+                path = os.path.join(work_dir, f"piece_{i:02d}.ts")
+                paths.append(path)
+                piece_source = piece_slice(input_file, index, piece['first'], piece['stop'], prefix, size)
+                cmd = ['ffmpeg', *input_args, '-i', 'pipe:0', '-map', '0:v:0']
+                if piece['mode'] == 'copy':
+                    cmd += ['-c', 'copy']
+                else:
+                    trim_start, trim_end = piece['trim']
+                    trim = f"trim=start={trim_start:.6f}" + (f":end={trim_end:.6f}" if trim_end is not None else '')
+                    cmd += ['-vf', f"setpts=PTS-STARTPTS,{trim},setpts=PTS-STARTPTS",
+                            *matching_encoder_args(sps, crf, preset)]
+                cmd += ['-an', '-f', 'mpegts', '-y', path]
+                if verbose:
+                    print(f"Command: {' '.join(cmd)}")
+                if self.run_ffmpeg(cmd, None, verbose, piece_source, job_class=job_class) != 0:
+                    print(f"✗ Smart cut failed on piece {i + 1} ({piece['mode']})")
+                    return False
+
+            # A cut less than a frame from a keyframe leaves an empty piece to drop
+            joined = [(path, piece) for path, piece in zip(paths, pieces) if os.path.getsize(path)]
+            paths = [path for path, _ in joined]
+            # Encoded pieces end on a frame boundary, so use their real length for the joins
+            durations = [measure_duration(path) or piece['duration'] for path, piece in joined]
+            with open(os.path.join(work_dir, 'pieces.txt'), 'w', encoding='utf-8') as f:
+                f.write(concat_list(paths, durations))
+
+            cmd = ['ffmpeg', '-f', 'concat', '-safe', '0', '-i', os.path.join(work_dir, 'pieces.txt')]
+            if has_audio:
+                # Audio is re-encoded once across the whole range, so it has no seams
+                first, stop, audio_start, audio_end = audio_window(index, pieces, start, end)
+                audio_source = piece_slice(input_file, index, first, stop, prefix, size)
+                atrim = f"atrim=start={audio_start:.6f}" + (f":end={audio_end:.6f}" if audio_end is not None else '')
+                audio_path = os.path.join(work_dir, 'audio.m4a')
+                audio_cmd = ['ffmpeg', *input_args, '-copyts', '-i', 'pipe:0', '-map', '0:a:0',
+                             '-af', f"{atrim},asetpts=PTS-STARTPTS", '-c:a', 'aac', '-b:a', '192k',
+                             '-y', audio_path]
+                if self.run_ffmpeg(audio_cmd, None, verbose, audio_source, job_class=job_class) != 0:
+                    print("✗ Smart cut failed on the audio")
+                    return False
+                cmd += ['-i', audio_path, '-map', '0:v:0', '-map', '1:a:0']
+            cmd += ['-c', 'copy', '-f', 'mp4', '-movflags', '+faststart', '-y', output_file]
+            if output_file == final_output:
+                unshare_output(output_file)
+            if verbose:
+                print(f"Command: {' '.join(cmd)}")
+            if self.run_ffmpeg(cmd, None, verbose, job_class=job_class) != 0:
+                print("✗ Smart cut failed joining the pieces")
+                return False
+            success = True
+        except KeyboardInterrupt:
+            print("\n✗ Conversion cancelled by user")
+            return False
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            if not success:
+                self.settle_output(output_file, final_output, False)
+
+        print("✓ Conversion completed successfully!")
+        if os.path.isfile(output_file):
+            print(f"Output file size: {os.path.getsize(output_file) / (1024 * 1024):.2f} MB")
+        self.settle_output(output_file, final_output, True)
+        return True
+
+    def publish_preview(self, input_file, output_file, verbose=False, start=None, end=None):
+        """Publish the preview tier of a two-tier conversion at output_file
+
+        Tries a remux first and a small ultrafast encode last. Returns the
+        description of the preview that went live, or None.
+        """
+        print(f"Publishing preview: {input_file}")
+        temp_file = live_replacement_path(output_file)
+        total_duration = self.get_duration(input_file)
+        if total_duration and (start or end is not None):
+            total_duration = min(filter(None, (end, total_duration))) - (start or 0)
+        try:
+            for description, cmd in preview_attempts(input_file, temp_file, trim_input_args(start, end)):
+                if verbose:
+                    print(f"Command: {' '.join(cmd)}")
+                if self.run_ffmpeg(cmd, total_duration, verbose, job_class='preview') == 0:
+                    os.replace(temp_file, output_file)
+                    print(f"Live tier: preview ({description}) at {output_file}")
+                    return description
+                print(f"✗ Preview {description} failed")
+        except KeyboardInterrupt:
+            print("\n✗ Preview cancelled by user")
+        finally:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+        return None
+
+    def final_tier(self, input_file, output_file, **kwargs):
+        """Run the high-quality encode of a two-tier conversion over its preview"""
+        print("Starting high-quality encode at background priority...")
+        success = self.convert_file(input_file, output_file, replace_live=True, job_class='background', **kwargs)
+        if success:
+            print(f"Live tier: final{' (once published)' if self.stager else ''} at {output_file}")
+        elif os.path.exists(output_file):
+            print("✗ High-quality encode failed, the preview stays live")
+        return success
+
+    def stream_layout(self, info, source=None):
+        """[codec type, codec name] pairs of the input, from its probe or from the head of a streamed source"""
+        if info:
+            return info.get('streams', [])
+        prefix = peek_head(source) if source is not None else None
+        if not prefix:
+            return []
+        try:
+            _, streams = TransportStream(prefix).streams()
+        except (TransportStreamError, IndexError):
+            return []
+        return [[stream['codec_type'], stream['codec_name']] for stream in streams]
+
+    def get_duration(self, input_file):
+        """Get the duration of a file in seconds, probing natively before trying ffprobe"""
+        info = probe_media(input_file, self.probe_cache)
+        return info['duration'] if info else None
+
+    def run_ffmpeg(self, cmd, total_duration=None, verbose=False, source=None, stream_output=False,
+                   log_tail=None, job_class=None, expected_speed=None, held_output=None):
+        """Run an ffmpeg command while printing progress, return its exit code
+
+        log_tail (e.g. a bounded deque) collects ffmpeg's messages for
+        classifying a failure. ffmpeg runs under the limits of job_class and
+        on the CPU cores of the current batch worker. expected_speed gives
+        an ETA before the first speed measurements arrive. held_output, a
+        HeldOutput, relays streamed output and is released on success.
+        """
+        stdin = subprocess.PIPE if source else None
+        limits = self.limits.get(job_class)
+        if limits:
+            cmd = limits.wrap_command(cmd)
+        # preexec_fn is not safe with the batch's worker threads running, so wrapper commands apply these
+        cmd = pin_command(cmd, getattr(self.worker, 'cores', None))
+        if stream_output:
+            # MP4 data goes straight to our stdout, progress comes on stderr
+            process = subprocess.Popen(
+                cmd, stdin=stdin, stdout=subprocess.PIPE if held_output else None, stderr=subprocess.PIPE,
+                text=True, universal_newlines=True
+            )
+            progress_stream = process.stderr
+        else:
+            process = subprocess.Popen(
+                cmd, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                text=True, universal_newlines=True
+            )
+            progress_stream = process.stdout
+
+        relay = None
+        try:
+            if source:
+                self.start_feeder(source, process)
+            if held_output:
+                relay = threading.Thread(target=held_output.relay, args=(process.stdout,), daemon=True)
+                relay.start()
+
+            meter = ThroughputMeter(total_duration, expected_speed)
+            batch_job = getattr(self.worker, 'batch_job', None)
+            live = self.live_progress and not verbose
+            last_logged = (0.0, meter.started)
+            for line in iter(progress_stream.readline, ''):
+                line = line.strip()
+                if verbose and line:
+                    print(f"FFmpeg: {line}")
+                if log_tail is not None and line and not line.startswith(('frame=', 'size=')):
+                    log_tail.append(line)
+
+                stats = parse_stats(line)
+                if stats is None:
+                    continue
+                meter.update(stats)
+                if batch_job is not None and meter.fraction is not None:
+                    self.batch_meter.progress(batch_job, meter.fraction)
+
+                # Show progress, redrawn at most every RENDER_INTERVAL on a terminal,
+                # otherwise logged every 5% or PROGRESS_LOG_INTERVAL seconds
+                if live:
+                    if meter.due():
+                        self.show_progress(meter, batch_job, live)
+                elif ((meter.fraction or 0) - last_logged[0] >= 0.05
+                        or meter.clock() - last_logged[1] >= PROGRESS_LOG_INTERVAL):
+                    self.show_progress(meter, batch_job, live)
+                    last_logged = (meter.fraction or 0, meter.clock())
+            if live and meter.last_render is not None:
+                self.show_progress(meter, batch_job, live)
+                print()
+
+            process.wait()
+            if relay:
+                relay.join()
+                if process.returncode == 0:
+                    held_output.release()
+        except KeyboardInterrupt:
+            process.terminate()
+            raise
+        return process.returncode
+
+    def show_progress(self, meter, batch_job=None, live=False):
+        """Print the throughput of the current ffmpeg run and of the batch"""
+        text = meter.describe()
+        if batch_job is not None:
+            text = f"[{batch_job.index}] {text} | {self.batch_meter.describe()}"
+        if live:
+            # Overwrite the previous status line
+            print(f"\r{text}\033[K", end='', flush=True)
+        else:
+            print(f"Progress: {text}")
+
+    def start_feeder(self, source, process):
+        """Stream source into ffmpeg's stdin from a background thread"""
+        stdin_fd = process.stdin.fileno()
+        enlarge_pipe(stdin_fd)
+
+        def feed():
+            try:
+                feed_source(source, stdin_fd)
+            except OSError:
+                # ffmpeg stopped reading, its return code tells why
+                pass
+            finally:
+                process.stdin.close()
+
+        threading.Thread(target=feed, daemon=True).start()
+
+    def finish_publishing(self):
+        """Wait for staged outputs to reach their destination, return failed paths"""
+        if not self.stager:
+            return []
+        failed = []
+        for output_file, staged_file, error in self.stager.wait():
+            print(f"✗ Could not publish {output_file}: {error}")
+            if os.path.exists(staged_file):
+                print(f"  The finished file is kept in scratch space: {staged_file}")
+            failed.append(output_file)
+        return failed
+
+    def batch_convert(self, input_dir, output_dir=None, jobs=1, per_device=None, order='fifo', dedup=False,
+                      preview_first=False, pin_cores=False, **kwargs):
+        """Convert all MTS files below a directory or inside a tar/zip archive
+
+        preview_first publishes a preview of every file before any of the
+        high-quality encodes start. pin_cores gives each of the parallel
+        jobs its own set of CPU cores.
+        """
+        # tarfile and zipfile are only needed here, keep them out of startup
+        from mts_archive import archive_output_dir, is_archive, is_compressed_tar
+
+        if (jobs > 1 or order != 'fifo') and is_compressed_tar(input_dir):
+            # Its members can only be read front to back: one pass over the
+            # archive instead of decompressing it again up to every member
+            print("Compressed tar archive: converting members one at a time, in archive order")
+            jobs, order = 1, 'fifo'
+        if jobs > 1 and not kwargs.get('threads') and not kwargs.get('copy_streams'):
+            # Parallel encoders would otherwise each start a thread per core
+            kwargs['threads'] = max(1, (os.cpu_count() or 1) // jobs)
+        if pin_cores and jobs > 1:
+            self.core_pool = CorePool(jobs)
+        if jobs > 1:
+            # Parallel jobs would overwrite each other's status line
+            self.live_progress = False
+        self.batch_meter = BatchMeter(jobs)
+        read_ahead = ReadAhead(log=print if kwargs.get('verbose') else None)
+        predict = not (kwargs.get('ladder') or kwargs.get('extras') or kwargs.get('hls'))
+
         input_path = Path(input_dir)
-        if not input_path.exists() or not input_path.is_dir():
+        if is_archive(input_dir):
+            # Stream members straight out of the archive, keeping their paths
+            sources = self.archive_sources(input_dir)
+            default_output = archive_output_dir(input_path)
+        elif input_path.is_dir():
+            # Walk the tree lazily so conversion starts with the first file found
+            sources = self.directory_sources(input_dir)
+            default_output = input_path
+        else:
             print(f"Error: Input directory {input_dir} does not exist")
             return
 
-        # Find MTS files
-        mts_files = []
-        for ext in ['*.mts', '*.MTS', '*.m2ts', '*.M2TS']:
-            mts_files.extend(input_path.glob(ext))
+        print(f"Searching {input_dir} for MTS files...")
+
+        # Set output directory
+        output_path = Path(output_dir) if output_dir else default_output
+        output_path.mkdir(parents=True, exist_ok=True)
+
+        found = 0
+
+        def make_jobs():
+            nonlocal found
+            for input_file, source, relative_output in sources:
+                found += 1
+                output_file = output_path / relative_output
+                if kwargs.get('hls'):
+                    output_file = Path(hls_output_dir(output_file))
+                name = source.name if source else Path(input_file).name
+
+                # Skip if output already exists
+                if output_file.exists():
+                    response = input(f"Output file {output_file.name} already exists. Overwrite? (y/N): ")
+                    if response.lower() != 'y':
+                        print(f"Skipping {name}...")
+                        continue
+
+                output_file.parent.mkdir(parents=True, exist_ok=True)
+                write_dirs = [str(output_file.parent)]
+                if self.stager:
+                    write_dirs.append(self.stager.scratch_dir)
+                input_size = source.size if source else os.path.getsize(input_file)
+                # The scheduler pulls jobs a few ahead of the running ones, so
+                # upcoming files are probed while the current ones convert
+                info = probe_media(input_file, self.probe_cache) if source is None else None
+                prediction = None
+                if predict and info:
+                    duration = output_duration(info['duration'], kwargs.get('start'), kwargs.get('end'))
+                    prediction = self.predict_conversion(
+                        info, duration, kwargs.get('copy_streams', False),
+                        kwargs.get('encoder', DEFAULT_ENCODER), kwargs.get('preset', 'medium'),
+                        kwargs.get('crf'))
+                estimated = estimate_output_bytes(input_size, kwargs.get('copy_streams', False),
+                                                  prediction['bytes'] if prediction else None)
+                job = BatchJob(input_file, str(output_file), write_dirs, estimated, source)
+                job.prediction = prediction
+                job.media = info
+                self.batch_meter.add(job, input_size, prediction['seconds'] if prediction else None)
+                yield job
+            self.batch_meter.complete = True
 
-        if not mts_files:
+        def reading_ahead(jobs):
+            """Queue jobs for read-ahead as the scheduler pulls them, which is about the order they start"""
+            for job in jobs:
+                # Remuxing reads the source as fast as the disk allows, reading ahead would only compete with it
+                if job.source is None and not kwargs.get('copy_streams'):
+                    read_ahead.add(job.input_file)
+                yield job
+
+        def pinned(worker):
+            """Run worker(job) on a core set the worker thread holds until it finishes"""
+            def run(job):
+                if self.core_pool is None:
+                    return worker(job)
+                self.worker.cores = self.core_pool.acquire()
+                try:
+                    return worker(job)
+                finally:
+                    self.core_pool.release(self.worker.cores)
+                    self.worker.cores = None
+            return run
+
+        def run_job(job):
+            read_ahead.release(job.input_file)
+            print(f"\n[{job.index}] Processing {job.name}")
+            self.worker.batch_job = job
+            success = False
+            try:
+                if preview_first and job.tier:
+                    success = self.final_tier(job.input_file, job.output_file, attempts=job.attempts, **kwargs)
+                else:
+                    success = self.convert_file(job.input_file, job.output_file, source=job.source,
+                                                attempts=job.attempts, **kwargs)
+            finally:
+                self.worker.batch_job = None
+                self.batch_meter.finish(job, success)
+            if success:
+                job.tier = 'final'
+            if kwargs.get('extras'):
+                job.outputs += existing_extra_outputs(job.output_file, kwargs['extras'])
+            return success
+
+        def run_preview(job):
+            # Archive members cannot be seeked, they only get the final tier
+            if job.source is None:
+                read_ahead.release(job.input_file)
+                print(f"\n[{job.index}] Preview of {job.name}")
+                if self.publish_preview(job.input_file, job.output_file, kwargs.get('verbose', False),
+                                        kwargs.get('start'), kwargs.get('end')):
+                    job.tier = 'preview'
+            return True
+
+        def reject_job(job):
+            print(f"\n✗ Skipping {job.name}: {job.error}")
+            read_ahead.release(job.input_file)
+            self.batch_meter.finish(job, False)
+
+        # Convert, limiting concurrent jobs per source and destination device
+        scheduler = DeviceScheduler(max_jobs=jobs, per_device=per_device)
+        pending_jobs = make_jobs()
+        duplicates = {}
+        if dedup:
+            print("Checking for duplicate source files...")
+            pending_jobs, duplicates = self.split_duplicate_jobs(pending_jobs)
+            for copy in (copy for copies in duplicates.values() for copy in copies):
+                self.batch_meter.discard(copy)
+        if order != 'fifo':
+            print(f"Probing files to schedule {order}...")
+            pending_jobs = order_jobs(pending_jobs, order)
+        if preview_first:
+            # Every file gets its preview before the slow encodes take the disks and cores
+            pending_jobs = scheduler.run(reading_ahead(pending_jobs), pinned(run_preview), on_reject=reject_job)
+            print(f"\nPreviews live for {sum(1 for job in pending_jobs if job.tier)} file(s), "
+                  "starting high-quality encodes")
+            pending_jobs = [job for job in pending_jobs if job.result]
+        # Fed from the final order, after --dedup and --order have rearranged the jobs
+        batch = scheduler.run(reading_ahead(pending_jobs), pinned(run_job), on_reject=reject_job)
+        read_ahead.close()
+        successful = sum(1 for job in batch if job.result)
+
+        if not found:
             print(f"No MTS files found in {input_dir}")
             return
 
-        print(f"Found {len(mts_files)} MTS files")
+        if self.stager:
+            print("Waiting for staged files to be published...")
+            successful -= len(self.finish_publishing())
 
-        # Set output directory
-        if output_dir:
-            output_path = Path(output_dir)
-            output_path.mkdir(parents=True, exist_ok=True)
-        else:
-            output_path = input_path
+        # Give duplicates the output of the clip that was actually encoded
+        for job, copies in duplicates.items():
+            if not job.result:
+                continue
+            for copy in copies:
+                try:
+                    method = link_output(job.output_file, copy.output_file)
+                except OSError as e:
+                    print(f"✗ Could not create {copy.output_file}: {e}")
+                    continue
+                print(f"Duplicate {copy.name}: {method} of {job.output_file}")
+                successful += 1
 
-        # Convert each file
-        successful = 0
-        for i, input_file in enumerate(mts_files, 1):
-            print(f"\n[{i}/{len(mts_files)}] Processing {input_file.name}")
+        print(f"\nBatch conversion completed: {successful}/{found} files converted successfully")
 
-            output_file = output_path / f"{input_file.stem}.mp4"
+        retried = [job for job in batch if len(job.attempts) > 1]
+        if retried:
+            print("Retried jobs:")
+            for job in retried:
+                print(f"  {'✓' if job.result else '✗'} {job.name}: {describe_attempts(job.attempts)}")
+        if preview_first:
+            tiers = Counter(job.tier for job in batch if job.tier)
+            print("Live tiers: " + ', '.join(f"{count} {tier}" for tier, count in tiers.most_common()))
+            for job in batch:
+                if job.tier == 'preview':
+                    print(f"  preview only: {job.output_file}")
+        failures = Counter(job.attempts[-1]['failure'] for job in batch if not job.result and job.attempts)
+        if failures:
+            print("Failures by class: " + ', '.join(f"{name} {count}" for name, count in failures.most_common()))
 
-            # Skip if output already exists
-            if output_file.exists():
-                response = input(f"Output file {output_file.name} already exists. Overwrite? (y/N): ")
-                if response.lower() != 'y':
-                    print("Skipping...")
-                    continue
+    def split_duplicate_jobs(self, jobs):
+        """Split jobs into unique ones and {job: [jobs with identical sources]}"""
+        jobs = list(jobs)
+        by_path = {job.input_file: job for job in jobs if job.source is None}
+        duplicates = {}
+        skipped = set()
+        for original, copies in find_duplicates(list(by_path)).items():
+            duplicates[by_path[original]] = [by_path[path] for path in copies]
+            skipped.update(copies)
 
-            if self.convert_file(str(input_file), str(output_file), **kwargs):
-                successful += 1
+        if skipped:
+            print(f"{len(skipped)} duplicate files will be linked instead of converted")
+        return [job for job in jobs if job.input_file not in skipped or job.source], duplicates
+
+    def directory_sources(self, input_dir):
+        """Yield (input file, source, relative output) for MTS files below input_dir"""
+        for path in iter_mts_files(input_dir):
+            # Mirror the source tree under the output directory
+            relative = Path(os.path.relpath(path, input_dir))
+            yield path, None, relative.with_suffix('.mp4')
+
+    def archive_sources(self, archive_path):
+        """Yield (archive, member, relative output) for MTS members of an archive"""
+        from mts_archive import list_members, safe_member_path
 
-        print(f"\nBatch conversion completed: {successful}/{len(mts_files)} files converted successfully")
+        for member in list_members(archive_path):
+            relative = safe_member_path(member.name)
+            if relative:
+                yield archive_path, member, Path(relative).with_suffix('.mp4')
 
 def main():
     parser = argparse.ArgumentParser(
@@ -212,6 +1157,10 @@ Examples:
   # Convert with custom quality and preset
   python mts_converter_cli.py input.mts -o output.mp4 --crf 20 --preset slow
 
+  # HEVC or AV1 archive copies at a fraction of the size
+  python mts_converter_cli.py input.mts --encoder hevc --tune grain
+  python mts_converter_cli.py /path/to/mts/files --batch --encoder av1 --preset fast
+
   # Lossless conversion (copy streams)
   python mts_converter_cli.py input.mts --copy
 
@@ -220,46 +1169,233 @@ Examples:
 
   # Batch convert with output directory
   python mts_converter_cli.py /path/to/mts/files --batch -o /path/to/output
+
+  # 1080p, 720p and 480p from a single decode
+  python mts_converter_cli.py input.mts --ladder 1080,720:20,480:22
+
+  # Convert MTS files inside a tar or zip archive without extracting it
+  python mts_converter_cli.py camcorder-2019.tar --batch -o /path/to/output -j 2
+
+  # Use in a pipe: MTS on stdin, fragmented MP4 on stdout
+  decrypt-tool recording.mts | python mts_converter_cli.py - -o - > output.mp4
+
+  # Skip card-recovered files with corrupt regions instead of failing mid-batch
+  python mts_converter_cli.py /path/to/recovered --batch --preflight skip
+
+  # Frame-accurate 5 minute excerpt at close to remux speed
+  python mts_converter_cli.py input.mts -o excerpt.mp4 --start 1:02:10 --end 1:07:10
+
+  # Index keyframes for fast seeking and cutting later
+  python mts_converter_cli.py input.mts --index
+
+  # Reviewable remux in seconds, slow encode replaces it in the background
+  python mts_converter_cli.py /path/to/mts/files --batch --preset slow --preview-first
+
+  # Encode on local disk, publish to a network share in the background
+  python mts_converter_cli.py /path/to/mts/files --batch -o /mnt/share --scratch /tmp/mts
         """
     )
 
-    parser.add_argument('input', help='Input MTS file or directory (for batch mode)')
-    parser.add_argument('-o', '--output', help='Output file or directory')
-    parser.add_argument('--crf', type=int, default=18, 
-                       help='Quality factor (0-51, lower=better quality) [default: 18]')
-    parser.add_argument('--preset', default='medium',
-                       choices=['veryslow', 'slower', 'slow', 'medium', 'fast', 'faster', 'veryfast'],
+    parser.add_argument('input', nargs='?', help="Input MTS file or directory (for batch mode), '-' for stdin")
+    parser.add_argument('-o', '--output', help="Output file or directory, '-' for fragmented MP4 on stdout")
+    parser.add_argument('--crf', type=int,
+                       help='Quality factor (0-51, 0-63 for av1, lower=better quality) '
+                            '[default: 18 h264, 22 hevc, 32 av1]')
+    parser.add_argument('--target-quality', metavar='[METRIC=]VALUE',
+                       help='Pick the CRF per file: the highest CRF whose sampled windows reach this '
+                            'vmaf, ssim or psnr score (e.g. vmaf=93, ssim=0.985); a bare value is VMAF')
+    parser.add_argument('--preset', default='medium', choices=PRESETS,
                        help='Encoding preset [default: medium]')
+    parser.add_argument('--encoder', default=DEFAULT_ENCODER, choices=list(ENCODERS),
+                       help='Video encoder: h264 (libx264), hevc (libx265) or av1 (libsvtav1) '
+                            f'[default: {DEFAULT_ENCODER}]')
+    parser.add_argument('--tune', choices=TUNES,
+                       help='Tune the encoder for the content, where the encoder supports it')
+    parser.add_argument('--threads', type=int,
+                       help='Encoder threads per job [default: all cores, divided between -j jobs]')
+    parser.add_argument('--list-encoders', action='store_true',
+                       help='Show which encoders the installed FFmpeg supports')
     parser.add_argument('--copy', action='store_true',
                        help='Copy streams without re-encoding (lossless, fastest)')
+    parser.add_argument('--extras', nargs='+', choices=EXTRA_OUTPUTS, metavar='EXTRA',
+                       help='Also write thumbnails, contact-sheet and/or preview (GIF) '
+                            'from the same decode as the MP4')
+    parser.add_argument('--ladder', nargs='?', const=DEFAULT_LADDER, metavar='RUNGS',
+                       help='Encode several resolutions from one decode, as HEIGHT[:CRF] list '
+                            f'[default rungs: {DEFAULT_LADDER}]')
+    parser.add_argument('--preflight', choices=['repair', 'skip'],
+                       help='Scan inputs for transport stream damage first, then decode damaged files '
+                            'with error-tolerant options (repair) or leave them out (skip)')
+    parser.add_argument('--scan', action='store_true',
+                       help='Check the input for damaged regions and report them (no conversion)')
+    parser.add_argument('--start', type=parse_time, metavar='TIME',
+                       help='Start the output at this time (seconds or HH:MM:SS.ms)')
+    parser.add_argument('--end', type=parse_time, metavar='TIME',
+                       help='End the output at this time; plain encodes of MTS files are smart cut, '
+                            're-encoding only the GOPs at the cut points')
+    parser.add_argument('--hls', nargs='?', const='ts', choices=list(HLS_FORMATS),
+                       help='Write an HLS package (master.m3u8 and segments) instead of MP4, stream copying '
+                            'H.264 video; with --ladder, encoded variants are added below the source '
+                            '[default segments: ts]')
+    parser.add_argument('--preview-first', action='store_true',
+                       help='Publish a remux or quick low-resolution preview first, then replace it with '
+                            'the full encode run at lower priority')
+    parser.add_argument('--analyze', action='store_true',
+                       help='Sample the input first and only deinterlace, crop or keep audio where needed')
     parser.add_argument('--batch', action='store_true',
-                       help='Batch convert all MTS files in input directory')
+                       help='Batch convert all MTS files below input directory (recursively) or in a tar/zip archive')
     parser.add_argument('--info', action='store_true',
                        help='Show video information only (no conversion)')
+    parser.add_argument('--index', action='store_true',
+                       help='Build the keyframe index of the input and show a summary (no conversion)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                       help='Number of files to convert at once in batch mode [default: 1]')
+    parser.add_argument('--per-device', type=int,
+                       help='Maximum concurrent jobs reading or writing the same disk '
+                            '[default: 1 on spinning and removable disks, otherwise no limit besides -j]')
+    parser.add_argument('--order', default='fifo', choices=SCHEDULING_POLICIES,
+                       help='Batch order: longest-first minimises total time with -j, '
+                            'shortest-first gives quick results first [default: fifo]')
+    parser.add_argument('--dedup', action='store_true',
+                       help='Convert byte-identical source files once and link the other outputs to it')
+    parser.add_argument('--limits', action='append', metavar='CLASS:LIMITS',
+                       help=f"Resource limits for one job class ({', '.join(JOB_CLASSES)}), as comma separated "
+                            "nice=N, ionice=CLASS[:LEVEL] (idle, best-effort, realtime) and memory=SIZE; "
+                            "may be repeated [default: background:nice=10,ionice=best-effort:7]")
+    parser.add_argument('--pin-cores', action='store_true',
+                       help='Pin each parallel batch job to its own set of CPU cores')
+    parser.add_argument('--scratch', metavar='DIR',
+                       help='Encode into a fast local scratch directory and move finished files '
+                            'to the output location in the background')
+    parser.add_argument('--output-cache', metavar='DIR',
+                       help='Reuse finished MP4s from a cache directory, which may be shared, keyed by '
+                            'source content and settings')
+    parser.add_argument('--output-cache-size', type=parse_size, default=DEFAULT_CACHE_SIZE, metavar='SIZE',
+                       help='Evict least recently used outputs beyond this size (e.g. 500G) [default: 100G]')
+    parser.add_argument('--refresh-capabilities', action='store_true',
+                       help='Query FFmpeg for its encoders, muxers and filters again instead of '
+                            'using the cached list')
     parser.add_argument('-v', '--verbose', action='store_true',
                        help='Verbose output (show FFmpeg messages)')
 
     args = parser.parse_args()
+    if args.input is None and not args.list_encoders:
+        parser.error("the following arguments are required: input")
 
-    converter = MTSConverterCLI()
+    # '-' reads MTS from stdin and writes fragmented MP4 to stdout
+    if args.input == '-' and not args.output and not args.batch:
+        args.output = '-'
+    if args.output == '-':
+        # stdout carries the MP4 data, so messages go to stderr
+        sys.stdout = sys.stderr
+
+    try:
+        limits = parse_limits(args.limits)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    output_cache = None
+    if args.output_cache:
+        try:
+            output_cache = OutputCache(args.output_cache, args.output_cache_size)
+        except OSError as e:
+            print(f"Error: Cannot use output cache {args.output_cache}: {e}")
+            sys.exit(1)
+    converter = MTSConverterCLI(scratch_dir=args.scratch, limits=limits,
+                                refresh_capabilities=args.refresh_capabilities, output_cache=output_cache)
+    if args.verbose:
+        for job_class, job_limits in limits.items():
+            print(f"Limits for {job_class} jobs: {job_limits.describe()}")
+
+    if args.list_encoders:
+        available = available_encoders(converter.capabilities)
+        for name, backend in ENCODERS.items():
+            print(f"  {'✓' if name in available else '✗'} {name:5} {backend['label']}")
+        return
+
+    target_quality = None
+    if args.target_quality:
+        if args.copy or args.ladder or args.crf is not None:
+            print("Error: --target-quality cannot be combined with --copy, --ladder or --crf")
+            sys.exit(1)
+        try:
+            target_quality = parse_target(args.target_quality, converter.capabilities['filters'])
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+
+    if args.crf is None:
+        args.crf = default_crf(args.encoder)
+    try:
+        check_crf(args.encoder, args.crf)
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    if not args.copy and args.encoder not in available_encoders(converter.capabilities):
+        print(f"Error: This FFmpeg build has no {ENCODERS[args.encoder]['codec']} encoder "
+              "(see --list-encoders)")
+        sys.exit(1)
 
     if args.info:
         # Just show video info
         if os.path.isfile(args.input):
-            converter.get_video_info(args.input)
+            converter.get_video_info(args.input, {'copy_streams': args.copy, 'encoder': args.encoder,
+                                                  'preset': args.preset, 'crf': args.crf})
         else:
             print(f"Error: {args.input} is not a valid file")
         return
 
+    if args.scan:
+        if not os.path.isfile(args.input):
+            print(f"Error: {args.input} is not a valid file")
+            sys.exit(1)
+        report = converter.check_integrity(args.input, verbose=True)
+        if report is None or report.damaged:
+            sys.exit(1)
+        return
+
+    if args.index:
+        if not os.path.isfile(args.input):
+            print(f"Error: {args.input} is not a valid file")
+            sys.exit(1)
+        if not converter.show_keyframe_index(args.input, rebuild=True):
+            sys.exit(1)
+        return
+
+    ladder = None
+    if args.ladder:
+        try:
+            ladder = parse_ladder(args.ladder, args.crf, ENCODERS[args.encoder]['max_crf'])
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        if args.copy or args.output == '-':
+            print("Error: --ladder cannot be combined with --copy or output to stdout")
+            sys.exit(1)
+
+    if args.preview_first and (args.copy or ladder or args.hls or '-' in (args.input, args.output)):
+        print("Error: --preview-first cannot be combined with --copy, --ladder, --hls or stdin/stdout")
+        sys.exit(1)
+    if args.hls and (args.copy or args.extras or args.analyze or args.output == '-'):
+        print("Error: --hls cannot be combined with --copy, --extras, --analyze or output to stdout")
+        sys.exit(1)
+
     if args.batch:
         # Batch mode
+        if args.input == '-' or args.output == '-':
+            print("Error: '-' cannot be used in batch mode")
+            sys.exit(1)
         converter.batch_convert(
-            args.input, args.output,
-            crf=args.crf, preset=args.preset, copy_streams=args.copy, verbose=args.verbose
+            args.input, args.output, jobs=args.jobs, per_device=args.per_device, order=args.order,
+            dedup=args.dedup, preview_first=args.preview_first, pin_cores=args.pin_cores, crf=args.crf,
+            preset=args.preset, copy_streams=args.copy, verbose=args.verbose,
+            extras=args.extras, ladder=ladder, analyze=args.analyze, preflight=args.preflight,
+            start=args.start, end=args.end, encoder=args.encoder, tune=args.tune, threads=args.threads,
+            target_quality=target_quality, hls=args.hls
         )
     else:
         # Single file mode
-        if not os.path.isfile(args.input):
+        if args.input != '-' and not os.path.isfile(args.input):
             print(f"Error: Input file {args.input} does not exist")
             return
 
@@ -267,23 +1403,40 @@ Examples:
         if not args.output:
             input_path = Path(args.input)
             args.output = str(input_path.with_suffix('.mp4'))
+            if args.hls:
+                args.output = hls_output_dir(args.output)
 
         # Check if output exists
-        if os.path.exists(args.output):
+        if args.output != '-' and os.path.exists(args.output):
+            if args.input == '-':
+                # stdin carries the MTS data and cannot answer a prompt
+                print(f"Error: Output file {args.output} already exists")
+                sys.exit(1)
             response = input(f"Output file {args.output} already exists. Overwrite? (y/N): ")
             if response.lower() != 'y':
                 print("Conversion cancelled")
                 return
 
         # Show input info
-        converter.get_video_info(args.input)
-        print()
+        if args.input != '-':
+            converter.get_video_info(args.input)
+            print()
 
         # Convert
-        success = converter.convert_file(
-            args.input, args.output,
-            crf=args.crf, preset=args.preset, copy_streams=args.copy, verbose=args.verbose
+        settings = dict(
+            crf=args.crf, preset=args.preset, copy_streams=args.copy, verbose=args.verbose,
+            extras=args.extras, ladder=ladder, analyze=args.analyze, preflight=args.preflight,
+            start=args.start, end=args.end, encoder=args.encoder, tune=args.tune, threads=args.threads,
+            target_quality=target_quality, hls=args.hls
         )
+        if args.preview_first:
+            converter.publish_preview(args.input, args.output, args.verbose, args.start, args.end)
+            success = converter.final_tier(args.input, args.output, **settings)
+        else:
+            success = converter.convert_file(args.input, args.output, **settings)
+
+        if converter.finish_publishing():
+            success = False
 
         if not success:
             sys.exit(1)
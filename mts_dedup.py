@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - Duplicate Detection
+Finds byte-identical source files so each clip is encoded only once, and
+links finished outputs to the places the duplicates would have produced.
+"""
+
+import os
+import mmap
+import errno
+import shutil
+import hashlib
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Chunks hashed per file before falling back to a full hash
+SAMPLE_COUNT = 8
+SAMPLE_SIZE = 64 * 1024
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+# ioctl(dest, FICLONE, src) shares extents on btrfs, XFS and similar
+FICLONE = 0x40049409
+
+
+def _digest_ranges(path, ranges):
+    """Hash the given (offset, length) ranges of a file through mmap"""
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        view = memoryview(mapped)
+        try:
+            for offset, length in ranges:
+                digest.update(view[offset:offset + length])
+        finally:
+            view.release()
+    return digest.hexdigest()
+
+
+def sample_digest(path, size):
+    """Hash a few chunks spread evenly across a file, including both ends"""
+    if size <= SAMPLE_COUNT * SAMPLE_SIZE:
+        return _digest_ranges(path, [(0, size)])
+    step = (size - SAMPLE_SIZE) // (SAMPLE_COUNT - 1)
+    return _digest_ranges(path, [(i * step, SAMPLE_SIZE) for i in range(SAMPLE_COUNT)])
+
+
+def full_digest(path, size):
+    """Hash a whole file"""
+    return _digest_ranges(path, [(offset, HASH_CHUNK_SIZE) for offset in range(0, size, HASH_CHUNK_SIZE)])
+
+
+def _group_by(items, key):
+    groups = {}
+    for item in items:
+        try:
+            groups.setdefault(key(item), []).append(item)
+        except OSError:
+            # Unreadable files are left to fail in the normal conversion path
+            groups.setdefault(('unreadable', id(item)), []).append(item)
+    return list(groups.values())
+
+
+def find_duplicates(paths):
+    """Group identical files, return {original: [duplicates]} for each group"""
+    sizes = {}
+    for path in paths:
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            continue
+        if size:
+            sizes.setdefault(size, []).append(path)
+
+    duplicates = {}
+    for size, same_size in sizes.items():
+        if len(same_size) < 2:
+            continue
+        for sampled in _group_by(same_size, lambda path: sample_digest(path, size)):
+            if len(sampled) < 2:
+                continue
+            # Samples only suggest a match, confirm with the full contents
+            for identical in _group_by(sampled, lambda path: full_digest(path, size)):
+                if len(identical) > 1:
+                    duplicates[identical[0]] = identical[1:]
+    return duplicates
+
+
+def reflink(source, destination):
+    """Clone source to destination sharing disk blocks, if the filesystem can"""
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflinks are not supported on this platform")
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(destination)
+            raise
+
+
+def link_output(source, destination, hardlink=True):
+    """Make destination hold the same content as source as cheaply as possible
+
+    Tries a reflink, then a hardlink, then falls back to a full copy, and
+    returns the method that was used. Without hardlink the two files never
+    share an inode, so editing one in place cannot change the other. The
+    link is made under a temporary name and renamed over destination, which
+    keeps an existing file in place until then.
+    """
+    directory = os.path.dirname(os.path.abspath(destination))
+    os.makedirs(directory, exist_ok=True)
+    temp_path = os.path.join(directory, f".{os.path.basename(destination)}.{os.getpid()}.{threading.get_ident()}.link")
+    if os.path.lexists(temp_path):
+        os.remove(temp_path)
+
+    try:
+        try:
+            reflink(source, temp_path)
+            method = 'reflink'
+        except OSError:
+            method = None
+        if method is None and hardlink:
+            try:
+                os.link(source, temp_path)
+                method = 'hardlink'
+            except OSError:
+                pass
+        if method is None:
+            shutil.copy2(source, temp_path)
+            method = 'copy'
+        os.replace(temp_path, destination)
+    except BaseException:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        raise
+    return method
+
+
+def unshare_output(path):
+    """Remove path when it is hardlinked elsewhere, so writing it anew cannot change the other links"""
+    try:
+        if os.stat(path).st_nlink > 1:
+            os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - File Discovery
+Walks a source tree with os.scandir and yields MTS files as soon as they
+are found, so batch workers can start before the walk has finished.
+"""
+
+import os
+
+MTS_EXTENSIONS = ('.mts', '.m2ts')
+
+
+def iter_mts_files(root):
+    """Yield every MTS file below root once, deduplicated by inode"""
+    seen = set()
+    pending_dirs = [root]
+    while pending_dirs:
+        directory = pending_dirs.pop()
+        try:
+            entries = os.scandir(directory)
+        except OSError:
+            continue
+
+        subdirs = []
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                        continue
+                    if not entry.name.lower().endswith(MTS_EXTENSIONS) or not entry.is_file():
+                        continue
+                    # DirEntry.stat() leaves st_ino and st_dev at zero on Windows
+                    info = os.stat(entry.path) if os.name == 'nt' else entry.stat()
+                except OSError:
+                    continue
+
+                key = (info.st_dev, info.st_ino)
+                if key in seen:
+                    continue
+                seen.add(key)
+                yield entry.path
+
+        # Walk subdirectories in name order, depth first
+        pending_dirs.extend(sorted(subdirs, reverse=True))
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - Encoder Backends
+Maps the shared quality, speed, threading and content settings onto the
+options of each supported video encoder, and checks which of them the
+local ffmpeg build provides.
+"""
+
+from mts_capabilities import get_capabilities
+
+# Speed presets offered by the CLI and GUI, slowest first (x264/x265 names)
+PRESETS = ['veryslow', 'slower', 'slow', 'medium', 'fast', 'faster', 'veryfast']
+# Content types encoders can be tuned for
+TUNES = ('film', 'grain', 'animation')
+
+ENCODERS = {
+    'h264': {
+        'codec': 'libx264',
+        'label': 'H.264 (libx264)',
+        'default_crf': 18,
+        'max_crf': 51,
+        # CRF range --target-quality searches
+        'crf_search': (12, 34),
+        'presets': {name: name for name in PRESETS},
+        'tunes': {'film': ['-tune', 'film'], 'grain': ['-tune', 'grain'], 'animation': ['-tune', 'animation']},
+        'tune_params': {},
+        'params_option': None,
+        # Encoder parameter that sets the worker thread count, None for -threads
+        'thread_param': None,
+        'params': [],
+        'extra_args': [],
+    },
+    'hevc': {
+        'codec': 'libx265',
+        'label': 'HEVC (libx265)',
+        # Visually close to x264 at CRF 18, at roughly 60% of the size
+        'default_crf': 22,
+        'max_crf': 51,
+        'crf_search': (14, 36),
+        'presets': {name: name for name in PRESETS},
+        'tunes': {'grain': ['-tune', 'grain'], 'animation': ['-tune', 'animation']},
+        'tune_params': {},
+        'params_option': '-x265-params',
+        'thread_param': 'pools',
+        # x265 logs every frame's statistics otherwise
+        'params': ['log-level=warning'],
+        # hvc1 is the sample entry Apple players require for HEVC in MP4
+        'extra_args': ['-tag:v', 'hvc1'],
+    },
+    'av1': {
+        'codec': 'libsvtav1',
+        'label': 'AV1 (SVT-AV1)',
+        'default_crf': 32,
+        'max_crf': 63,
+        'crf_search': (18, 50),
+        # SVT-AV1 presets run from 0 (slowest) to 13 (fastest)
+        'presets': {'veryslow': '3', 'slower': '4', 'slow': '5', 'medium': '7',
+                    'fast': '8', 'faster': '10', 'veryfast': '12'},
+        'tunes': {},
+        # Grain is cheaper to synthesise at playback than to encode
+        'tune_params': {'grain': ['film-grain=8']},
+        'params_option': '-svtav1-params',
+        'thread_param': 'lp',
+        'params': [],
+        'extra_args': ['-pix_fmt', 'yuv420p'],
+    },
+}
+DEFAULT_ENCODER = 'h264'
+
+
+def default_crf(encoder):
+    return ENCODERS[encoder]['default_crf']
+
+
+def check_crf(encoder, crf):
+    """Raise ValueError when crf is outside the encoder's scale"""
+    backend = ENCODERS[encoder]
+    if not 0 <= crf <= backend['max_crf']:
+        raise ValueError(f"CRF for {backend['label']} must be between 0 and {backend['max_crf']}")
+
+
+def _tile_params(encoder, height):
+    """SVT-AV1 tile columns (log2) so large frames can be decoded in parallel"""
+    if encoder != 'av1' or not height:
+        return []
+    if height >= 2160:
+        return ['tile-columns=2']
+    if height >= 1080:
+        return ['tile-columns=1']
+    return []
+
+
+def encoder_args(encoder, crf, preset='medium', threads=None, tune=None, height=None):
+    """ffmpeg video codec options for an encoder
+
+    threads limits the encoder's worker threads (None lets it use every
+    core), tune is one of TUNES or None, and height of the encoded frames
+    picks the tile layout where the encoder supports tiles.
+    """
+    backend = ENCODERS[encoder]
+    args = ['-c:v', backend['codec'], '-crf', str(crf), '-preset', backend['presets'][preset]]
+    args += backend['tunes'].get(tune, [])
+    params = list(backend['tune_params'].get(tune, []))
+
+    if threads and backend['thread_param']:
+        params.append(f"{backend['thread_param']}={threads}")
+    elif threads:
+        args += ['-threads', str(threads)]
+    params += _tile_params(encoder, height) + backend['params']
+    if params:
+        args += [backend['params_option'], ':'.join(params)]
+    return args + backend['extra_args']
+
+
+def describe_encoder(encoder, crf, preset, tune=None):
+    text = f"{ENCODERS[encoder]['label']}, CRF {crf}, preset {preset}"
+    tunable = ENCODERS[encoder]['tunes'].keys() | ENCODERS[encoder]['tune_params'].keys()
+    return f"{text}, tuned for {tune}" if tune in tunable else text
+
+
+def available_encoders(capabilities=None):
+    """Names of the ENCODERS backends the local ffmpeg was built with"""
+    if capabilities is None:
+        capabilities = get_capabilities()
+    codecs = set(capabilities['encoders']) if capabilities else set()
+    return [name for name, backend in ENCODERS.items() if backend['codec'] in codecs]
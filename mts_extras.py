@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - Extra Outputs
+Builds filtergraph branches that produce thumbnails, a contact sheet and a
+preview GIF from the same decode as the main MP4 encode.
+"""
+
+import os
+
+EXTRA_OUTPUTS = ('thumbnails', 'contact-sheet', 'preview')
+
+THUMBNAIL_COUNT = 5
+CONTACT_SHEET_TILES = (4, 4)
+CONTACT_SHEET_WIDTH = 320
+PREVIEW_SECONDS = 5
+PREVIEW_FPS = 10
+PREVIEW_WIDTH = 480
+# Frame spacing used when the input duration is unknown (e.g. stdin)
+FALLBACK_INTERVAL = 60.0
+
+
+def extra_output_paths(output_file, extras):
+    """Return {extra: [files]} that the given extras write next to output_file"""
+    base = os.path.splitext(output_file)[0]
+    paths = {}
+    if 'thumbnails' in extras:
+        paths['thumbnails'] = [f"{base}_thumb_{i:02d}.jpg" for i in range(1, THUMBNAIL_COUNT + 1)]
+    if 'contact-sheet' in extras:
+        paths['contact-sheet'] = [f"{base}_contact.jpg"]
+    if 'preview' in extras:
+        paths['preview'] = [f"{base}_preview.gif"]
+    return paths
+
+
+def existing_extra_outputs(output_file, extras):
+    """List the extra output files that were actually written"""
+    return [path for files in extra_output_paths(output_file, extras).values()
+            for path in files if os.path.exists(path)]
+
+
+class ExtrasPlan:
+    def __init__(self, filtergraph, main_label, output_args):
+        self.filtergraph = filtergraph
+        # Split branch feeding the main encode, None when the video is copied
+        self.main_label = main_label
+        self.output_args = output_args
+
+
+def plan_extras(output_file, extras, duration=None, copy_video=False, video_filter=None):
+    """Build one filtergraph that splits the decoded video for every extra output
+
+    video_filter is applied once before the split, so the main encode and
+    the extras share it.
+    """
+    paths = extra_output_paths(output_file, extras)
+    branches = [name for name in EXTRA_OUTPUTS if name in paths]
+    labels = [] if copy_video else ['main']
+    labels += [name.replace('-', '_') for name in branches]
+
+    prefix = f"{video_filter}," if video_filter and not copy_video else ''
+    chains = [f"[0:v:0]{prefix}split={len(labels)}" + ''.join(f"[{label}]" for label in labels)]
+    output_args = []
+
+    if 'thumbnails' in paths:
+        interval = (duration or FALLBACK_INTERVAL * (THUMBNAIL_COUNT + 1)) / (THUMBNAIL_COUNT + 1)
+        chains.append(f"[thumbnails]yadif=deint=interlaced,fps=1/{interval:.3f}[thumbs]")
+        pattern = os.path.splitext(output_file)[0] + '_thumb_%02d.jpg'
+        output_args += ['-map', '[thumbs]', '-frames:v', str(THUMBNAIL_COUNT), '-q:v', '3',
+                        '-start_number', '1', pattern]
+
+    if 'contact-sheet' in paths:
+        columns, rows = CONTACT_SHEET_TILES
+        interval = (duration or FALLBACK_INTERVAL * columns * rows) / (columns * rows)
+        chains.append(f"[contact_sheet]yadif=deint=interlaced,fps=1/{interval:.3f},"
+                      f"scale={CONTACT_SHEET_WIDTH}:-2,tile={columns}x{rows}[sheet]")
+        output_args += ['-map', '[sheet]', '-frames:v', '1', '-q:v', '3', paths['contact-sheet'][0]]
+
+    if 'preview' in paths:
+        # Start a tenth of the way in to skip the usual camera-start shake
+        start = (duration or 0) / 10
+        chains.append(f"[preview]trim=start={start:.3f}:duration={PREVIEW_SECONDS},setpts=PTS-STARTPTS,"
+                      f"yadif=deint=interlaced,fps={PREVIEW_FPS},scale={PREVIEW_WIDTH}:-2,"
+                      f"split[gif_frames][gif_palette_in];[gif_palette_in]palettegen[gif_palette];"
+                      f"[gif_frames][gif_palette]paletteuse[gif]")
+        output_args += ['-map', '[gif]', paths['preview'][0]]
+
+    return ExtrasPlan(';'.join(chains), None if copy_video else '[main]', output_args)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - Failure Handling
+Classifies failed ffmpeg runs from the tail of their log and picks the
+next, more expensive strategy worth retrying with.
+"""
+
+import re
+
+# Lines of ffmpeg output kept for classifying a failure
+LOG_TAIL_LINES = 40
+
+# Strategies from cheapest to most expensive
+STRATEGIES = ('copy', 'copy-video', 'transcode')
+
+# Checked in order, the first class with a matching line wins
+FAILURE_PATTERNS = (
+    ('out-of-space', re.compile(r'No space left on device|Disk quota exceeded|File too large', re.I)),
+    # Usually an address space cap set with --limits
+    ('out-of-memory', re.compile(r'Cannot allocate memory|Out of memory|std::bad_alloc', re.I)),
+    ('io', re.compile(r'Input/output error|Permission denied|Read-only file system|Broken pipe|'
+                      r'No such file or directory|Error opening output|Stale file handle', re.I)),
+    ('mux-incompatible', re.compile(r'Could not find tag for codec|not currently supported in container|'
+                                    r'incompatible with output codec|Could not write header|'
+                                    r'non monotonically increasing dts|Non-monotonous DTS|'
+                                    r'Timestamps are unset|pts has no value|Invalid audio stream', re.I)),
+    ('corrupt-input', re.compile(r'Invalid data found when processing input|error while decoding|'
+                                 r'corrupt (decoded )?(frame|input)|Packet corrupt|non-existing PPS|'
+                                 r'decode_slice_header error|Error splitting the input into NAL units|'
+                                 r'missing picture in access unit|PES packet size mismatch|'
+                                 r'Invalid NAL unit size', re.I)),
+)
+FAILURE_CLASSES = tuple(name for name, _ in FAILURE_PATTERNS) + ('unknown',)
+
+# Retrying cannot fix these, the environment has to change first
+FATAL_FAILURES = ('out-of-space', 'out-of-memory', 'io')
+
+
+def classify_failure(lines):
+    """Return the failure class for the last lines of a failed ffmpeg run"""
+    for name, pattern in FAILURE_PATTERNS:
+        if any(pattern.search(line) for line in lines):
+            return name
+    return 'unknown'
+
+
+def plan_retry(strategy, failure, resilient=False):
+    """Return (strategy, resilient) for the next attempt, or None to give up
+
+    Mux problems move on to the next strategy, corrupt input is decoded
+    again with error-tolerant options, and unknown failures take one step
+    up the strategy list.
+    """
+    if failure in FATAL_FAILURES:
+        return None
+    if failure == 'corrupt-input':
+        if resilient and strategy == 'transcode':
+            return None
+        # Copying corrupt packets rarely helps, decode them instead
+        return 'transcode', True
+    position = STRATEGIES.index(strategy)
+    if position + 1 == len(STRATEGIES):
+        return None
+    return STRATEGIES[position + 1], resilient
+
+
+def describe_attempts(attempts):
+    """One-line history such as 'copy (mux-incompatible) -> copy-video'"""
+    steps = []
+    for attempt in attempts:
+        step = attempt['strategy'] + (' +tolerant' if attempt['resilient'] else '')
+        if attempt['failure']:
+            step += f" ({attempt['failure']})"
+        steps.append(step)
+    return ' -> '.join(steps)
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - Speed History
+Remembers how fast finished conversions ran and how large their output
+was, per encoder, preset, CRF band, resolution, field order and host, so
+ETAs, batch planning and --info can predict new files from the medians
+of earlier runs.
+"""
+
+import json
+import os
+import socket
+import statistics
+import threading
+
+from mts_paths import user_cache_dir
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+HISTORY_FILE = 'speed_history.json'
+# Newest runs kept per profile
+HISTORY_SAMPLES = 25
+# CRF values within one band encode at about the same speed
+CRF_BAND = 4
+# Runs shorter than this are dominated by startup and say little about speed
+MIN_SAMPLE_SECONDS = 5.0
+
+
+def crf_band(crf):
+    low = int(crf) // CRF_BAND * CRF_BAND
+    return f"{low}-{low + CRF_BAND - 1}"
+
+
+def profile_key(info, encoder, preset, crf, copy_streams=False, host=None):
+    """History key of a conversion, e.g. 'h264|medium|crf16-19|1080p|interlaced|studio-pc'"""
+    height = info.get('height') if info else None
+    interlaced = info.get('interlaced') if info else None
+    field_order = 'unknown' if interlaced is None else 'interlaced' if interlaced else 'progressive'
+    # Remuxing speed does not depend on encoder settings
+    settings = ['copy', '-', '-'] if copy_streams else [encoder, preset, f"crf{crf_band(crf)}"]
+    return '|'.join([*settings, f"{height}p" if height else 'unknown', field_order,
+                     host or socket.gethostname()])
+
+
+class SpeedHistory:
+    """Measured speed and output bitrate of finished conversions, per profile_key"""
+
+    def __init__(self, path=None):
+        if path is None:
+            try:
+                path = os.path.join(user_cache_dir(), HISTORY_FILE)
+            except OSError:
+                # No writable cache location, run without history
+                path = None
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = None
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError, TypeError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def _load(self):
+        if self.entries is None:
+            self.entries = self._read()
+        return self.entries
+
+    def record(self, key, duration, elapsed, output_bytes):
+        """Store one finished run: media seconds converted, wall clock seconds taken, bytes written"""
+        if self.path is None or not duration or elapsed < MIN_SAMPLE_SECONDS:
+            return
+        sample = {'speed': duration / elapsed, 'bytes_per_second': output_bytes / duration}
+        with self.lock:
+            try:
+                with open(f"{self.path}.lock", 'a+b') as lock:
+                    if fcntl is not None:
+                        fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+                    # Merge into the file as it is now, other runs may have recorded since it was loaded
+                    entries = self._read()
+                    samples = entries.setdefault(key, [])
+                    samples.append(sample)
+                    del samples[:-HISTORY_SAMPLES]
+                    # Write to a temporary file first so readers never see half a history
+                    temp_path = f"{self.path}.{os.getpid()}.tmp"
+                    with open(temp_path, 'w', encoding='utf-8') as f:
+                        json.dump(entries, f)
+                    os.replace(temp_path, self.path)
+            except OSError:
+                return
+            self.entries = entries
+
+    def predict(self, key, duration):
+        """Predicted 'seconds', output 'bytes', 'speed' and the number of 'samples', or None
+
+        Medians keep one run slowed down by other load from skewing the
+        prediction.
+        """
+        if self.path is None or not duration:
+            return None
+        with self.lock:
+            samples = list(self._load().get(key, []))
+        if not samples:
+            return None
+        speed = statistics.median(sample['speed'] for sample in samples)
+        bytes_per_second = statistics.median(sample['bytes_per_second'] for sample in samples)
+        return {'seconds': duration / speed, 'bytes': int(duration * bytes_per_second),
+                'speed': speed, 'samples': len(samples)}
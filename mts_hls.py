@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - HLS Packaging
+Plans and builds a single ffmpeg run that writes HLS segments and
+playlists straight from the source: H.264 video is stream copied into the
+top variant, and rendition ladder rungs below it are encoded from one
+shared decode.
+"""
+
+import os
+import re
+
+from mts_encoders import DEFAULT_ENCODER, encoder_args
+from mts_ladder import ladder_filtergraph
+
+# Segment container per --hls format, and the extension of its segments
+HLS_FORMATS = {'ts': ('mpegts', 'ts'), 'fmp4': ('fmp4', 'm4s')}
+SEGMENT_SECONDS = 6
+MASTER_PLAYLIST = 'master.m3u8'
+VARIANT_PLAYLIST = 'index.m3u8'
+AAC_CODEC = 'mp4a.40.2'
+
+
+def hls_output_dir(output_file):
+    """Directory for the HLS package that replaces an MP4 output path"""
+    return f"{os.path.splitext(output_file)[0]}_hls"
+
+
+def avc_codec(sps):
+    """RFC 6381 codec string such as avc1.640028 from a parsed SPS"""
+    return f"avc1.{sps['profile_idc']:02x}{sps['constraint_flags']:02x}{sps['level_idc']:02x}"
+
+
+def plan_variants(media, sps=None, rungs=None, crf=18):
+    """Variant dicts, highest first
+
+    H.264 video is stream copied into a 'source' variant and only ladder
+    rungs below its height are encoded; other video is encoded for every
+    rung, or once at its own size without a ladder. media is None for
+    streamed input, which is taken to be AVCHD and so H.264.
+    """
+    streams = media.get('streams', []) if media else []
+    copy = media is None or ['video', 'h264'] in streams
+    height = media.get('height') if media else None
+
+    variants = []
+    if copy:
+        variants.append({'name': 'source', 'copy': True, 'height': height,
+                         'width': media.get('width') if media else None,
+                         'codecs': avc_codec(sps) if sps else None})
+    for rung in rungs or ():
+        if copy and height and rung['height'] >= height:
+            continue
+        variants.append({'name': rung['name'], 'copy': False, 'height': rung['height'], 'crf': rung['crf']})
+    if not variants:
+        variants.append({'name': 'encoded', 'copy': False, 'height': None, 'crf': crf})
+    return variants
+
+
+def stream_encoder_args(args, index):
+    """Scope encoder_args options to output video stream index, e.g. -crf to -crf:v:1"""
+    scoped = []
+    for option, value in zip(args[::2], args[1::2]):
+        option = option[:-2] if option.endswith(':v') else option
+        scoped += [f"{option}:v:{index}", value]
+    return scoped
+
+
+def hls_output_args(variants, output_dir, hls_format='ts', has_audio=True, copy_audio=False, preset='medium',
+                    encoder=DEFAULT_ENCODER, threads=None, tune=None):
+    """ffmpeg options after the input: filtergraph, maps, codecs and the HLS muxer"""
+    encoded = [variant for variant in variants if not variant['copy']]
+    args = []
+    if encoded and encoded[0]['height'] is None:
+        # The single variant encoded at the source size only needs deinterlacing
+        args = ['-filter_complex', "[0:v:0]yadif=deint=interlaced[v0]"]
+    elif encoded:
+        args = ['-filter_complex', ladder_filtergraph(encoded)]
+    codec_args = []
+    stream_map = []
+    for i, variant in enumerate(variants):
+        if variant['copy']:
+            args += ['-map', '0:v:0']
+            codec_args += [f'-c:v:{i}', 'copy']
+        else:
+            args += ['-map', f"[v{encoded.index(variant)}]"]
+            codec_args += stream_encoder_args(
+                encoder_args(encoder, variant['crf'], preset, threads, tune, variant['height']), i)
+            # Keyframes on the segment grid keep the variants' segments aligned
+            codec_args += [f'-force_key_frames:v:{i}', f"expr:gte(t,n_forced*{SEGMENT_SECONDS})"]
+        if has_audio:
+            args += ['-map', '0:a:0']
+        stream_map.append(f"v:{i},a:{i},name:{variant['name']}" if has_audio else f"v:{i},name:{variant['name']}")
+
+    if has_audio:
+        # AVCHD audio is usually AC-3, which browsers do not play
+        codec_args += ['-c:a', 'copy'] if copy_audio else ['-c:a', 'aac', '-b:a', '192k']
+    segment_type, extension = HLS_FORMATS[hls_format]
+    variant_dir = os.path.join(output_dir, '%v')
+    return [
+        *args, *codec_args,
+        '-f', 'hls', '-hls_time', str(SEGMENT_SECONDS), '-hls_playlist_type', 'vod',
+        '-hls_segment_type', segment_type,
+        '-hls_segment_filename', os.path.join(variant_dir, f"seg_%05d.{extension}"),
+        '-master_pl_name', MASTER_PLAYLIST, '-var_stream_map', ' '.join(stream_map),
+        os.path.join(variant_dir, VARIANT_PLAYLIST)
+    ]
+
+
+def measure_variant(playlist):
+    """Peak and average bitrate of a media playlist's segments, in bit/s"""
+    directory = os.path.dirname(playlist)
+    peak = total_bits = total_seconds = 0
+    duration = None
+    with open(playlist, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('#EXTINF:'):
+                duration = float(line[len('#EXTINF:'):].split(',')[0])
+            elif line and not line.startswith('#') and duration:
+                bits = os.path.getsize(os.path.join(directory, line)) * 8
+                peak = max(peak, bits / duration)
+                total_bits += bits
+                total_seconds += duration
+                duration = None
+    return int(peak), int(total_bits / total_seconds) if total_seconds else 0
+
+
+def finish_master_playlist(output_dir, variants, has_audio=True):
+    """Put measured bandwidths, and the codecs of copied video, into ffmpeg's master playlist
+
+    ffmpeg only knows the bitrate of streams it encodes at a fixed rate,
+    which is neither copied nor CRF encoded video.
+    """
+    codecs = {variant['name']: variant.get('codecs') for variant in variants}
+    path = os.path.join(output_dir, MASTER_PLAYLIST)
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    for i, line in enumerate(lines[:-1]):
+        if not line.startswith('#EXT-X-STREAM-INF:'):
+            continue
+        uri = lines[i + 1]
+        peak, average = measure_variant(os.path.join(output_dir, uri))
+        line = re.sub(r'(?<![-\w])BANDWIDTH=\d+', f"BANDWIDTH={peak}", line)
+        if 'AVERAGE-BANDWIDTH=' in line:
+            line = re.sub(r'AVERAGE-BANDWIDTH=\d+', f"AVERAGE-BANDWIDTH={average}", line)
+        else:
+            line += f",AVERAGE-BANDWIDTH={average}"
+        name = uri.split('/')[0]
+        if 'CODECS=' not in line and codecs.get(name):
+            line += f",CODECS=\"{codecs[name]}{',' + AAC_CODEC if has_audio else ''}\""
+        lines[i] = line
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(temp_path, path)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - Keyframe Index
+Finds H.264 IDR access units and their PTS by walking the memory-mapped
+transport stream, and keeps the result in a compact index file next to
+the source so later jobs can seek and cut without running ffprobe.
+"""
+
+import os
+import sys
+import struct
+import hashlib
+from array import array
+from bisect import bisect_right
+
+from mts_paths import user_cache_dir
+from mts_ts import (M2TS_PACKET_SIZE, PTS_HZ, TS_PACKET_SIZE, TransportStream, TransportStreamError,
+                    unwrap_timestamp)
+
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = b'MTSIDX01'
+# magic, source size, source mtime_ns, packet size, video PID, keyframe count
+INDEX_HEADER = struct.Struct('<8sQqHHQ')
+
+H264_SLICE = 1
+H264_IDR = 5
+# PSI tables are expected in the first part of the file
+HEAD_BYTES = 4 * 1024 * 1024
+# How much of an access unit is searched for its first slice
+SLICE_SEARCH_BYTES = 32 * 1024
+
+
+class KeyframeIndex:
+    def __init__(self, packet_size, video_pid, offsets=None, pts=None):
+        self.packet_size = packet_size
+        self.video_pid = video_pid
+        # Byte offset of the packet starting each IDR access unit, and its PTS
+        self.offsets = offsets if offsets is not None else array('q')
+        self.pts = pts if pts is not None else array('q')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def seconds(self, i):
+        """Time of keyframe i relative to the first keyframe"""
+        return (self.pts[i] - self.pts[0]) / PTS_HZ
+
+    def times(self):
+        return [self.seconds(i) for i in range(len(self))]
+
+    def at_or_before(self, seconds):
+        """Index of the last keyframe at or before a time, or None"""
+        target = self.pts[0] + round(seconds * PTS_HZ) if len(self) else 0
+        i = bisect_right(self.pts, target) - 1
+        return i if i >= 0 else None
+
+    def at_or_after(self, seconds):
+        """Index of the first keyframe at or after a time, or None"""
+        i = self.at_or_before(seconds)
+        if i is not None and self.pts[i] == self.pts[0] + round(seconds * PTS_HZ):
+            return i
+        i = 0 if i is None else i + 1
+        return i if i < len(self) else None
+
+    def save(self, path, source_stat):
+        """Write the index, tagged with the source file's size and mtime"""
+        offsets, pts = array('q', self.offsets), array('q', self.pts)
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+            pts.byteswap()
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, source_stat.st_size, source_stat.st_mtime_ns,
+                                      self.packet_size, self.video_pid, len(self)))
+            f.write(offsets.tobytes())
+            f.write(pts.tobytes())
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path, source_stat):
+        """Read an index file, return None if missing or stale"""
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(INDEX_HEADER.size)
+                if len(header) != INDEX_HEADER.size:
+                    return None
+                magic, size, mtime_ns, packet_size, video_pid, count = INDEX_HEADER.unpack(header)
+                if magic != INDEX_MAGIC or size != source_stat.st_size or mtime_ns != source_stat.st_mtime_ns:
+                    return None
+                offsets, pts = array('q'), array('q')
+                offsets.fromfile(f, count)
+                pts.fromfile(f, count)
+        except (OSError, EOFError):
+            return None
+        if sys.byteorder == 'big':
+            offsets.byteswap()
+            pts.byteswap()
+        return cls(packet_size, video_pid, offsets, pts)
+
+
+def _first_slice_type(ts, pid, payload, pusi_pos):
+    """Return the NAL type of the first slice in the access unit starting at payload"""
+    data = ts.data
+    chunk = bytearray(data[payload:pusi_pos + TS_PACKET_SIZE])
+    index = ts.packet_index(pusi_pos) + 1
+    start = 0
+    while len(chunk) < SLICE_SEARCH_BYTES:
+        while True:
+            start = chunk.find(b'\x00\x00\x01', start)
+            if start < 0 or start + 3 >= len(chunk):
+                break
+            nal_type = chunk[start + 3] & 0x1F
+            if nal_type in (H264_SLICE, H264_IDR):
+                return nal_type
+            start += 3
+        # A start code may straddle the packet boundary
+        start = max(0, len(chunk) - 3)
+
+        # Append the next packet of the same PID, stopping at the next access unit
+        while True:
+            pos = ts.sync_offset(index)
+            index += 1
+            if pos + TS_PACKET_SIZE > ts.size:
+                return None
+            packet_pid, pusi, packet_payload = ts.header(pos)
+            if packet_pid == pid:
+                break
+        if pusi:
+            return None
+        if packet_payload is not None:
+            chunk += data[packet_payload:pos + TS_PACKET_SIZE]
+    return None
+
+
+def build_index(input_file):
+    """Scan a transport stream and return its KeyframeIndex"""
+    with TransportStream.open(input_file) as ts:
+        _, streams = ts.streams(limit=HEAD_BYTES)
+        video = next((s for s in streams if s['codec_name'] == 'h264'), None)
+        if video is None:
+            raise TransportStreamError("no H.264 video stream found")
+        pid = video['pid']
+        index = KeyframeIndex(ts.packet_size, pid)
+        packet_start = 4 if ts.packet_size == M2TS_PACKET_SIZE else 0
+
+        # Find the PES stream_id the video uses from its first access unit
+        pattern = None
+        for i in range(ts.packet_count):
+            pos = ts.sync_offset(i)
+            packet_pid, pusi, payload = ts.header(pos)
+            if packet_pid == pid and pusi and payload is not None:
+                pattern = bytes(ts.data[payload:payload + 4])
+                break
+        if pattern is None or pattern[:3] != b'\x00\x00\x01':
+            return index
+
+        # Let mmap.find jump between PES starts instead of visiting every packet
+        data = ts.data
+        last_pts = None
+        hit = data.find(pattern, ts.first_sync)
+        while hit >= 0:
+            pos = ts.sync_offset(ts.packet_index(hit))
+            packet_pid, pusi, payload = ts.header(pos)
+            if packet_pid == pid and pusi and payload == hit:
+                pts, es_start = ts.pes_header(hit)
+                if pts is not None and _first_slice_type(ts, pid, es_start, pos) == H264_IDR:
+                    pts = pts if last_pts is None else unwrap_timestamp(pts, last_pts)
+                    last_pts = pts
+                    index.offsets.append(pos - packet_start)
+                    index.pts.append(pts)
+            hit = data.find(pattern, hit + 4)
+        return index
+
+
+def index_paths(input_file):
+    """Candidate index locations: next to the source, then the user cache"""
+    paths = [input_file + INDEX_SUFFIX]
+    try:
+        digest = hashlib.sha1(os.path.abspath(input_file).encode('utf-8')).hexdigest()
+        cache = os.path.join(user_cache_dir(), 'index')
+        os.makedirs(cache, exist_ok=True)
+        paths.append(os.path.join(cache, digest + INDEX_SUFFIX))
+    except OSError:
+        pass
+    return paths
+
+
+def get_index(input_file, rebuild=False):
+    """Load the saved keyframe index of a file, building and saving it if needed"""
+    source_stat = os.stat(input_file)
+    paths = index_paths(input_file)
+    if not rebuild:
+        for path in paths:
+            index = KeyframeIndex.load(path, source_stat)
+            if index is not None:
+                return index, path
+
+    index = build_index(input_file)
+    for path in paths:
+        try:
+            index.save(path, source_stat)
+            return index, path
+        except OSError:
+            # Read-only source media, fall back to the cache directory
+            continue
+    return index, None
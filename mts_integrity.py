@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - Integrity Scan
+Checks every transport stream packet for lost sync, transport error flags
+and continuity counter gaps before a file is converted, and reports the
+damaged byte and time ranges. Uses NumPy when it is installed and falls
+back to a slower pure Python scan otherwise.
+"""
+
+from bisect import bisect_right
+
+from mts_ts import (NULL_PID, PTS_HZ, SYNC_BYTE, SYNC_CHECK_PACKETS, TS_PACKET_SIZE, TransportStream,
+                    unwrap_timestamp)
+
+# NumPy takes longer to import than the CLI takes to start, so _load_numpy
+# imports it on the first scan. None: not tried yet, False: not installed,
+# otherwise the module.
+np = None
+
+# Damaged packets closer than this are reported as one range
+MERGE_PACKETS = 64
+# Files with more damage than this are better skipped than repaired
+MAX_DAMAGED_FRACTION = 0.05
+# ffmpeg input options that drop corrupt packets instead of failing on them
+RESILIENT_INPUT_ARGS = ['-fflags', '+discardcorrupt+genpts', '-err_detect', 'ignore_err']
+
+ERROR_KINDS = ('sync', 'transport', 'continuity')
+# Packet header, adaptation field header and PCR
+HEADER_BYTES = 12
+# One PCR sample per this many bytes is plenty to place damage in time
+PCR_SPACING = 1024 * 1024
+
+
+class DamagedRange:
+    def __init__(self, start, end, errors, start_time=None, end_time=None):
+        self.start = start
+        self.end = end
+        # Number of damaged packets per error kind
+        self.errors = errors
+        # Seconds from the first PCR, None when the stream carries no PCR
+        self.start_time = start_time
+        self.end_time = end_time
+
+    @property
+    def size(self):
+        return self.end - self.start
+
+    def describe(self):
+        text = f"bytes {self.start}-{self.end}"
+        if self.start_time is not None:
+            text += f" ({self.start_time:.2f}s-{self.end_time:.2f}s)"
+        kinds = ', '.join(f"{count} {kind}" for kind, count in self.errors.items() if count)
+        return f"{text}: {kinds}"
+
+
+class IntegrityReport:
+    def __init__(self, size, packet_size, packet_count, ranges):
+        self.size = size
+        self.packet_size = packet_size
+        self.packet_count = packet_count
+        self.ranges = ranges
+
+    @property
+    def damaged(self):
+        return bool(self.ranges)
+
+    @property
+    def damaged_bytes(self):
+        return sum(r.size for r in self.ranges)
+
+    @property
+    def damaged_fraction(self):
+        return self.damaged_bytes / self.size if self.size else 0.0
+
+    def error_count(self, kind):
+        return sum(r.errors.get(kind, 0) for r in self.ranges)
+
+
+def _load_numpy():
+    """Import NumPy on first use, return the module or None"""
+    global np
+    if np is None:
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            np = False
+    return np or None
+
+
+def _runs(offsets, step):
+    """Group sorted packet offsets into (start, end, count) byte ranges"""
+    runs = []
+    for offset in offsets:
+        if runs and offset - runs[-1][1] <= step * MERGE_PACKETS:
+            runs[-1][1] = offset + step
+            runs[-1][2] += 1
+        else:
+            runs.append([offset, offset + step, 1])
+    return runs
+
+
+def _runs_numpy(offsets, step):
+    """Vectorised _runs for a sorted NumPy array of offsets"""
+    if not len(offsets):
+        return []
+    breaks = np.flatnonzero(np.diff(offsets) > step * (MERGE_PACKETS + 1)) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [len(offsets)]))
+    return [[int(offsets[s]), int(offsets[e - 1]) + step, int(e - s)] for s, e in zip(starts, ends)]
+
+
+def _segment_numpy(ts, start, end, pcr_pid):
+    """Check the aligned packets between two sync offsets with NumPy
+
+    Returns (packets scanned, {kind: runs}, pcr offsets, pcr values, offset
+    where sync was lost or None).
+    """
+    step = ts.packet_size
+    count = (end - start - TS_PACKET_SIZE) // step + 1
+    if count <= 0:
+        return 0, {}, [], [], None
+    view = np.frombuffer(ts.data, dtype=np.uint8, count=(count - 1) * step + TS_PACKET_SIZE, offset=start)
+    packets = np.lib.stride_tricks.as_strided(view, shape=(count, TS_PACKET_SIZE), strides=(step, 1))
+    # Copy out just the header and PCR bytes, the payload is never touched
+    headers = np.ascontiguousarray(packets[:, :HEADER_BYTES])
+
+    lost = None
+    bad_sync = headers[:, 0] != SYNC_BYTE
+    if bad_sync.any():
+        # A run of bad sync bytes means bytes were inserted or dropped, not corrupted
+        window = np.convolve(bad_sync.astype(np.int8), np.ones(SYNC_CHECK_PACKETS, dtype=np.int8), 'valid')
+        misaligned = np.flatnonzero(window == SYNC_CHECK_PACKETS)
+        if len(misaligned):
+            count = int(misaligned[0])
+            lost = start + count * step
+            headers, bad_sync = headers[:count], bad_sync[:count]
+
+    b1, b3, b4, b5 = headers[:, 1], headers[:, 3], headers[:, 4], headers[:, 5]
+    good = ~bad_sync
+    transport = good & (b1 & 0x80 != 0)
+    pid = (b1 & 0x1F).astype(np.uint16) << 8 | headers[:, 2]
+    has_adaptation = (b3 & 0x20 != 0) & (b4 > 0)
+
+    # Continuity counters only advance on packets with payload, per PID
+    checked = np.flatnonzero(good & (b3 & 0x10 != 0) & (pid != NULL_PID))
+    checked_pids = pid[checked]
+    continuity = []
+    for value in np.flatnonzero(np.bincount(checked_pids, minlength=NULL_PID + 1)):
+        index = checked[checked_pids == value]
+        counters = b3[index] & 0x0F
+        delta = (counters[1:] - counters[:-1]) & 0x0F
+        # A repeated counter is a legal duplicate packet
+        gaps = index[1:][delta > 1]
+        discontinuity = has_adaptation[gaps] & (b5[gaps] & 0x80 != 0)
+        continuity.append(gaps[~discontinuity])
+    continuity = np.sort(np.concatenate(continuity)) if continuity else np.empty(0, dtype=np.intp)
+
+    def byte_offsets(indices):
+        return start + indices.astype(np.int64) * step
+
+    runs = {
+        'sync': _runs_numpy(byte_offsets(np.flatnonzero(bad_sync)), step),
+        'transport': _runs_numpy(byte_offsets(np.flatnonzero(transport)), step),
+        'continuity': _runs_numpy(byte_offsets(continuity), step),
+    }
+
+    pcr_offsets, pcr_values = [], []
+    if pcr_pid is not None:
+        has_pcr = np.flatnonzero(good & has_adaptation & (pid == pcr_pid) & (b4 >= 7) & (b5 & 0x10 != 0))
+        spacing = PCR_SPACING // step
+        has_pcr = has_pcr[np.flatnonzero(np.diff(has_pcr // spacing, prepend=-1))]
+        fields = headers[has_pcr, 6:11].astype(np.int64)
+        values = fields[:, 0] << 25 | fields[:, 1] << 17 | fields[:, 2] << 9 | fields[:, 3] << 1 | fields[:, 4] >> 7
+        pcr_offsets, pcr_values = byte_offsets(has_pcr).tolist(), values.tolist()
+    return count, runs, pcr_offsets, pcr_values, lost
+
+
+def _segment_python(ts, start, end, pcr_pid):
+    """Pure Python version of _segment_numpy"""
+    data = ts.data
+    step = ts.packet_size
+    damaged = {kind: [] for kind in ERROR_KINDS}
+    pcr_offsets, pcr_values = [], []
+    counters = {}
+    bad_streak = 0
+    lost = None
+    count = 0
+    pos = start
+    while pos + TS_PACKET_SIZE <= end:
+        if data[pos] != SYNC_BYTE:
+            damaged['sync'].append(pos)
+            bad_streak += 1
+            if bad_streak == SYNC_CHECK_PACKETS:
+                lost = pos - (SYNC_CHECK_PACKETS - 1) * step
+                del damaged['sync'][-SYNC_CHECK_PACKETS:]
+                count -= SYNC_CHECK_PACKETS - 1
+                break
+            pos += step
+            count += 1
+            continue
+        bad_streak = 0
+        count += 1
+        pid, _, _ = ts.header(pos)
+        b3 = data[pos + 3]
+        if data[pos + 1] & 0x80:
+            damaged['transport'].append(pos)
+        if pid != NULL_PID:
+            has_adaptation = b3 & 0x20 and data[pos + 4] > 0
+            if b3 & 0x10:
+                counter = b3 & 0x0F
+                previous = counters.get(pid)
+                discontinuity = has_adaptation and data[pos + 5] & 0x80
+                if previous is not None and (counter - previous) & 0x0F > 1 and not discontinuity:
+                    damaged['continuity'].append(pos)
+                counters[pid] = counter
+            if pid == pcr_pid and has_adaptation and (not pcr_offsets or pos - pcr_offsets[-1] >= PCR_SPACING):
+                pcr = ts.pcr(pos)
+                if pcr is not None:
+                    pcr_offsets.append(pos)
+                    pcr_values.append(pcr)
+        pos += step
+    runs = {kind: _runs(offsets, step) for kind, offsets in damaged.items()}
+    return count, runs, pcr_offsets, pcr_values, lost
+
+
+def _unwrap(values):
+    """Unwrap a sequence of 33-bit clock values into a monotonic timeline"""
+    unwrapped = []
+    for value in values:
+        unwrapped.append(unwrap_timestamp(value, unwrapped[-1]) if unwrapped else value)
+    return unwrapped
+
+
+def _time_at(offset, pcr_offsets, pcr_times):
+    """Interpolate the stream time at a byte offset from the PCR samples"""
+    if not pcr_offsets:
+        return None
+    i = bisect_right(pcr_offsets, offset)
+    if i == 0:
+        return pcr_times[0]
+    if i == len(pcr_offsets):
+        return pcr_times[-1]
+    o0, o1 = pcr_offsets[i - 1], pcr_offsets[i]
+    t0, t1 = pcr_times[i - 1], pcr_times[i]
+    return t0 + (t1 - t0) * (offset - o0) / (o1 - o0)
+
+
+def _merge_ranges(runs_by_kind, step):
+    """Combine the runs of every error kind into sorted, non-overlapping ranges"""
+    events = sorted((start, end, kind, count) for kind, runs in runs_by_kind.items()
+                    for start, end, count in runs)
+    ranges = []
+    for start, end, kind, count in events:
+        if ranges and start - ranges[-1].end <= step * MERGE_PACKETS:
+            current = ranges[-1]
+            current.end = max(current.end, end)
+        else:
+            current = DamagedRange(start, end, dict.fromkeys(ERROR_KINDS, 0))
+            ranges.append(current)
+        current.errors[kind] += count
+    return ranges
+
+
+def scan_file(input_file, use_numpy=None):
+    """Scan a transport stream and return an IntegrityReport
+
+    use_numpy=None uses NumPy when it is available.
+    """
+    if use_numpy is not False:
+        use_numpy = _load_numpy() is not None
+    scan_segment = _segment_numpy if use_numpy else _segment_python
+
+    with TransportStream.open(input_file) as ts:
+        step = ts.packet_size
+        pcr_pid, _ = ts.streams(limit=4 * 1024 * 1024)
+        runs_by_kind = {kind: [] for kind in ERROR_KINDS}
+        pcr_offsets, pcr_values = [], []
+        packet_count = 0
+
+        # Scan aligned segments, resynchronising wherever the packet grid breaks
+        pos = ts.first_sync
+        # Bytes before the first packet, not counting an M2TS timestamp header
+        leading = pos - (step - TS_PACKET_SIZE)
+        if leading > 0:
+            runs_by_kind['sync'].append([0, leading, 1])
+        while pos is not None and pos < ts.size:
+            count, runs, offsets, values, lost = scan_segment(ts, pos, ts.size, pcr_pid)
+            packet_count += count
+            for kind, kind_runs in runs.items():
+                runs_by_kind[kind] += kind_runs
+            pcr_offsets += offsets
+            pcr_values += values
+            if lost is None:
+                break
+            pos = ts.find_sync(lost + 1)
+            # Everything up to the next aligned sync byte is unreadable
+            gap_end = ts.size if pos is None else pos
+            runs_by_kind['sync'].append([lost, gap_end, max(1, (gap_end - lost) // step)])
+
+        pcr_times = [(value - pcr_values[0]) / PTS_HZ for value in _unwrap(pcr_values)] if pcr_values else []
+        ranges = _merge_ranges(runs_by_kind, step)
+        for damaged in ranges:
+            damaged.start_time = _time_at(damaged.start, pcr_offsets, pcr_times)
+            damaged.end_time = _time_at(damaged.end, pcr_offsets, pcr_times)
+        return IntegrityReport(ts.size, step, packet_count, ranges)
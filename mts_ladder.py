@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - Rendition Ladder
+Builds a single ffmpeg filtergraph that deinterlaces once, splits the video
+and scales it for every rung, so several resolutions share one decode.
+"""
+
+import os
+
+from mts_encoders import DEFAULT_ENCODER, encoder_args
+
+# HEIGHT[:CRF] per rung, CRF falls back to the --crf value
+DEFAULT_LADDER = '1080,720:20,480:22'
+
+
+def parse_ladder(spec, default_crf=18, max_crf=51):
+    """Parse 'HEIGHT[:CRF],...' into a list of rung dicts, highest first"""
+    rungs = []
+    for item in spec.split(','):
+        item = item.strip().lower()
+        if not item:
+            continue
+        height, _, crf = item.partition(':')
+        height = height.rstrip('p')
+        try:
+            rung = {'height': int(height), 'crf': int(crf) if crf else default_crf}
+        except ValueError:
+            raise ValueError(f"Invalid ladder rung '{item}', expected HEIGHT[:CRF]") from None
+        if rung['height'] <= 0 or not 0 <= rung['crf'] <= max_crf:
+            raise ValueError(f"Invalid ladder rung '{item}'")
+        rung['name'] = f"{rung['height']}p"
+        rungs.append(rung)
+
+    if not rungs:
+        raise ValueError("The ladder needs at least one rung")
+    return sorted(rungs, key=lambda rung: rung['height'], reverse=True)
+
+
+def rung_output_path(output_file, rung):
+    """Return the output file for one rung, e.g. clip_720p.mp4"""
+    base, ext = os.path.splitext(output_file)
+    return f"{base}_{rung['name']}{ext or '.mp4'}"
+
+
+def ladder_filtergraph(rungs):
+    """Deinterlace once, split, and scale each branch to its rung height"""
+    labels = ''.join(f"[r{i}]" for i in range(len(rungs)))
+    chains = [f"[0:v:0]yadif=deint=interlaced,split={len(rungs)}{labels}"]
+    for i, rung in enumerate(rungs):
+        chains.append(f"[r{i}]scale=-2:{rung['height']}[v{i}]")
+    return ';'.join(chains)
+
+
+def ladder_output_args(rungs, output_files, preset='medium', encoder=DEFAULT_ENCODER, threads=None, tune=None):
+    """ffmpeg output options for every rung, in rung order"""
+    args = []
+    for i, (rung, output_file) in enumerate(zip(rungs, output_files)):
+        args += [
+            '-map', f"[v{i}]", '-map', '0:a:0?',
+            *encoder_args(encoder, rung['crf'], preset, threads, tune, rung['height']),
+            '-c:a', 'aac', '-b:a', '192k',
+            '-f', 'mp4', '-movflags', '+faststart', output_file
+        ]
+    return args
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - Worker Resource Limits
+Keeps ffmpeg workers from starving other services: per job class
+niceness, I/O scheduling class and address space cap, applied by
+wrapper commands before ffmpeg starts, plus disjoint CPU core sets for
+parallel batch workers.
+"""
+
+import os
+import queue
+import shutil
+
+# copy: lossless remux, encode: full conversion, preview: the quick tier of
+# --preview-first, background: the high-quality tier that replaces it
+JOB_CLASSES = ('copy', 'encode', 'preview', 'background')
+# Applied unless --limits overrides them
+DEFAULT_LIMITS = {'background': 'nice=10,ionice=best-effort:7'}
+
+IONICE_CLASSES = {'realtime': '1', 'best-effort': '2', 'idle': '3'}
+SIZE_SUFFIXES = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+
+def parse_size(value):
+    """Parse a byte count such as 4G or 512M"""
+    value = value.strip().lower().rstrip('b')
+    multiplier = SIZE_SUFFIXES.get(value[-1:], 1)
+    number = value[:-1] if value[-1:] in SIZE_SUFFIXES else value
+    try:
+        size = int(float(number) * multiplier)
+    except ValueError:
+        raise ValueError(f"invalid size: {value}") from None
+    if size <= 0:
+        raise ValueError(f"invalid size: {value}")
+    return size
+
+
+class ProcessLimits:
+    def __init__(self, nice=0, ionice=None, ionice_level=None, memory=None):
+        self.nice = nice
+        # IONICE_CLASSES key and priority 0 (highest) to 7 within the class
+        self.ionice = ionice
+        self.ionice_level = ionice_level
+        # Address space cap in bytes
+        self.memory = memory
+
+    @classmethod
+    def parse(cls, spec):
+        """Parse 'nice=N,ionice=CLASS[:LEVEL],memory=SIZE' (any subset)"""
+        limits = cls()
+        for item in filter(None, (part.strip() for part in spec.split(','))):
+            key, _, value = item.partition('=')
+            try:
+                if key == 'nice':
+                    limits.nice = int(value)
+                elif key == 'ionice':
+                    name, _, level = value.partition(':')
+                    if name not in IONICE_CLASSES or (level and not 0 <= int(level) <= 7):
+                        raise ValueError
+                    limits.ionice = name
+                    limits.ionice_level = int(level) if level else None
+                elif key == 'memory':
+                    limits.memory = parse_size(value)
+                else:
+                    raise ValueError
+            except ValueError:
+                raise ValueError(f"Invalid limit '{item}', expected nice=N, ionice=CLASS[:LEVEL] "
+                                 "or memory=SIZE") from None
+        return limits
+
+    def describe(self):
+        parts = []
+        if self.nice:
+            parts.append(f"nice {self.nice:+d}")
+        if self.ionice:
+            parts.append(f"ionice {self.ionice}" + (f":{self.ionice_level}" if self.ionice_level is not None else ''))
+        if self.memory:
+            parts.append(f"memory {self.memory // (1024 * 1024)} MB")
+        return ', '.join(parts) or 'none'
+
+    def wrap_command(self, cmd):
+        """Prefix cmd with nice, util-linux prlimit and ionice for the limits that are set
+
+        The tools apply each limit to themselves and exec the next one, so
+        ffmpeg starts with every limit in place and nothing runs in the
+        forked child before exec. Tools that are not installed are skipped.
+        """
+        prefix = []
+        if self.nice and shutil.which('nice'):
+            prefix += ['nice', '-n', str(self.nice)]
+        if self.memory and shutil.which('prlimit'):
+            prefix += ['prlimit', f"--as={self.memory}", '--']
+        if self.ionice and shutil.which('ionice'):
+            prefix += ['ionice', '-c', IONICE_CLASSES[self.ionice]]
+            if self.ionice_level is not None and self.ionice != 'idle':
+                prefix += ['-n', str(self.ionice_level)]
+        return prefix + list(cmd)
+
+
+def pin_command(cmd, cores=None):
+    """Prefix cmd with util-linux taskset to run it on a set of CPU cores"""
+    if not cores or not shutil.which('taskset'):
+        return list(cmd)
+    return ['taskset', '-c', ','.join(str(core) for core in sorted(cores)), *cmd]
+
+
+def parse_limits(specs):
+    """Map job classes to ProcessLimits from 'CLASS:OPTIONS' specs over DEFAULT_LIMITS"""
+    merged = dict(DEFAULT_LIMITS)
+    for spec in specs or ():
+        job_class, _, options = spec.partition(':')
+        if job_class not in JOB_CLASSES:
+            raise ValueError(f"Unknown job class '{job_class}', expected one of {', '.join(JOB_CLASSES)}")
+        merged[job_class] = options
+    return {job_class: ProcessLimits.parse(options) for job_class, options in merged.items()}
+
+
+def core_sets(workers):
+    """Split the usable CPU cores into disjoint sets, one per worker"""
+    if not hasattr(os, 'sched_getaffinity'):
+        return []
+    cores = sorted(os.sched_getaffinity(0))
+    workers = max(1, min(workers, len(cores)))
+    size, extra = divmod(len(cores), workers)
+    # Neighbouring core numbers usually share caches, so keep each set contiguous
+    sets = []
+    start = 0
+    for i in range(workers):
+        end = start + size + (1 if i < extra else 0)
+        sets.append(set(cores[start:end]))
+        start = end
+    return sets
+
+
+class CorePool:
+    """Hands each running batch worker a core set no other worker holds"""
+
+    def __init__(self, workers):
+        self.sets = queue.Queue()
+        for cores in core_sets(workers):
+            self.sets.put(cores)
+
+    def acquire(self):
+        try:
+            return self.sets.get_nowait()
+        except queue.Empty:
+            return None
+
+    def release(self, cores):
+        if cores:
+            self.sets.put(cores)
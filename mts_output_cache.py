@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - Shared Output Cache
+Keeps finished MP4s in a directory that several users and machines can
+share, keyed by a hash of the source content and the settings that shape
+the output. A repeat conversion gets a reflink or copy of the cached
+file instead of an encode. File locks let one writer per key encode while
+the others wait for its result, and the least recently used entries are
+evicted once the cache grows past its size cap.
+"""
+
+import os
+import json
+import time
+import errno
+import hashlib
+from contextlib import contextmanager
+
+from mts_dedup import full_digest, link_output
+from mts_encoders import ENCODERS
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Bump when a change to the conversion makes older entries wrong
+CACHE_VERSION = 1
+DEFAULT_CACHE_SIZE = 100 * 1024 ** 3
+ENTRY_SUFFIX = '.mp4'
+# Written with each entry; its mtime records the entry's last use
+META_SUFFIX = '.json'
+LOCK_SUFFIX = '.lock'
+# Temporary files older than this were left by a writer that died
+STALE_SECONDS = 24 * 3600
+
+
+def source_digest(input_file, cache=None):
+    """Hash of a file's content, kept in the probe cache until the file changes"""
+    digest = cache.get(input_file, 'content') if cache else None
+    if digest is None:
+        digest = full_digest(input_file, os.path.getsize(input_file))
+        if cache:
+            cache.set(input_file, 'content', digest)
+    return digest
+
+
+def cache_settings(copy_streams=False, encoder='h264', crf=18, preset='medium', tune=None, analyze=False,
+                   preflight=None, start=None, end=None, target_quality=None):
+    """The settings that decide a conversion's output, in one canonical form
+
+    Thread counts, resource limits and scratch staging are left out: they
+    change how the output is made, not what it contains. A quality target
+    replaces the CRF it resolves to, so a hit skips the search as well.
+    """
+    settings = {'preflight': preflight, 'start': start or None, 'end': end}
+    if copy_streams:
+        return dict(settings, copy=True)
+    backend = ENCODERS[encoder]
+    tunable = backend['tunes'].keys() | backend['tune_params'].keys()
+    return dict(settings, codec=backend['codec'], preset=backend['presets'][preset],
+                crf=None if target_quality else crf,
+                target=f"{target_quality[0]}={target_quality[1]:g}" if target_quality else None,
+                tune=tune if tune in tunable else None, analyze=bool(analyze))
+
+
+def cache_key(digest, settings):
+    text = json.dumps({'version': CACHE_VERSION, 'source': digest, 'settings': settings}, sort_keys=True)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _lock(f, exclusive=True, wait=True):
+    """flock f, return False instead of waiting when wait is off and another holder has it"""
+    if fcntl is None:
+        return True
+    mode = (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | (0 if wait else fcntl.LOCK_NB)
+    try:
+        fcntl.flock(f.fileno(), mode)
+    except OSError as e:
+        if not wait and e.errno in (errno.EAGAIN, errno.EACCES):
+            return False
+        raise
+    return True
+
+
+class CacheEntry:
+    """One key of the cache, held under its writer lock"""
+
+    def __init__(self, cache, key, metadata=None):
+        self.cache = cache
+        self.key = key
+        self.path = cache.entry_path(key)
+        # Stored alongside the output, e.g. the source's name
+        self.metadata = metadata or {}
+
+    def deliver(self, destination):
+        """Link the cached output to destination, return the method used or None on a miss"""
+        if not os.path.isfile(self.path):
+            return None
+        try:
+            # Never a hardlink: retagging one delivered file in place would change the entry
+            method = link_output(self.path, destination, hardlink=False)
+        except OSError:
+            # Evicted or unreadable, convert instead
+            return None
+        try:
+            os.utime(self.path[:-len(ENTRY_SUFFIX)] + META_SUFFIX)
+        except OSError:
+            pass
+        return method
+
+    def store(self, output_file):
+        """Add a finished output to the cache, then evict down to the size cap"""
+        base = self.path[:-len(ENTRY_SUFFIX)]
+        temp_path = os.path.join(os.path.dirname(base), f".{self.key}.{os.getpid()}.tmp")
+        temp_meta = f"{temp_path}{META_SUFFIX}"
+        try:
+            # Reflink first so the cache shares the output's blocks where the filesystem allows,
+            # a hardlink would let edits of the output change the entry
+            link_output(output_file, temp_path, hardlink=False)
+            with open(temp_meta, 'w', encoding='utf-8') as f:
+                json.dump(dict(self.metadata, key=self.key, created=time.time()), f)
+            os.replace(temp_meta, base + META_SUFFIX)
+            os.replace(temp_path, self.path)
+        except OSError:
+            for path in (temp_path, temp_meta):
+                if os.path.exists(path):
+                    os.remove(path)
+            return False
+        self.cache.evict(keep=self.key)
+        return True
+
+
+class OutputCache:
+    """Content-addressed MP4 outputs in root, at most max_bytes of them"""
+
+    def __init__(self, root, max_bytes=DEFAULT_CACHE_SIZE):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.objects = os.path.join(root, 'objects')
+        os.makedirs(self.objects, exist_ok=True)
+
+    def entry_path(self, key):
+        return os.path.join(self.objects, key[:2], key + ENTRY_SUFFIX)
+
+    @contextmanager
+    def claim(self, key, metadata=None, on_wait=None):
+        """Hold the writer lock of key, yield its CacheEntry
+
+        Another process or thread converting the same key makes this wait
+        for it, calling on_wait first, so its output can be delivered
+        instead of encoding the same thing twice.
+        """
+        entry = CacheEntry(self, key, metadata)
+        os.makedirs(os.path.dirname(entry.path), exist_ok=True)
+        with open(entry.path[:-len(ENTRY_SUFFIX)] + LOCK_SUFFIX, 'a+b') as lock:
+            if not _lock(lock, wait=False):
+                if on_wait:
+                    on_wait()
+                _lock(lock)
+            yield entry
+
+    def entries(self):
+        """(last use, size, key) of every cached output"""
+        found = []
+        now = time.time()
+        for shard in os.scandir(self.objects):
+            if not shard.is_dir():
+                continue
+            for item in os.scandir(shard.path):
+                try:
+                    if item.name.startswith('.'):
+                        if now - item.stat().st_mtime > STALE_SECONDS:
+                            os.remove(item.path)
+                        continue
+                    if not item.name.endswith(ENTRY_SUFFIX):
+                        continue
+                    key = item.name[:-len(ENTRY_SUFFIX)]
+                    try:
+                        used = os.stat(os.path.join(shard.path, key + META_SUFFIX)).st_mtime
+                    except OSError:
+                        used = item.stat().st_mtime
+                    found.append((used, item.stat().st_size, key))
+                except OSError:
+                    # Removed by another evicting process
+                    continue
+        return found
+
+    def evict(self, keep=None):
+        """Remove least recently used outputs until the cache fits max_bytes, return bytes freed"""
+        with open(os.path.join(self.root, 'evict' + LOCK_SUFFIX), 'a+b') as lock:
+            if not _lock(lock, wait=False):
+                # Another process is already evicting
+                return 0
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            freed = 0
+            for _, size, key in entries:
+                if total - freed <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+                base = self.entry_path(key)[:-len(ENTRY_SUFFIX)]
+                with open(base + LOCK_SUFFIX, 'a+b') as entry_lock:
+                    # An entry being rewritten is not the least recently used one
+                    if not _lock(entry_lock, wait=False):
+                        continue
+                    # The lock file stays: a waiting writer may already have it open
+                    for path in (base + ENTRY_SUFFIX, base + META_SUFFIX):
+                        try:
+                            os.remove(path)
+                        except OSError:
+                            pass
+                freed += size
+            return freed
@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - Paths
+Locations of the per-user files kept between runs.
+"""
+
+import os
+import sys
+
+
+def user_cache_dir():
+    """Return (and create) the directory for caches kept between runs"""
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    elif sys.platform == 'darwin':
+        base = os.path.expanduser('~/Library/Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    path = os.path.join(base, 'mts-converter')
+    os.makedirs(path, exist_ok=True)
+    return path
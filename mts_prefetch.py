@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - Batch Read-Ahead
+Pulls the start of the next files of a batch into the page cache while
+the current file encodes, so slow USB and network sources do not leave
+the encoder waiting between files. How far ahead it reads follows the
+memory the page cache can spare.
+"""
+
+import os
+import threading
+
+# Bytes warmed at the start of each upcoming file
+PREFETCH_BYTES = 1024 ** 3
+# Smallest window worth reading when memory is tight
+MIN_PREFETCH_BYTES = 64 * 1024 * 1024
+# Files warmed ahead at most, and the share of available memory they may use
+MAX_PREFETCH_FILES = 4
+PAGE_CACHE_SHARE = 0.5
+# Seconds between checks of available memory while the budget is used up
+RECHECK_SECONDS = 5.0
+READ_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def available_memory():
+    """Bytes the page cache could grow by without swapping, None if unknown"""
+    try:
+        with open('/proc/meminfo', 'r', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        # Free pages only, which undercounts reclaimable cache
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def warm_file(path, length, cancelled=None):
+    """Start reading the first length bytes of path into the page cache
+
+    Uses posix_fadvise(WILLNEED) where available, which queues the reads
+    without copying data, and plain reads elsewhere. cancelled() is polled
+    between chunks of the fallback.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(fd, 0, length, os.POSIX_FADV_WILLNEED)
+            return
+        done = 0
+        while done < length and not (cancelled and cancelled()):
+            chunk = os.read(fd, min(READ_CHUNK_SIZE, length - done))
+            if not chunk:
+                break
+            done += len(chunk)
+    finally:
+        os.close(fd)
+
+
+class ReadAhead:
+    """Background page cache warming of the files a batch starts next
+
+    Files are added in the order they will probably start; release()
+    hands a file over to its encode, or drops one that will not be
+    converted, and frees its share of the budget.
+    """
+
+    def __init__(self, log=None, memory=available_memory):
+        self.log = log
+        self.memory = memory
+        self.condition = threading.Condition()
+        self.queue = []
+        # Warmed files not released yet, and the bytes warmed for each
+        self.warmed = {}
+        self.released = set()
+        self.closed = False
+        self.worker = None
+
+    def add(self, path):
+        with self.condition:
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._run, daemon=True)
+                self.worker.start()
+            # A file released after one pass of a batch (e.g. its preview) can be read ahead again
+            self.released.discard(path)
+            self.queue.append(path)
+            self.condition.notify_all()
+
+    def release(self, path):
+        """Stop reading ahead for path"""
+        with self.condition:
+            self.released.add(path)
+            if path in self.queue:
+                self.queue.remove(path)
+            self.warmed.pop(path, None)
+            self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.queue.clear()
+            self.condition.notify_all()
+
+    def _budget(self, size):
+        """Bytes to warm of a file of size now, 0 to wait, None to skip warming it"""
+        available = self.memory()
+        if available is None:
+            # Unknown memory: read ahead one file only
+            budget = PREFETCH_BYTES
+        else:
+            budget = int(available * PAGE_CACHE_SHARE)
+        budget -= sum(self.warmed.values())
+        wanted = min(size, PREFETCH_BYTES)
+        if len(self.warmed) >= MAX_PREFETCH_FILES or budget < min(wanted, MIN_PREFETCH_BYTES):
+            # Wait for a warmed file to be released; with none warmed, memory is simply short
+            return 0 if self.warmed else None
+        return min(wanted, budget)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                path = self.queue.pop(0)
+
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            with self.condition:
+                length = self._budget(size)
+                while length == 0 and not self.closed and path not in self.released:
+                    self.condition.wait(RECHECK_SECONDS)
+                    length = self._budget(size)
+                if not length or self.closed or path in self.released:
+                    continue
+                self.warmed[path] = length
+
+            try:
+                warm_file(path, length, lambda: path in self.released or self.closed)
+            except OSError:
+                with self.condition:
+                    self.warmed.pop(path, None)
+                continue
+            if self.log:
+                self.log(f"Read ahead: {os.path.basename(path)} ({length / (1024 * 1024):.0f} MB)")
@@ -0,0 +1,514 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - Media Probing
+Reads duration and stream layout of MTS files for planning batch work,
+and caches the results per file between runs.
+"""
+
+import os
+import json
+import time
+import threading
+import subprocess
+
+try:
+    import sqlite3
+except ImportError:  # Python built without SQLite
+    sqlite3 = None
+
+from mts_paths import user_cache_dir
+from mts_ts import PTS_HZ, PTS_WRAP, TS_PACKET_SIZE, TransportStream, TransportStreamError, unwrap_timestamp
+
+# The native prober only looks at the start and the end of a file
+PROBE_HEAD_BYTES = 512 * 1024
+PROBE_TAIL_BYTES = 1024 * 1024
+# First tail window, doubled until a timestamp is found
+PROBE_TAIL_STEP = 64 * 1024
+# How much video payload is searched for the sequence parameter set
+SPS_SEARCH_BYTES = 64 * 1024
+
+PROBE_CACHE_FILE = 'probe_cache.sqlite'
+# Part of every cache key, bump when a change to probing makes older entries wrong
+PROBE_CACHE_VERSION = 2
+# Seconds to wait for another process writing the cache
+PROBE_CACHE_TIMEOUT = 30
+# Entries not stored again for this long, or beyond the newest this many, are pruned on open
+PROBE_CACHE_MAX_AGE = 180 * 24 * 3600
+PROBE_CACHE_MAX_ROWS = 200000
+
+H264_SLICE = 1
+H264_IDR = 5
+H264_SEI = 6
+H264_SPS = 7
+H264_SEI_PIC_TIMING = 1
+# pic_struct values of frames showing the bottom field first, e.g. 4 = bottom, top
+H264_BOTTOM_FIRST = {2, 4, 6}
+# profile_idc values whose SPS carries chroma format and scaling lists
+H264_HIGH_PROFILES = {100, 110, 122, 244, 44, 83, 86, 118, 128, 138, 139, 134, 135}
+
+
+def ffprobe_media(input_file):
+    """Get duration and video size with ffprobe, return a dict or None"""
+    cmd = [
+        'ffprobe', '-v', 'quiet', '-print_format', 'json',
+        '-show_entries', 'format=duration,start_time:stream=codec_type,codec_name,width,height,field_order',
+        input_file
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        data = json.loads(result.stdout)
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError):
+        return None
+
+    info = {'duration': None, 'duration_us': None, 'start_time': None, 'width': None, 'height': None,
+            'interlaced': None, 'field_order': None, 'streams': []}
+    try:
+        info['duration'] = float(data.get('format', {}).get('duration'))
+        info['duration_us'] = round(info['duration'] * 1000000)
+    except (TypeError, ValueError):
+        pass
+    try:
+        info['start_time'] = float(data.get('format', {}).get('start_time'))
+    except (TypeError, ValueError):
+        pass
+
+    for stream in data.get('streams', []):
+        info['streams'].append([stream.get('codec_type'), stream.get('codec_name')])
+        if stream.get('codec_type') == 'video' and info['width'] is None:
+            info['width'] = stream.get('width')
+            info['height'] = stream.get('height')
+            field_order = stream.get('field_order')
+            if field_order and field_order != 'unknown':
+                info['interlaced'] = field_order != 'progressive'
+                # tt and tb code the top field first, bb and bt the bottom one
+                if info['interlaced']:
+                    info['field_order'] = 'bff' if field_order.startswith('b') else 'tff'
+    return info
+
+
+class _BitReader:
+    """Reads Exp-Golomb coded H.264 header fields"""
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def bits(self, count):
+        value = 0
+        for _ in range(count):
+            byte = self.data[self.pos >> 3]
+            value = value << 1 | (byte >> (7 - (self.pos & 7))) & 1
+            self.pos += 1
+        return value
+
+    def ue(self):
+        zeros = 0
+        while not self.bits(1):
+            zeros += 1
+        return (1 << zeros) - 1 + self.bits(zeros)
+
+    def se(self):
+        value = self.ue()
+        return (value + 1) // 2 if value & 1 else -(value // 2)
+
+
+def parse_sps(nal):
+    """Return profile, level, cropped size and interlacing from an H.264 SPS NAL unit as a dict
+
+    The fields needed to read slice headers and picture timing come along,
+    e.g. the width of frame_num.
+    """
+    # Drop emulation prevention bytes before reading the bitstream
+    reader = _BitReader(nal[1:].replace(b'\x00\x00\x03', b'\x00\x00'))
+    profile_idc = reader.bits(8)
+    constraint_flags = reader.bits(8)
+    level_idc = reader.bits(8)
+    reader.ue()  # seq_parameter_set_id
+    chroma_format_idc = 1
+    separate_colour_plane = False
+    if profile_idc in H264_HIGH_PROFILES:
+        chroma_format_idc = reader.ue()
+        if chroma_format_idc == 3 and reader.bits(1):
+            separate_colour_plane = True
+            chroma_format_idc = 0  # separate colour planes crop like monochrome
+        reader.ue()  # bit_depth_luma_minus8
+        reader.ue()  # bit_depth_chroma_minus8
+        reader.bits(1)  # qpprime_y_zero_transform_bypass_flag
+        if reader.bits(1):
+            for i in range(12 if chroma_format_idc == 3 else 8):
+                if reader.bits(1):
+                    last_scale = next_scale = 8
+                    for _ in range(16 if i < 6 else 64):
+                        if next_scale:
+                            next_scale = (last_scale + reader.se()) % 256
+                        last_scale = next_scale or last_scale
+
+    log2_max_frame_num = reader.ue() + 4
+    pic_order_cnt_type = reader.ue()
+    if pic_order_cnt_type == 0:
+        reader.ue()
+    elif pic_order_cnt_type == 1:
+        reader.bits(1)
+        reader.se()
+        reader.se()
+        for _ in range(reader.ue()):
+            reader.se()
+    reader.ue()  # max_num_ref_frames
+    reader.bits(1)  # gaps_in_frame_num_value_allowed_flag
+    width_mbs = reader.ue() + 1
+    height_map_units = reader.ue() + 1
+    frame_mbs_only = reader.bits(1)
+    if not frame_mbs_only:
+        reader.bits(1)  # mb_adaptive_frame_field_flag
+    reader.bits(1)  # direct_8x8_inference_flag
+
+    width = width_mbs * 16
+    height = (2 - frame_mbs_only) * height_map_units * 16
+    if reader.bits(1):
+        left, right, top, bottom = (reader.ue() for _ in range(4))
+        sub_width, sub_height = {0: (1, 1), 1: (2, 2), 2: (2, 1), 3: (1, 1)}.get(chroma_format_idc, (2, 2))
+        width -= sub_width * (left + right)
+        height -= sub_height * (2 - frame_mbs_only) * (top + bottom)
+    sps = {'profile_idc': profile_idc, 'constraint_flags': constraint_flags, 'level_idc': level_idc,
+           'width': width, 'height': height, 'interlaced': not frame_mbs_only,
+           'separate_colour_plane': separate_colour_plane, 'log2_max_frame_num': log2_max_frame_num,
+           'pic_struct_present': False, 'delay_lengths': None}
+    try:
+        if reader.bits(1):  # vui_parameters_present_flag
+            sps.update(_parse_vui(reader))
+    except IndexError:
+        # Truncated VUI, the fields above are complete
+        pass
+    return sps
+
+
+def _parse_hrd(reader):
+    """Skip HRD parameters, return the bit lengths of cpb_removal_delay and dpb_output_delay"""
+    cpb_count = reader.ue() + 1
+    reader.bits(8)  # bit_rate_scale, cpb_size_scale
+    for _ in range(cpb_count):
+        reader.ue()  # bit_rate_value_minus1
+        reader.ue()  # cpb_size_value_minus1
+        reader.bits(1)  # cbr_flag
+    reader.bits(5)  # initial_cpb_removal_delay_length_minus1
+    lengths = (reader.bits(5) + 1, reader.bits(5) + 1)
+    reader.bits(5)  # time_offset_length
+    return lengths
+
+
+def _parse_vui(reader):
+    """Read the VUI fields that shape picture timing SEI messages"""
+    if reader.bits(1) and reader.bits(8) == 255:  # aspect_ratio_idc
+        reader.bits(32)  # sar_width, sar_height
+    if reader.bits(1):
+        reader.bits(1)  # overscan_appropriate_flag
+    if reader.bits(1):
+        reader.bits(4)  # video_format, video_full_range_flag
+        if reader.bits(1):
+            reader.bits(24)  # colour primaries, transfer and matrix
+    if reader.bits(1):
+        reader.ue()  # chroma_sample_loc_type_top_field
+        reader.ue()  # chroma_sample_loc_type_bottom_field
+    if reader.bits(1):
+        reader.bits(65)  # num_units_in_tick, time_scale, fixed_frame_rate_flag
+    delay_lengths = None
+    for _ in range(2):  # NAL and VCL HRD
+        if reader.bits(1):
+            delay_lengths = _parse_hrd(reader)
+    if delay_lengths:
+        reader.bits(1)  # low_delay_hrd_flag
+    return {'pic_struct_present': bool(reader.bits(1)), 'delay_lengths': delay_lengths}
+
+
+def _sei_pic_struct(sps, nal):
+    """pic_struct of the picture timing message in an SEI NAL unit, or None"""
+    data = nal[1:].replace(b'\x00\x00\x03', b'\x00\x00')
+    pos = 0
+    while pos < len(data) and data[pos] != 0x80:
+        payload_type = payload_size = 0
+        while data[pos] == 0xFF:
+            payload_type += 255
+            pos += 1
+        payload_type += data[pos]
+        pos += 1
+        while data[pos] == 0xFF:
+            payload_size += 255
+            pos += 1
+        payload_size += data[pos]
+        pos += 1
+        if payload_type == H264_SEI_PIC_TIMING:
+            reader = _BitReader(data[pos:pos + payload_size])
+            if sps['delay_lengths']:
+                reader.bits(sum(sps['delay_lengths']))  # cpb_removal_delay, dpb_output_delay
+            return reader.bits(4)
+        pos += payload_size
+    return None
+
+
+def parse_field_order(sps, nals):
+    """'tff' or 'bff' for interlaced video, from the NAL units that follow its SPS
+
+    Picture timing SEI messages name the field order of frames, a field
+    picture's slice header its parity. Without either, AVCHD's top field
+    first is assumed.
+    """
+    try:
+        if sps['pic_struct_present']:
+            for nal in nals.get('sei', []):
+                pic_struct = _sei_pic_struct(sps, nal)
+                if pic_struct is not None:
+                    return 'bff' if pic_struct in H264_BOTTOM_FIRST else 'tff'
+        nal = nals.get('slice')
+        if nal is not None:
+            reader = _BitReader(nal[1:].replace(b'\x00\x00\x03', b'\x00\x00'))
+            reader.ue()  # first_mb_in_slice
+            reader.ue()  # slice_type
+            reader.ue()  # pic_parameter_set_id
+            if sps['separate_colour_plane']:
+                reader.bits(2)  # colour_plane_id
+            reader.bits(sps['log2_max_frame_num'])
+            if reader.bits(1):  # field_pic_flag
+                return 'bff' if reader.bits(1) else 'tff'
+    except IndexError:
+        # Truncated header
+        pass
+    return 'tff'
+
+
+def _find_nals(ts, pid, start, end):
+    """Collect video payload between two sync offsets, return its first SPS and the NAL units after it
+
+    'sei' lists the SEI NAL units up to the first 'slice', of which only
+    the start is kept, which holds its header.
+    """
+    chunk = bytearray()
+    pos = start
+    while pos + TS_PACKET_SIZE <= end and len(chunk) < SPS_SEARCH_BYTES:
+        packet_pid, _, payload = ts.header(pos)
+        if packet_pid == pid and payload is not None:
+            chunk += ts.data[payload:pos + TS_PACKET_SIZE]
+        pos += ts.packet_size
+
+    kinds = {H264_SPS: 'sps', H264_SEI: 'sei', H264_SLICE: 'slice', H264_IDR: 'slice'}
+    found = {}
+    nal_start = chunk.find(b'\x00\x00\x01')
+    while 0 <= nal_start < len(chunk) - 3:
+        nal_end = chunk.find(b'\x00\x00\x01', nal_start + 3)
+        kind = kinds.get(chunk[nal_start + 3] & 0x1F)
+        # Only what follows the first SPS can be read with it
+        if kind == 'sps' and kind not in found or kind in ('sei', 'slice') and 'sps' in found:
+            if nal_end < 0 and kind != 'slice':
+                break
+            nal = bytes(chunk[nal_start + 3:nal_end if nal_end >= 0 else len(chunk)]).rstrip(b'\x00')
+            if kind == 'sei':
+                found.setdefault('sei', []).append(nal)
+            else:
+                found[kind] = nal
+            if kind == 'slice':
+                break
+        nal_start = nal_end
+    return found
+
+
+def _pes_timestamps(ts, pids, start, end, first_only=False):
+    """Return {pid: [PTS of each PES start]} for packets between two sync offsets
+
+    With first_only the scan stops as soon as every PID has one timestamp.
+    """
+    found = {}
+    pos = start
+    while pos is not None and pos + TS_PACKET_SIZE <= end:
+        packet_pid, pusi, payload = ts.header(pos)
+        if packet_pid is None:
+            # Lost sync in a damaged region, pick it up again
+            pos = ts.find_sync(pos + 1, end)
+            continue
+        if pusi and payload is not None and packet_pid in pids:
+            pts, _ = ts.pes_header(payload)
+            if pts is not None:
+                found.setdefault(packet_pid, []).append(pts)
+                if first_only and len(found) == len(pids):
+                    break
+        pos += ts.packet_size
+    return found
+
+
+def _pts_range(timestamps, pick):
+    """Unwrap per-PID timestamp lists and return the lowest or highest PTS"""
+    values = []
+    for pts_list in timestamps.values():
+        values += [unwrap_timestamp(pts, pts_list[0]) for pts in pts_list]
+    return pick(values) if values else None
+
+
+def native_probe(input_file):
+    """Probe a transport stream from its head and tail only, return a dict or None"""
+    try:
+        ts = TransportStream.open(input_file)
+    except (OSError, TransportStreamError):
+        return None
+    with ts:
+        head_end = min(ts.size, ts.first_sync + PROBE_HEAD_BYTES)
+        _, streams = ts.streams(limit=head_end)
+        if not streams:
+            return None
+        info = {'duration': None, 'duration_us': None, 'start_time': None, 'width': None, 'height': None,
+                'interlaced': None, 'field_order': None,
+                'streams': [[s['codec_type'], s['codec_name']] for s in streams]}
+        pids = {s['pid'] for s in streams if s['codec_type'] in ('video', 'audio')}
+        video = next((s for s in streams if s['codec_type'] == 'video'), None)
+
+        head = _pes_timestamps(ts, pids, ts.first_sync, head_end, first_only=True)
+        first = _pts_range(head, min)
+
+        # Read backwards from the end in growing windows until a timestamp turns up
+        last, window = None, PROBE_TAIL_STEP
+        while last is None and window <= PROBE_TAIL_BYTES:
+            start = ts.find_sync(max(ts.first_sync, ts.size - window))
+            if start is None:
+                break
+            last = _pts_range(_pes_timestamps(ts, pids, start, ts.size), max)
+            window *= 2
+
+        if first is not None and last is not None:
+            # Modulo the wrap period copes with a 33-bit rollover between head and tail
+            ticks = (last - first) % PTS_WRAP
+            info['duration_us'] = ticks * 1000000 // PTS_HZ
+            info['duration'] = info['duration_us'] / 1000000
+            info['start_time'] = first % PTS_WRAP / PTS_HZ
+
+        if video is not None and video['codec_name'] == 'h264':
+            sps = _read_sps(ts, video['pid'], head_end)
+            if sps:
+                info['width'], info['height'] = sps['width'], sps['height']
+                info['interlaced'] = sps['interlaced']
+                info['field_order'] = sps['field_order']
+    if info['duration'] is None:
+        return None
+    return info
+
+
+def _read_sps(ts, pid, head_end):
+    nals = _find_nals(ts, pid, ts.first_sync, head_end)
+    if 'sps' not in nals:
+        return None
+    try:
+        sps = parse_sps(nals['sps'])
+    except IndexError:
+        # Truncated SPS
+        return None
+    sps['field_order'] = parse_field_order(sps, nals) if sps['interlaced'] else None
+    return sps
+
+
+def read_sps(input_file):
+    """Return the parsed SPS of a transport stream's H.264 video with its field order, or None"""
+    try:
+        ts = TransportStream.open(input_file)
+    except (OSError, TransportStreamError):
+        return None
+    with ts:
+        head_end = min(ts.size, ts.first_sync + PROBE_HEAD_BYTES)
+        _, streams = ts.streams(limit=head_end)
+        video = next((s for s in streams if s['codec_name'] == 'h264'), None)
+        return _read_sps(ts, video['pid'], head_end) if video else None
+
+
+class ProbeCache:
+    """Per-file probe and analysis results, invalidated when a file changes
+
+    Entries live in an SQLite database, one row per file and section, so
+    storing a result costs the same however many files are cached, and
+    several processes can share the cache without losing each other's
+    entries.
+    """
+
+    def __init__(self, path=None):
+        if path is None:
+            try:
+                path = os.path.join(user_cache_dir(), PROBE_CACHE_FILE)
+            except OSError:
+                # No writable cache location, run without caching
+                path = None
+        if sqlite3 is None:
+            path = None
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = None
+
+    def _key(self, input_file):
+        if self.path is None:
+            raise OSError("probe cache is disabled")
+        info = os.stat(input_file)
+        return f"{PROBE_CACHE_VERSION}|{os.path.abspath(input_file)}|{info.st_size}|{info.st_mtime_ns}"
+
+    def _connect(self):
+        if self.db is None:
+            # Worker threads share the connection under self.lock
+            db = sqlite3.connect(self.path, timeout=PROBE_CACHE_TIMEOUT, isolation_level=None,
+                                 check_same_thread=False)
+            # The cache can always be rebuilt, so skip the fsync after each write
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=OFF')
+            columns = [row[1] for row in db.execute('PRAGMA table_info(entries)')]
+            if columns and 'stored' not in columns:
+                # Written before rows had a time to prune by
+                db.execute('DROP TABLE entries')
+            db.execute('CREATE TABLE IF NOT EXISTS entries '
+                       '(file TEXT, section TEXT, value TEXT, stored REAL, PRIMARY KEY (file, section))')
+            db.execute('CREATE INDEX IF NOT EXISTS entries_stored ON entries (stored)')
+            self._prune(db)
+            self.db = db
+        return self.db
+
+    def _prune(self, db):
+        """Drop rows of other cache versions, old rows and the oldest beyond the row cap
+
+        Rows of edited or deleted files are never looked up again, so
+        without this the cache would only grow.
+        """
+        db.execute('DELETE FROM entries WHERE substr(file, 1, ?) != ?',
+                   (len(f"{PROBE_CACHE_VERSION}|"), f"{PROBE_CACHE_VERSION}|"))
+        db.execute('DELETE FROM entries WHERE stored < ?', (time.time() - PROBE_CACHE_MAX_AGE,))
+        db.execute('DELETE FROM entries WHERE stored <= (SELECT stored FROM entries '
+                   'ORDER BY stored DESC LIMIT 1 OFFSET ?)', (PROBE_CACHE_MAX_ROWS,))
+
+    def get(self, input_file, section):
+        """Return a cached section ('media', 'analysis', ...) for a file, or None"""
+        try:
+            key = self._key(input_file)
+        except OSError:
+            return None
+        with self.lock:
+            try:
+                row = self._connect().execute('SELECT value FROM entries WHERE file = ? AND section = ?',
+                                              (key, section)).fetchone()
+            except sqlite3.Error:
+                return None
+        try:
+            return json.loads(row[0]) if row else None
+        except ValueError:
+            return None
+
+    def set(self, input_file, section, value):
+        """Store a section for a file"""
+        try:
+            key = self._key(input_file)
+        except OSError:
+            return
+        with self.lock:
+            try:
+                self._connect().execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                                        (key, section, json.dumps(value), time.time()))
+            except sqlite3.Error:
+                pass
+
+
+def probe_media(input_file, cache=None):
+    """Probe a file natively or with ffprobe, reusing cached results when the file is unchanged"""
+    info = cache.get(input_file, 'media') if cache else None
+    if info is None:
+        info = native_probe(input_file) or ffprobe_media(input_file)
+        if info is not None and cache:
+            cache.set(input_file, 'media', info)
+    return info
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - Target Quality Search
+Finds the highest CRF that still meets a quality target for one source:
+a few short windows spread across the file are encoded at candidate CRFs
+and scored against the source with VMAF, SSIM or PSNR, and the CRF is
+found by binary search.
+"""
+
+import math
+import os
+import re
+import subprocess
+import tempfile
+
+from mts_analysis import window_starts
+from mts_encoders import ENCODERS, encoder_args
+
+QUALITY_WINDOWS = 3
+WINDOW_SECONDS = 4.0
+MIN_WINDOW_SECONDS = 1.0
+# Media encoded by a whole search, as a share of the file; shorter files get fewer, shorter windows
+SEARCH_BUDGET = 0.1
+
+# ffmpeg filter scoring [distorted][reference], its value range and how it reports the mean
+QUALITY_METRICS = {
+    'vmaf': {'filter': 'libvmaf', 'range': (0.0, 100.0),
+             'pattern': re.compile(r'VMAF score[:=]\s*([0-9.]+)')},
+    'ssim': {'filter': 'ssim', 'range': (0.0, 1.0),
+             'pattern': re.compile(r'SSIM .*All:([0-9.]+)')},
+    'psnr': {'filter': 'psnr', 'range': (0.0, 100.0),
+             'pattern': re.compile(r'PSNR .*average:([0-9.]+|inf)')},
+}
+
+
+def parse_target(spec, filters=()):
+    """Parse 'METRIC=VALUE' or a bare VMAF score into (metric, value)
+
+    filters lists the local ffmpeg's filters; a bare score needs libvmaf.
+    """
+    metric, _, value = spec.rpartition('=')
+    metric = metric.strip().lower()
+    if not metric:
+        if 'libvmaf' not in filters:
+            raise ValueError("This FFmpeg build has no libvmaf, give the target as ssim=VALUE or psnr=VALUE")
+        metric = 'vmaf'
+    if metric not in QUALITY_METRICS:
+        raise ValueError(f"Unknown quality metric '{metric}', expected one of {', '.join(QUALITY_METRICS)}")
+    if QUALITY_METRICS[metric]['filter'] not in filters:
+        raise ValueError(f"This FFmpeg build has no {QUALITY_METRICS[metric]['filter']} filter")
+    try:
+        target = float(value)
+    except ValueError:
+        raise ValueError(f"Invalid quality target: {spec}") from None
+    low, high = QUALITY_METRICS[metric]['range']
+    if not low < target <= high:
+        raise ValueError(f"A {metric} target must be above {low:g} and at most {high:g}")
+    return metric, target
+
+
+def sample_windows(duration, candidates):
+    """Number and length of the windows to sample when a search tries that many CRFs"""
+    per_candidate = (duration or 0) * SEARCH_BUDGET / candidates
+    length = max(MIN_WINDOW_SECONDS, min(WINDOW_SECONDS, per_candidate / QUALITY_WINDOWS))
+    return max(1, min(QUALITY_WINDOWS, int(per_candidate / length))), length
+
+
+def extract_windows(input_file, duration, workdir, windows=QUALITY_WINDOWS, length=WINDOW_SECONDS):
+    """Copy short video windows out of the source, return their paths"""
+    clips = []
+    for i, start in enumerate(window_starts(duration, windows, length)):
+        clip = os.path.join(workdir, f"window{i}.ts")
+        # Stream copy from the keyframe before start; the encodes and the scoring
+        # both read this clip, so its frames line up exactly
+        cmd = ['ffmpeg', '-hide_banner', '-nostats', '-ss', f"{start:.3f}", '-i', input_file,
+               '-t', f"{length:.3f}", '-map', '0:v:0', '-c', 'copy', '-f', 'mpegts', '-y', clip]
+        result = subprocess.run(cmd, capture_output=True)
+        if result.returncode == 0 and os.path.getsize(clip) > 0:
+            clips.append(clip)
+    return clips
+
+
+def score_clip(clip, crf, metric, encoder, preset, tune=None, threads=None, height=None, video_filter=None):
+    """Encode one window at crf and score it against the window, None if either step fails"""
+    encoded = f"{os.path.splitext(clip)[0]}.crf{crf}.mp4"
+    filter_args = ['-vf', video_filter] if video_filter else []
+    cmd = ['ffmpeg', '-hide_banner', '-nostats', '-i', clip, *filter_args,
+           *encoder_args(encoder, crf, preset, threads, tune, height), '-an', '-f', 'mp4', '-y', encoded]
+    if subprocess.run(cmd, capture_output=True).returncode != 0:
+        return None
+
+    # The reference goes through the same filters as the encode, both restart at zero
+    reference = f"{video_filter}," if video_filter else ''
+    graph = (f"[0:v]setpts=PTS-STARTPTS[distorted];[1:v]{reference}setpts=PTS-STARTPTS[reference];"
+             f"[distorted][reference]{QUALITY_METRICS[metric]['filter']}")
+    cmd = ['ffmpeg', '-hide_banner', '-nostats', '-i', encoded, '-i', clip,
+           '-lavfi', graph, '-f', 'null', '-']
+    result = subprocess.run(cmd, capture_output=True, text=True, errors='replace')
+    os.remove(encoded)
+    scores = QUALITY_METRICS[metric]['pattern'].findall(result.stderr)
+    if result.returncode != 0 or not scores:
+        return None
+    return float(scores[-1])
+
+
+def search_crf(input_file, media, target, encoder, preset='medium', tune=None, threads=None, video_filter=None,
+               log=None):
+    """Binary search for the highest CRF whose sampled windows meet target on average
+
+    target is a (metric, value) pair. Returns a dict with the chosen
+    'crf', its 'score' and 'tested' (number of candidate CRFs encoded),
+    or None when no window could be sampled or scored.
+    """
+    metric, value = target
+    low, high = ENCODERS[encoder]['crf_search']
+    height = media.get('height')
+    scores = {}
+
+    # A binary search over the range tries about this many CRFs
+    candidates = math.ceil(math.log2(high - low + 1)) + 1
+    windows, length = sample_windows(media.get('duration'), candidates)
+
+    with tempfile.TemporaryDirectory(prefix='mts-quality-') as workdir:
+        clips = extract_windows(input_file, media.get('duration'), workdir, windows, length)
+        if not clips:
+            return None
+
+        def score(crf):
+            if crf not in scores:
+                results = [score_clip(clip, crf, metric, encoder, preset, tune, threads, height, video_filter)
+                           for clip in clips]
+                results = [result for result in results if result is not None]
+                scores[crf] = sum(results) / len(results) if results else None
+                if log:
+                    shown = 'failed' if scores[crf] is None else f"{scores[crf]:.4g}"
+                    log(f"  CRF {crf}: {metric} {shown}")
+            return scores[crf]
+
+        # Quality falls as CRF rises, so keep the highest CRF known to pass in low
+        while low < high:
+            mid = (low + high + 1) // 2
+            result = score(mid)
+            if result is None:
+                return None
+            if result >= value:
+                low = mid
+            else:
+                high = mid - 1
+        if score(low) is None:
+            return None
+    return {'crf': low, 'score': scores[low], 'tested': len(scores)}
+
+
+def find_target_crf(input_file, media, target, encoder, preset='medium', tune=None, threads=None,
+                    video_filter=None, cache=None, log=None):
+    """search_crf, reusing a result cached with the file's probe data for the same settings"""
+    key = f"{encoder}|{preset}|{tune}|{target[0]}={target[1]:g}|{video_filter or ''}"
+    results = (cache.get(input_file, 'quality') if cache else None) or {}
+    if key in results:
+        return dict(results[key], cached=True)
+
+    result = search_crf(input_file, media, target, encoder, preset, tune, threads, video_filter, log)
+    if result is not None and cache:
+        cache.set(input_file, 'quality', {**results, key: result})
+    return result
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - Batch Scheduler
+Runs batch jobs on a small worker pool while capping how many jobs touch
+the same block device at once and reserving output space before each job
+starts.
+"""
+
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from mts_probe import probe_media
+
+# Estimated output size as a fraction of the input size
+COPY_SIZE_RATIO = 1.05
+ENCODE_SIZE_RATIO = 0.75
+# Headroom on output sizes predicted from the speed history
+PREDICTED_SIZE_MARGIN = 1.15
+# Free space that is never handed out to reservations
+SPACE_MARGIN = 256 * 1024 * 1024
+
+SCHEDULING_POLICIES = ('fifo', 'longest-first', 'shortest-first')
+# Used to turn a file size into a cost when a file cannot be probed (AVCHD 1080)
+ASSUMED_BITRATE = 24000000
+ASSUMED_PIXELS = 1920 * 1080
+PROBE_WORKERS = 8
+# Jobs at once on a spinning or removable disk unless --per-device says otherwise
+SLOW_DEVICE_JOBS = 1
+
+
+def device_id(path):
+    """Return the block device of path, or of its nearest existing parent"""
+    path = os.path.abspath(path)
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except FileNotFoundError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                raise
+            path = parent
+
+
+def slow_device(dev):
+    """Whether a block device is a spinning disk or removable (USB drive, card reader)
+
+    Parallel jobs on those seek each other to a crawl. Devices without an
+    entry under /sys, e.g. network shares or other platforms, count as fast.
+    """
+    path = f"/sys/dev/block/{os.major(dev)}:{os.minor(dev)}"
+    if os.path.exists(os.path.join(path, 'partition')):
+        # A partition's queue and removable flag belong to its disk
+        path = os.path.join(path, '..')
+    for flag in ('queue/rotational', 'removable'):
+        try:
+            with open(os.path.join(path, flag), 'r', encoding='ascii') as f:
+                if f.read().strip() == '1':
+                    return True
+        except OSError:
+            continue
+    return False
+
+
+def estimate_output_bytes(input_size, copy_streams=False, predicted_bytes=None):
+    """Estimate the size of the MP4 produced from an input of input_size bytes
+
+    predicted_bytes, the size earlier runs of the same profile suggest,
+    replaces the fixed ratios when known.
+    """
+    if predicted_bytes:
+        return int(predicted_bytes * PREDICTED_SIZE_MARGIN)
+    ratio = COPY_SIZE_RATIO if copy_streams else ENCODE_SIZE_RATIO
+    return int(input_size * ratio)
+
+
+def estimate_job_cost(job):
+    """Estimate encode work for a job as duration times frame size"""
+    info = job.media
+    if info is None and job.source is None:
+        info = job.media = probe_media(job.input_file)
+    if info and info['duration'] and info['width'] and info['height']:
+        return info['duration'] * info['width'] * info['height']
+
+    size = job.source.size if job.source else os.path.getsize(job.input_file)
+    return size * 8 / ASSUMED_BITRATE * ASSUMED_PIXELS
+
+
+def predicted_job_cost(job):
+    return job.prediction['seconds']
+
+
+def order_jobs(jobs, policy='fifo', cost=estimate_job_cost):
+    """Return jobs in the order given by a scheduling policy"""
+    if policy == 'fifo':
+        return jobs
+    if policy not in SCHEDULING_POLICIES:
+        raise ValueError(f"Unknown scheduling policy: {policy}")
+
+    jobs = list(jobs)
+    if cost is estimate_job_cost and jobs and all(job.prediction for job in jobs):
+        # Predicted encode times only compare with each other, so use them when every job has one
+        cost = predicted_job_cost
+    with ThreadPoolExecutor(max_workers=PROBE_WORKERS) as pool:
+        for job, job_cost in zip(jobs, pool.map(cost, jobs)):
+            job.cost = job_cost
+
+    # Longest first keeps one long clip from finishing alone at the end
+    return sorted(jobs, key=lambda job: job.cost, reverse=policy == 'longest-first')
+
+
+class BatchJob:
+    def __init__(self, input_file, output_file, write_dirs=None, estimated_bytes=0, source=None):
+        self.input_file = input_file
+        self.output_file = output_file
+        # Stream to read instead of input_file, e.g. an archive member
+        self.source = source
+        self.write_dirs = write_dirs or [os.path.dirname(os.path.abspath(output_file))]
+        self.estimated_bytes = estimated_bytes
+        self.cost = None
+        self.index = 0
+        self.result = None
+        # Files written besides output_file, e.g. thumbnails
+        self.outputs = []
+        self.error = None
+        # One dict per ffmpeg run: strategy, resilient, returncode, failure
+        self.attempts = []
+        # Output tier currently at output_file: None, 'preview' or 'final'
+        self.tier = None
+        # Encode time and output size predicted from the speed history, or None
+        self.prediction = None
+        # probe_media result of input_file, probed once when the job is created
+        self.media = None
+
+        # Filled in by the scheduler
+        self.devices = set()
+        self.write_devices = {}
+
+    @property
+    def name(self):
+        return self.source.name if self.source else os.path.basename(self.input_file)
+
+
+class DeviceScheduler:
+    def __init__(self, max_jobs=1, per_device=None):
+        self.max_jobs = max(1, max_jobs)
+        # None caps only slow devices, at SLOW_DEVICE_JOBS
+        self.per_device = None if per_device is None else max(1, per_device)
+        self.device_caps = {}
+
+        self.condition = threading.Condition()
+        self.running = 0
+        self.device_load = {}
+        self.reserved = {}
+
+    def run(self, jobs, worker, on_reject=None):
+        """Run worker(job) for every job and store its return value in job.result
+
+        jobs may be a generator; jobs are pulled from it as workers free up,
+        so the first job starts as soon as it has been produced.
+        """
+        source = iter(jobs)
+        exhausted = False
+        pending = []
+        seen = []
+        # Discovered but unstarted jobs kept so busy devices can be skipped
+        lookahead = self.max_jobs * 4
+
+        while True:
+            if not exhausted and len(pending) < lookahead:
+                try:
+                    job = next(source)
+                except StopIteration:
+                    exhausted = True
+                else:
+                    seen.append(job)
+                    job.index = len(seen)
+                    self._resolve_devices(job)
+                    pending.append(job)
+
+            with self.condition:
+                if not pending:
+                    if exhausted:
+                        break
+                    continue
+
+                job = self._next_ready(pending)
+                if job is not None:
+                    pending.remove(job)
+                    self._acquire(job)
+                    threading.Thread(target=self._run_job, args=(job, worker), daemon=True).start()
+                    continue
+
+                if not exhausted and len(pending) < lookahead:
+                    # Look further ahead for a job on an idle device
+                    continue
+                if self.running == 0:
+                    # Nothing is running, so no space will be freed up
+                    job = pending.pop(0)
+                    job.result = False
+                    job.error = "not enough free space on the destination"
+                    if on_reject:
+                        on_reject(job)
+                    continue
+                self.condition.wait()
+
+        with self.condition:
+            while self.running:
+                self.condition.wait()
+
+        return seen
+
+    def _resolve_devices(self, job):
+        """Look up the source and destination devices of a job"""
+        job.devices = {device_id(job.input_file)}
+        job.write_devices = {}
+        for write_dir in job.write_dirs:
+            dev = device_id(write_dir)
+            job.devices.add(dev)
+            job.write_devices.setdefault(dev, write_dir)
+
+    def _next_ready(self, pending):
+        """Return the first pending job that can start now"""
+        if self.running >= self.max_jobs:
+            return None
+        for job in pending:
+            if any(self.device_load.get(dev, 0) >= self._device_cap(dev) for dev in job.devices):
+                continue
+            if not self._has_space(job):
+                continue
+            return job
+        return None
+
+    def _device_cap(self, dev):
+        """Most jobs that may touch dev at once"""
+        if self.per_device is not None:
+            return self.per_device
+        if dev not in self.device_caps:
+            self.device_caps[dev] = SLOW_DEVICE_JOBS if slow_device(dev) else self.max_jobs
+        return self.device_caps[dev]
+
+    def _has_space(self, job):
+        """Check the job's estimated output against free space minus reservations"""
+        for dev, write_dir in job.write_devices.items():
+            free = shutil.disk_usage(write_dir).free - self.reserved.get(dev, 0) - SPACE_MARGIN
+            if job.estimated_bytes > free:
+                return False
+        return True
+
+    def _acquire(self, job):
+        self.running += 1
+        for dev in job.devices:
+            self.device_load[dev] = self.device_load.get(dev, 0) + 1
+        for dev in job.write_devices:
+            self.reserved[dev] = self.reserved.get(dev, 0) + job.estimated_bytes
+
+    def _release(self, job):
+        self.running -= 1
+        for dev in job.devices:
+            self.device_load[dev] -= 1
+        for dev in job.write_devices:
+            self.reserved[dev] -= job.estimated_bytes
+
+    def _run_job(self, job, worker):
+        try:
+            job.result = worker(job)
+        except Exception as e:
+            job.result = False
+            job.error = str(e)
+        finally:
+            with self.condition:
+                self._release(job)
+                self.condition.notify_all()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - Scratch Staging
+Writes encodes to a fast local scratch directory and publishes finished
+files to their destination in the background, so a partially written
+MP4 is never visible at the final output path.
+"""
+
+import os
+import errno
+import itertools
+import queue
+import shutil
+import threading
+
+# Copy buffer used when the destination is on a different filesystem
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+PARTIAL_SUFFIX = '.partial'
+
+
+def atomic_publish(source, destination):
+    """Move source to destination, ending in an atomic rename"""
+    dest_dir = os.path.dirname(os.path.abspath(destination))
+    os.makedirs(dest_dir, exist_ok=True)
+
+    try:
+        os.replace(source, destination)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    # Different filesystem: copy next to the destination under a hidden
+    # name, flush it to disk, then rename it into place
+    partial = os.path.join(dest_dir, '.' + os.path.basename(destination) + PARTIAL_SUFFIX)
+    try:
+        with open(source, 'rb') as src, open(partial, 'wb') as dst:
+            shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+            dst.flush()
+            os.fsync(dst.fileno())
+        shutil.copymode(source, partial)
+        os.replace(partial, destination)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    os.remove(source)
+
+
+class ScratchStager:
+    def __init__(self, scratch_dir):
+        self.scratch_dir = scratch_dir
+        os.makedirs(scratch_dir, exist_ok=True)
+
+        self.counter = itertools.count(1)
+        self.pending = queue.Queue()
+        self.failures = []
+        self.worker = None
+        self.lock = threading.Lock()
+
+    def stage_path(self, output_file):
+        """Return a unique scratch path for the given output file"""
+        name, ext = os.path.splitext(os.path.basename(output_file))
+        unique = f"{name}.{os.getpid()}-{next(self.counter)}{ext}"
+        return os.path.join(self.scratch_dir, unique)
+
+    def publish(self, staged_file, output_file):
+        """Queue a finished scratch file to be moved to its destination"""
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self._publish_worker, daemon=True)
+                self.worker.start()
+        self.pending.put((staged_file, output_file))
+
+    def discard(self, staged_file):
+        """Remove a scratch file that will not be published"""
+        try:
+            os.remove(staged_file)
+        except OSError:
+            pass
+
+    def wait(self):
+        """Block until every queued file is published, return the failures
+
+        Each failure is (output_file, staged_file, error); the staged file
+        is kept so the finished encode can still be recovered.
+        """
+        self.pending.join()
+        failures, self.failures = self.failures, []
+        return failures
+
+    def _publish_worker(self):
+        """Move queued scratch files out while the next job encodes"""
+        while True:
+            staged_file, output_file = self.pending.get()
+            try:
+                atomic_publish(staged_file, output_file)
+            except OSError as e:
+                self.failures.append((output_file, staged_file, e))
+            finally:
+                self.pending.task_done()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - Stream Helpers
+Pipe handling for feeding MTS data into ffmpeg and reading MP4 data out
+of it without intermediate files.
+"""
+
+import os
+import sys
+import stat
+import errno
+from contextlib import nullcontext
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Kernel pipe buffer requested for streamed input (Linux default max is 1 MB)
+PIPE_BUFFER_SIZE = 1024 * 1024
+# fcntl.F_SETPIPE_SZ is only exposed by Python 3.10+, the value is fixed on Linux
+F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+
+# Movie flags for an MP4 written to a non-seekable pipe; delay_moov waits for the
+# first packets, which copied AC-3 needs before its sample description can be written
+FRAGMENTED_MP4_FLAGS = '+frag_keyframe+empty_moov+default_base_moof+delay_moov'
+# Piped input read ahead of ffmpeg to find the stream layout
+PEEK_BYTES = 512 * 1024
+# Streamed output held back until ffmpeg has written this much, so an
+# attempt that fails early can be retried without corrupting stdout
+HELD_OUTPUT_BYTES = 16 * 1024 * 1024
+
+
+def is_pipe(fd):
+    """Check whether a file descriptor refers to a pipe"""
+    try:
+        return stat.S_ISFIFO(os.fstat(fd).st_mode)
+    except OSError:
+        return False
+
+
+def enlarge_pipe(fd, size=PIPE_BUFFER_SIZE):
+    """Grow the kernel buffer of a pipe, return the new size or None"""
+    if fcntl is None or not sys.platform.startswith('linux') or not is_pipe(fd):
+        return None
+    while size >= 64 * 1024:
+        try:
+            return fcntl.fcntl(fd, F_SETPIPE_SZ, size)
+        except OSError:
+            # Above /proc/sys/fs/pipe-max-size for this user, try smaller
+            size //= 2
+    return None
+
+
+def write_all(fd, data):
+    """Write a whole buffer to a file descriptor"""
+    view = memoryview(data)
+    while view:
+        written = os.write(fd, view)
+        view = view[written:]
+
+
+def copy_range(src_fd, dst_fd, offset, length):
+    """Copy a byte range of a file into a pipe, zero-copy where the OS allows"""
+    splice = getattr(os, 'splice', None)
+    sendfile = getattr(os, 'sendfile', None) if sys.platform.startswith('linux') else None
+
+    while length > 0:
+        chunk = min(length, PIPE_BUFFER_SIZE)
+        try:
+            if splice:
+                copied = splice(src_fd, dst_fd, chunk, offset_src=offset)
+            elif sendfile:
+                copied = sendfile(dst_fd, src_fd, offset, chunk)
+            else:
+                os.lseek(src_fd, offset, os.SEEK_SET)
+                data = os.read(src_fd, chunk)
+                write_all(dst_fd, data)
+                copied = len(data)
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, errno.ENOSYS) or not (splice or sendfile):
+                raise
+            # Kernel refused zero-copy for this pair, step down one method
+            if splice:
+                splice = None
+            else:
+                sendfile = None
+            continue
+
+        if copied == 0:
+            break
+        offset += copied
+        length -= copied
+
+
+def copy_stream(stream, dst_fd):
+    """Copy a readable file object into a pipe through one reused buffer"""
+    buffer = bytearray(PIPE_BUFFER_SIZE)
+    view = memoryview(buffer)
+    while True:
+        count = stream.readinto(buffer)
+        if not count:
+            break
+        write_all(dst_fd, view[:count])
+
+
+def feed_source(source, dst_fd):
+    """Stream an archive member or other source into ffmpeg's stdin
+
+    Sources with a prefix attribute have those bytes written first.
+    """
+    prefix = getattr(source, 'prefix', None)
+    if prefix:
+        write_all(dst_fd, prefix)
+    raw = source.raw_range()
+    if raw:
+        path, offset, length = raw
+        with open(path, 'rb') as f:
+            copy_range(f.fileno(), dst_fd, offset, length)
+    else:
+        with source.open() as stream:
+            copy_stream(stream, dst_fd)
+
+
+def peek_head(source, size=PEEK_BYTES):
+    """First bytes of a source without using it up, or None when only reading it would tell"""
+    prefix = getattr(source, 'prefix', None)
+    if prefix is not None:
+        return prefix
+    raw = source.raw_range()
+    if not raw:
+        return None
+    path, offset, length = raw
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(min(size, length))
+
+
+class PeekedInput:
+    """A pipe whose first bytes were read before ffmpeg starts, e.g. to look at its stream layout
+
+    Fed to ffmpeg like an archive member: the peeked bytes as the prefix,
+    then the rest of the pipe. stream may also be an opened archive member
+    that cannot be read twice, which display_name then names.
+    """
+    name = '-'
+    size = None
+
+    def __init__(self, stream, size=PEEK_BYTES, display_name='stdin'):
+        self.stream = stream
+        self.display_name = display_name
+        self.prefix = stream.read(size)
+
+    def raw_range(self):
+        return None
+
+    def open(self):
+        # The pipe is not ours to close
+        return nullcontext(self.stream)
+
+
+class HeldOutput:
+    """Relays a child's stdout to dst_fd, holding back the first hold bytes
+
+    Until that much has been written, a failed attempt can be discarded
+    and retried; released tells whether anything reached dst_fd yet.
+    """
+
+    def __init__(self, dst_fd, hold=HELD_OUTPUT_BYTES):
+        self.dst_fd = dst_fd
+        self.hold = hold
+        self.buffer = bytearray()
+        self.released = False
+
+    def relay(self, src):
+        """Copy the child's output file object until it closes"""
+        try:
+            while True:
+                data = os.read(src.fileno(), PIPE_BUFFER_SIZE)
+                if not data:
+                    break
+                if self.released:
+                    write_all(self.dst_fd, data)
+                    continue
+                self.buffer += data
+                if len(self.buffer) >= self.hold:
+                    self.release()
+        except OSError:
+            # Our reader went away; closing the pipe lets the child fail instead of blocking
+            src.close()
+
+    def release(self):
+        """Write out what is held back, after the attempt succeeded"""
+        write_all(self.dst_fd, self.buffer)
+        self.buffer = bytearray()
+        self.released = True
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - Throughput Statistics
+Parses ffmpeg's periodic stats lines into frame rate, speed factor and
+bitrate, smooths the conversion rate with an exponentially weighted
+moving average and turns it into an ETA for the current file and for a
+whole batch.
+"""
+
+import math
+import re
+import threading
+import time
+
+# Seconds over which older rate samples fade to about a third of their weight
+SMOOTHING_SECONDS = 5.0
+# Minimum seconds between two renderings of the live stats
+RENDER_INTERVAL = 0.5
+# No progress for this long marks a conversion as stalled
+STALL_SECONDS = 10.0
+
+STATS_PATTERN = re.compile(r'(frame|fps|bitrate|speed|time)=\s*(\S+)')
+
+
+def parse_time_value(text):
+    """Seconds from an ffmpeg HH:MM:SS.ms time, None if it is not one"""
+    parts = text.split(':')
+    if len(parts) != 3:
+        return None
+    try:
+        hours, minutes, seconds = (float(part) for part in parts)
+    except ValueError:
+        return None
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def parse_stats(line):
+    """Parse an ffmpeg 'frame= ... time= ... speed=' line into a dict, None for other lines
+
+    Keys present are those ffmpeg reported with a value: 'time' (seconds
+    of output written), 'frame', 'fps', 'bitrate' (kbit/s) and 'speed'
+    (media seconds per wall clock second).
+    """
+    stats = {}
+    for key, value in STATS_PATTERN.findall(line):
+        if key == 'time':
+            seconds = parse_time_value(value)
+            if seconds is not None:
+                stats['time'] = seconds
+            continue
+        # 'N/A' before the first frame, units such as 'kbits/s' and 'x' after the number
+        number = re.match(r'[0-9.]+', value)
+        if number:
+            try:
+                stats[key] = float(number.group())
+            except ValueError:
+                pass
+    return stats if 'time' in stats else None
+
+
+def format_duration(seconds):
+    """H:MM:SS for a duration or ETA in seconds, '?' when unknown"""
+    if seconds is None or seconds != seconds or seconds == float('inf'):
+        return '?'
+    seconds = int(seconds + 0.5)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class RateAverage:
+    """Exponentially weighted moving average of a rate, weighted by sample interval
+
+    Samples arrive at irregular intervals, so each one's weight follows
+    from the time it covers rather than from a fixed smoothing factor.
+    """
+
+    def __init__(self, smoothing=SMOOTHING_SECONDS):
+        self.smoothing = smoothing
+        self.rate = None
+        self.last_value = None
+        self.last_time = None
+
+    def update(self, value, now):
+        """Add the cumulative amount done at time now"""
+        if self.last_time is not None and now > self.last_time:
+            elapsed = now - self.last_time
+            sample = max(0.0, value - self.last_value) / elapsed
+            if self.rate is None:
+                self.rate = sample
+            else:
+                weight = 1 - math.exp(-elapsed / self.smoothing)
+                self.rate += weight * (sample - self.rate)
+        if self.last_time is None or now > self.last_time:
+            self.last_value = value
+            self.last_time = now
+        return self.rate
+
+
+class ThroughputMeter:
+    """Live statistics of one ffmpeg run from its stats lines"""
+
+    def __init__(self, total_duration=None, expected_speed=None, clock=time.monotonic):
+        self.total_duration = total_duration
+        # Speed to assume until the first measurements arrive, e.g. from the speed history
+        self.expected_speed = expected_speed
+        self.clock = clock
+        self.started = clock()
+        self.speed = RateAverage()
+        self.fps = None
+        self.bitrate = None
+        self.position = 0.0
+        self.last_advance = self.started
+        self.last_render = None
+
+    def update(self, stats):
+        """Feed one parse_stats result, return the smoothed speed factor"""
+        now = self.clock()
+        if stats['time'] > self.position:
+            self.last_advance = now
+        self.position = stats['time']
+        self.fps = stats.get('fps', self.fps)
+        self.bitrate = stats.get('bitrate', self.bitrate)
+        return self.speed.update(self.position, now)
+
+    @property
+    def fraction(self):
+        if not self.total_duration:
+            return None
+        return min(1.0, self.position / self.total_duration)
+
+    @property
+    def stalled(self):
+        return self.clock() - self.last_advance >= STALL_SECONDS
+
+    def eta(self):
+        """Seconds until this run finishes at the smoothed speed, None if unknown"""
+        if self.fraction == 1.0:
+            # A remux can finish before any rate was measured
+            return 0.0
+        speed = self.speed.rate or self.expected_speed
+        if not self.total_duration or not speed:
+            return None
+        return max(0.0, self.total_duration - self.position) / speed
+
+    def due(self, interval=RENDER_INTERVAL):
+        """True at most once per interval, for rate limited rendering"""
+        now = self.clock()
+        if self.last_render is not None and now - self.last_render < interval:
+            return False
+        self.last_render = now
+        return True
+
+    def describe(self):
+        """One line summary such as '42.0% | 48 fps | 1.93x | 8.1 Mbit/s | ETA 0:01:12'"""
+        parts = []
+        if self.fraction is not None:
+            parts.append(f"{self.fraction * 100:.1f}%")
+        if self.fps is not None:
+            parts.append(f"{self.fps:.0f} fps")
+        if self.stalled:
+            parts.append("stalled")
+        elif self.speed.rate is not None:
+            parts.append(f"{self.speed.rate:.2f}x")
+        if self.bitrate is not None:
+            parts.append(f"{self.bitrate / 1000:.1f} Mbit/s")
+        if self.total_duration:
+            parts.append(f"ETA {format_duration(self.eta())}")
+        else:
+            parts.append(f"at {format_duration(self.position)}")
+        return ' | '.join(parts)
+
+
+class BatchMeter:
+    """Progress of a batch, measured in input bytes so every file counts by its size
+
+    Jobs are added as they are discovered; running jobs report the fraction
+    of their input converted so far from their worker threads. Until the
+    first progress arrives, the ETA comes from the jobs' expected encode
+    times, shared among workers.
+    """
+
+    def __init__(self, workers=1, clock=time.monotonic):
+        self.workers = max(1, workers)
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.sizes = {}
+        self.done = {}
+        self.expected = {}
+        self.total_size = 0
+        self.total_done = 0.0
+        self.found = 0
+        self.finished = 0
+        # False while more jobs may still be discovered
+        self.complete = False
+        self.rate = RateAverage()
+
+    def add(self, key, size, expected_seconds=None):
+        with self.lock:
+            self.sizes[key] = max(1, size)
+            self.expected[key] = expected_seconds
+            self.done[key] = 0.0
+            self.total_size += self.sizes[key]
+            self.found += 1
+
+    def _set_done(self, key, amount):
+        change = amount - self.done[key]
+        self.done[key] = amount
+        self.total_done += change
+        if change < 0 and self.rate.last_value is not None:
+            # A retry starting over is not negative throughput
+            self.rate.last_value += change
+        self.rate.update(self.total_done, self.clock())
+
+    def progress(self, key, fraction):
+        """Record that fraction of the job's input has been converted"""
+        with self.lock:
+            if key in self.sizes:
+                self._set_done(key, self.sizes[key] * min(1.0, max(0.0, fraction)))
+
+    def _remove(self, key):
+        self._set_done(key, 0.0)
+        self.total_size -= self.sizes.pop(key)
+        del self.done[key]
+        del self.expected[key]
+
+    def finish(self, key, success=True):
+        """Mark a job done; a failed job's input leaves the batch total"""
+        with self.lock:
+            if key not in self.sizes:
+                return
+            self.finished += 1
+            if success:
+                self._set_done(key, self.sizes[key])
+            else:
+                self._remove(key)
+
+    def discard(self, key):
+        """Drop a job that will not be converted, e.g. a duplicate"""
+        with self.lock:
+            if key in self.sizes:
+                self._remove(key)
+                self.found -= 1
+
+    def eta(self):
+        """Seconds until every job found so far is converted, None if unknown"""
+        with self.lock:
+            if self.rate.rate:
+                return (self.total_size - self.total_done) / self.rate.rate
+            remaining = [(key, seconds) for key, seconds in self.expected.items()
+                         if self.done[key] < self.sizes[key]]
+            if not remaining or any(seconds is None for _, seconds in remaining):
+                return None
+            return sum(seconds * (1 - self.done[key] / self.sizes[key])
+                       for key, seconds in remaining) / self.workers
+
+    def describe(self):
+        with self.lock:
+            files = f"{self.finished}/{self.found}{'' if self.complete else '+'}"
+        return f"batch {files} files, ETA {format_duration(self.eta())}"
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - Two-Tier Delivery
+Builds the preview tier of a --preview-first conversion: a remux, or
+failing that a small ultrafast encode, published at the output path
+within seconds. The high-quality encode then runs as the 'background' job
+class (lower priority, see mts_limits) and is renamed over the preview
+once it is complete.
+"""
+
+import os
+
+TIERS = ('preview', 'final')
+
+PREVIEW_HEIGHT = 540
+PREVIEW_CRF = 28
+
+
+def preview_attempts(input_file, output_file, input_args=()):
+    """(description, ffmpeg command) pairs to try in order for the preview tier"""
+    head = ['ffmpeg', *input_args, '-i', input_file, '-map', '0:v:0', '-map', '0:a:0?']
+    tail = ['-f', 'mp4', '-movflags', '+faststart', '-y', output_file]
+    aac = ['-c:a', 'aac', '-b:a', '128k']
+    return [
+        ('remux', [*head, '-c', 'copy', *tail]),
+        # MP4 cannot carry every AVCHD audio format
+        ('remux with AAC audio', [*head, '-c:v', 'copy', *aac, *tail]),
+        (f"{PREVIEW_HEIGHT}p ultrafast encode",
+         [*head, '-vf', f"yadif=deint=interlaced,scale=-2:{PREVIEW_HEIGHT}",
+          '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', str(PREVIEW_CRF), *aac, *tail]),
+    ]
+
+
+def live_replacement_path(output_file):
+    """Hidden path next to output_file for a file to be renamed over it"""
+    directory, name = os.path.split(output_file)
+    base, ext = os.path.splitext(name)
+    return os.path.join(directory, f".{base}.{os.getpid()}.tier{ext or '.mp4'}")
@@ -5,9 +5,13 @@ import subprocess
 import threading
 import os
 import sys
-import re
 from pathlib import Path
 
+from mts_capabilities import get_capabilities
+from mts_encoders import DEFAULT_ENCODER, ENCODERS, PRESETS, TUNES, available_encoders, describe_encoder, encoder_args
+from mts_probe import native_probe
+from mts_throughput import ThroughputMeter, parse_stats
+
 class MTStoMP4Converter:
     def __init__(self):
         self.root = tk.Tk()
@@ -20,21 +24,39 @@ class MTStoMP4Converter:
         self.output_file = tk.StringVar()
         self.conversion_running = False
         self.ffmpeg_process = None
-
-        # Check if ffmpeg is available
-        if not self.check_ffmpeg():
-            messagebox.showerror("Error", "FFmpeg is not installed or not in PATH.\nPlease install FFmpeg first.")
-            sys.exit(1)
+        self.capabilities = None
 
         self.setup_ui()
+        # Check for ffmpeg once the window is up, so a first run that has to
+        # query it does not delay the window
+        self.root.after_idle(self.check_ffmpeg)
 
     def check_ffmpeg(self):
-        """Check if ffmpeg is available in system PATH"""
-        try:
-            subprocess.run(['ffmpeg', '-version'], capture_output=True, check=True)
-            return True
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            return False
+        """Look up the ffmpeg capabilities in the background, conversion starts disabled until then"""
+        result = {}
+        thread = threading.Thread(target=lambda: result.setdefault('capabilities', get_capabilities()),
+                                  daemon=True)
+        thread.start()
+        self.root.after(50, self.on_ffmpeg_checked, thread, result)
+
+    def on_ffmpeg_checked(self, thread, result):
+        """Fill in the encoders the local ffmpeg supports and enable conversion"""
+        if thread.is_alive():
+            self.root.after(50, self.on_ffmpeg_checked, thread, result)
+            return
+        self.capabilities = result.get('capabilities')
+        if self.capabilities is None:
+            messagebox.showerror("Error", "FFmpeg is not installed or not in PATH.\nPlease install FFmpeg first.")
+            self.root.destroy()
+            sys.exit(1)
+
+        self.encoder_names = available_encoders(self.capabilities) or [DEFAULT_ENCODER]
+        self.encoder_combo.config(values=[ENCODERS[name]['label'] for name in self.encoder_names])
+        if self.encoder_var.get() not in self.encoder_combo.cget('values'):
+            self.encoder_var.set(ENCODERS[self.encoder_names[0]]['label'])
+            self.on_encoder_selected()
+        self.convert_button.config(state=tk.NORMAL)
+        self.status_label.config(text="Ready to convert")
 
     def setup_ui(self):
         """Setup the user interface"""
@@ -77,9 +99,10 @@ class MTStoMP4Converter:
         quality_frame.columnconfigure(1, weight=1)
 
         ttk.Label(quality_frame, text="Quality (CRF):").grid(row=0, column=0, sticky=tk.W)
-        self.crf_var = tk.StringVar(value="18")
-        crf_spinbox = ttk.Spinbox(quality_frame, from_=0, to=51, textvariable=self.crf_var, width=10)
-        crf_spinbox.grid(row=0, column=1, sticky=tk.W, padx=(5, 0))
+        self.crf_var = tk.StringVar(value=str(ENCODERS[DEFAULT_ENCODER]['default_crf']))
+        self.crf_spinbox = ttk.Spinbox(quality_frame, from_=0, to=ENCODERS[DEFAULT_ENCODER]['max_crf'],
+                                       textvariable=self.crf_var, width=10)
+        self.crf_spinbox.grid(row=0, column=1, sticky=tk.W, padx=(5, 0))
 
         ttk.Label(quality_frame, text="(Lower = Better Quality, Higher = Smaller File)").grid(
             row=0, column=2, sticky=tk.W, padx=(10, 0))
@@ -88,15 +111,30 @@ class MTStoMP4Converter:
         ttk.Label(quality_frame, text="Encoding Speed:").grid(row=1, column=0, sticky=tk.W, pady=(5, 0))
         self.preset_var = tk.StringVar(value="medium")
         preset_combo = ttk.Combobox(quality_frame, textvariable=self.preset_var, 
-                                   values=["veryslow", "slower", "slow", "medium", "fast", "faster", "veryfast"],
+                                   values=PRESETS,
                                    state="readonly", width=15)
         preset_combo.grid(row=1, column=1, sticky=tk.W, padx=(5, 0), pady=(5, 0))
 
+        # Encoder backends the installed ffmpeg supports, filled in by check_ffmpeg
+        ttk.Label(quality_frame, text="Encoder:").grid(row=2, column=0, sticky=tk.W, pady=(5, 0))
+        self.encoder_names = [DEFAULT_ENCODER]
+        self.encoder_var = tk.StringVar(value=ENCODERS[DEFAULT_ENCODER]['label'])
+        self.encoder_combo = ttk.Combobox(quality_frame, textvariable=self.encoder_var,
+                                          values=[ENCODERS[DEFAULT_ENCODER]['label']],
+                                          state="readonly", width=15)
+        self.encoder_combo.grid(row=2, column=1, sticky=tk.W, padx=(5, 0), pady=(5, 0))
+        self.encoder_combo.bind('<<ComboboxSelected>>', self.on_encoder_selected)
+
+        ttk.Label(quality_frame, text="Content:").grid(row=3, column=0, sticky=tk.W, pady=(5, 0))
+        self.tune_var = tk.StringVar(value="default")
+        ttk.Combobox(quality_frame, textvariable=self.tune_var, values=["default", *TUNES],
+                     state="readonly", width=15).grid(row=3, column=1, sticky=tk.W, padx=(5, 0), pady=(5, 0))
+
         # Copy streams option (for lossless conversion)
         self.copy_streams = tk.BooleanVar(value=False)
         ttk.Checkbutton(quality_frame, text="Copy streams (lossless, fastest)", 
                        variable=self.copy_streams, command=self.toggle_copy_mode).grid(
-            row=2, column=0, columnspan=3, sticky=tk.W, pady=(5, 0))
+            row=4, column=0, columnspan=3, sticky=tk.W, pady=(5, 0))
 
         # Progress frame
         progress_frame = ttk.LabelFrame(main_frame, text="Conversion Progress", padding="5")
@@ -108,9 +146,13 @@ class MTStoMP4Converter:
                                           maximum=100, length=400)
         self.progress_bar.grid(row=0, column=0, sticky=(tk.W, tk.E), pady=(0, 5))
 
-        self.status_label = ttk.Label(progress_frame, text="Ready to convert")
+        self.status_label = ttk.Label(progress_frame, text="Checking FFmpeg...")
         self.status_label.grid(row=1, column=0, sticky=tk.W)
 
+        # Percentage, frame rate, speed, bitrate and ETA of the running conversion
+        self.stats_label = ttk.Label(progress_frame, text="")
+        self.stats_label.grid(row=2, column=0, sticky=tk.W)
+
         # Log frame
         log_frame = ttk.LabelFrame(main_frame, text="Conversion Log", padding="5")
         log_frame.grid(row=6, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(0, 10))
@@ -136,7 +178,8 @@ class MTStoMP4Converter:
         button_frame.grid(row=7, column=0, columnspan=2, pady=(10, 0))
 
         self.convert_button = ttk.Button(button_frame, text="Start Conversion", 
-                                        command=self.start_conversion, style="Accent.TButton")
+                                        command=self.start_conversion, style="Accent.TButton",
+                                        state=tk.DISABLED)
         self.convert_button.pack(side=tk.LEFT, padx=(0, 10))
 
         self.cancel_button = ttk.Button(button_frame, text="Cancel", 
@@ -172,6 +215,17 @@ class MTStoMP4Converter:
         if filename:
             self.output_file.set(filename)
 
+    def selected_encoder(self):
+        """Backend name of the encoder chosen in the combobox"""
+        label = self.encoder_var.get()
+        return next(name for name in self.encoder_names if ENCODERS[name]['label'] == label)
+
+    def on_encoder_selected(self, event=None):
+        """Switch the CRF range and default to the chosen encoder's scale"""
+        backend = ENCODERS[self.selected_encoder()]
+        self.crf_spinbox.config(to=backend['max_crf'])
+        self.crf_var.set(str(backend['default_crf']))
+
     def toggle_copy_mode(self):
         """Toggle between copy mode and re-encoding mode"""
         # This function can be extended to enable/disable quality options
@@ -216,7 +270,10 @@ class MTStoMP4Converter:
         return True
 
     def get_video_duration(self, input_file):
-        """Get video duration using ffprobe"""
+        """Get video duration from the transport stream, falling back to ffprobe"""
+        info = native_probe(input_file)
+        if info:
+            return info['duration']
         try:
             cmd = [
                 'ffprobe', '-v', 'quiet', '-show_entries', 'format=duration',
@@ -227,27 +284,6 @@ class MTStoMP4Converter:
         except (subprocess.CalledProcessError, ValueError):
             return None
 
-    def parse_ffmpeg_output(self, line, total_duration):
-        """Parse ffmpeg output to extract progress information"""
-        # Look for time information in ffmpeg output
-        time_match = re.search(r'time=([0-9:.]+)', line)
-        if time_match and total_duration:
-            time_str = time_match.group(1)
-            try:
-                # Parse time string (HH:MM:SS.microseconds)
-                time_parts = time_str.split(':')
-                if len(time_parts) == 3:
-                    hours = float(time_parts[0])
-                    minutes = float(time_parts[1])
-                    seconds = float(time_parts[2])
-                    current_time = hours * 3600 + minutes * 60 + seconds
-
-                    progress = (current_time / total_duration) * 100
-                    return min(progress, 100)  # Cap at 100%
-            except (ValueError, IndexError):
-                pass
-        return None
-
     def run_conversion(self):
         """Run the actual conversion process"""
         input_path = self.input_file.get()
@@ -272,15 +308,17 @@ class MTStoMP4Converter:
                 self.log_message("Using lossless copy mode...")
             else:
                 # Re-encoding mode with quality settings
+                encoder = self.selected_encoder()
+                tune = self.tune_var.get() if self.tune_var.get() in TUNES else None
                 cmd = [
                     'ffmpeg', '-i', input_path,
-                    '-c:v', 'libx264', '-crf', self.crf_var.get(),
-                    '-preset', self.preset_var.get(),
+                    *encoder_args(encoder, self.crf_var.get(), self.preset_var.get(), tune=tune),
                     '-c:a', 'aac', '-b:a', '192k',
                     '-movflags', '+faststart',
                     '-y', output_path
                 ]
-                self.log_message(f"Using re-encoding mode with CRF {self.crf_var.get()} and {self.preset_var.get()} preset...")
+                self.log_message("Using re-encoding mode: "
+                                 f"{describe_encoder(encoder, self.crf_var.get(), self.preset_var.get(), tune)}...")
 
             self.log_message(f"Command: {' '.join(cmd)}")
             self.log_message("Starting conversion...")
@@ -292,22 +330,25 @@ class MTStoMP4Converter:
             )
 
             # Process output line by line
+            meter = ThroughputMeter(total_duration)
             for line in iter(self.ffmpeg_process.stdout.readline, ''):
                 if not self.conversion_running:
                     break
 
                 line = line.strip()
-                if line:
-                    # Update progress if possible
-                    if total_duration:
-                        progress = self.parse_ffmpeg_output(line, total_duration)
-                        if progress is not None:
-                            self.update_progress(progress)
-                            self.status_label.config(text=f"Converting... {progress:.1f}%")
-
+                stats = parse_stats(line)
+                if stats is not None:
+                    # Stats lines arrive several times a second, redraw at most every RENDER_INTERVAL
+                    meter.update(stats)
+                    if meter.due():
+                        if meter.fraction is not None:
+                            self.update_progress(meter.fraction * 100)
+                        self.status_label.config(text="Converting... stalled" if meter.stalled
+                                                 else "Converting...")
+                        self.stats_label.config(text=meter.describe())
+                elif any(keyword in line.lower() for keyword in ['error', 'warning']):
                     # Log important information
-                    if any(keyword in line.lower() for keyword in ['error', 'warning', 'frame=', 'time=']):
-                        self.log_message(line)
+                    self.log_message(line)
 
             # Wait for process to complete
             self.ffmpeg_process.wait()
@@ -363,6 +404,7 @@ class MTStoMP4Converter:
         self.cancel_button.config(state=tk.NORMAL)
         self.progress_var.set(0)
         self.status_label.config(text="Starting conversion...")
+        self.stats_label.config(text="")
 
         # Clear log
         self.log_text.config(state=tk.NORMAL)
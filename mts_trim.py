@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - Smart Cut
+Plans frame-accurate trims that stream-copy every whole GOP inside the
+range and re-encode only the partial GOPs at either end, using the
+keyframe index to cut the source on packet boundaries.
+"""
+
+import os
+
+from mts_ts import PTS_HZ, PTS_WRAP, TransportStream, unwrap_timestamp
+
+# libx264 profile names for H.264 profile_idc values
+X264_PROFILES = {66: 'baseline', 77: 'main', 100: 'high', 110: 'high10', 122: 'high422', 244: 'high444'}
+
+
+def parse_time(value):
+    """Parse SECONDS, MM:SS or HH:MM:SS (with optional fractions) into seconds"""
+    parts = value.strip().split(':')
+    if not 1 <= len(parts) <= 3:
+        raise ValueError(f"invalid time: {value}")
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + float(part)
+    if seconds < 0:
+        raise ValueError(f"invalid time: {value}")
+    return seconds
+
+
+def trim_input_args(start=None, end=None):
+    """ffmpeg input options for a plain (re-encoding or keyframe-bound) trim"""
+    args = []
+    if start:
+        args += ['-ss', f"{start:.3f}"]
+    if end is not None:
+        args += ['-to', f"{end:.3f}"]
+    return args
+
+
+class TransportSlice:
+    """Byte range of a transport stream, fed to ffmpeg with the PAT/PMT in front"""
+
+    def __init__(self, path, offset, length, prefix):
+        self.path = path
+        self.offset = offset
+        self.size = length
+        self.prefix = prefix
+
+    @property
+    def display_name(self):
+        return f"{os.path.basename(self.path)}@{self.offset}"
+
+    def raw_range(self):
+        return self.path, self.offset, self.size
+
+
+def plan_cut(index, start=None, end=None):
+    """Split a trim into pieces along the keyframes of a KeyframeIndex
+
+    Returns a list of dicts with 'mode' ('encode' or 'copy'), the keyframe
+    numbers 'first' and 'stop' (None for end of file) the piece is cut
+    from, 'trim' as (start, end) seconds relative to the first keyframe
+    for encoded pieces, and its 'duration' in the output (None when it
+    runs to the end of the file).
+    """
+    if not len(index):
+        raise ValueError("no keyframes found")
+    start = start or 0.0
+    if end is not None and end <= start:
+        raise ValueError("--end must be after --start")
+    last = len(index) - 1
+
+    def following(k):
+        return k + 1 if k < last else None
+
+    def encode(first, trim_start, trim_end):
+        relative_end = None if trim_end is None else trim_end - index.seconds(first)
+        duration = None if trim_end is None else trim_end - trim_start
+        return {'mode': 'encode', 'first': first, 'stop': following(first),
+                'trim': (trim_start - index.seconds(first), relative_end), 'duration': duration}
+
+    head = index.at_or_before(start)
+    if head is None:
+        head, start = 0, 0.0
+    # First keyframe at or after the cut-in, and last one at or before the cut-out
+    inner_start = head if index.seconds(head) == start else following(head)
+    inner_end = None if end is None else index.at_or_before(end)
+
+    if inner_start is None or (inner_end is not None and inner_end < inner_start):
+        # Cut-in and cut-out fall inside the same GOP
+        return [encode(head, start, end)]
+
+    pieces = []
+    if inner_start != head:
+        pieces.append(encode(head, start, index.seconds(inner_start)))
+    if inner_end is None or inner_end > inner_start:
+        stop = inner_end
+        duration = None if stop is None else index.seconds(stop) - index.seconds(inner_start)
+        pieces.append({'mode': 'copy', 'first': inner_start, 'stop': stop, 'trim': None, 'duration': duration})
+    if inner_end is not None and end > index.seconds(inner_end):
+        pieces.append(encode(inner_end, index.seconds(inner_end), end))
+    return pieces
+
+
+def keyframe_offset(index, start_time):
+    """Seconds from the file's start time (what players show as 0) to its first keyframe"""
+    if start_time is None:
+        return 0.0
+    return (index.pts[0] - round(start_time * PTS_HZ)) % PTS_WRAP / PTS_HZ
+
+
+def piece_slice(input_file, index, first, stop, prefix, size):
+    """TransportSlice covering keyframes first up to (not including) stop"""
+    offset = index.offsets[first]
+    end = size if stop is None else index.offsets[stop]
+    return TransportSlice(input_file, offset, end - offset, prefix)
+
+
+def matching_encoder_args(sps, crf, preset):
+    """libx264 options that produce a stream the copied GOPs can be joined to"""
+    args = ['-c:v', 'libx264', '-crf', str(crf), '-preset', preset, '-pix_fmt', 'yuv420p']
+    profile = X264_PROFILES.get(sps['profile_idc'])
+    if profile:
+        args += ['-profile:v', profile]
+    args += ['-level:v', f"{sps['level_idc'] // 10}.{sps['level_idc'] % 10}"]
+    if sps['interlaced']:
+        # The re-encoded GOPs must keep the field order of the copied ones
+        parity = 'bff' if sps.get('field_order') == 'bff' else 'tff'
+        args += ['-flags', '+ildct+ilme', '-x264-params', f"{parity}=1"]
+    return args
+
+
+def measure_duration(path):
+    """Duration of the video in a cut piece from its PES timestamps, or None"""
+    with TransportStream.open(path) as ts:
+        _, streams = ts.streams()
+        video = next((s['pid'] for s in streams if s['codec_type'] == 'video'), None)
+        timestamps = []
+        for i in range(ts.packet_count):
+            pos = ts.sync_offset(i)
+            pid, pusi, payload = ts.header(pos)
+            if pid == video and pusi and payload is not None:
+                pts, _ = ts.pes_header(payload)
+                if pts is not None:
+                    timestamps.append(unwrap_timestamp(pts, timestamps[0]) if timestamps else pts)
+    if not timestamps:
+        return None
+    timestamps.sort()
+    # The last frame lasts as long as the shortest frame interval
+    steps = [b - a for a, b in zip(timestamps, timestamps[1:]) if b > a]
+    return (timestamps[-1] - timestamps[0] + (min(steps) if steps else 0)) / PTS_HZ
+
+
+def concat_list(paths, durations):
+    """ffconcat script joining the pieces, with their exact durations"""
+    lines = ['ffconcat version 1.0']
+    for path, duration in zip(paths, durations):
+        lines.append(f"file '{os.path.basename(path)}'")
+        if duration is not None:
+            lines.append(f"duration {duration:.6f}")
+    return '\n'.join(lines) + '\n'
+
+
+def audio_window(index, pieces, start, end):
+    """Keyframe range and -copyts trim times for the audio of a cut
+
+    Audio is cut once for the whole range, from a slice one GOP wider on
+    each side so that audio muxed ahead of or behind the video is kept.
+    Returns (first, stop, trim_start, trim_end) in source clock seconds.
+    """
+    first = max(0, pieces[0]['first'] - 1)
+    stop = pieces[-1]['stop']
+    if stop is not None:
+        stop = stop + 1 if stop + 1 < len(index) else None
+    origin = (index.pts[first] % PTS_WRAP) / PTS_HZ - index.seconds(first)
+    trim_end = None if end is None else origin + end
+    return first, stop, origin + (start or 0.0), trim_end
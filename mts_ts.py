@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+MTS to MP4 Converter - Transport Stream Parsing
+Minimal MPEG-TS / M2TS reader working directly on a memory-mapped file:
+packet layout detection, PAT/PMT parsing and PES timestamps.
+"""
+
+import mmap
+
+TS_PACKET_SIZE = 188
+M2TS_PACKET_SIZE = 192
+SYNC_BYTE = 0x47
+# Packets that must line up on sync bytes before a layout is accepted
+SYNC_CHECK_PACKETS = 5
+
+PAT_PID = 0x0000
+NULL_PID = 0x1FFF
+PAT_TABLE_ID = 0x00
+PMT_TABLE_ID = 0x02
+
+# Timestamps are 33-bit counters of a 90 kHz clock
+PTS_HZ = 90000
+PTS_WRAP = 1 << 33
+
+# PMT stream_type -> (codec type, ffmpeg codec name); 0x80+ are Blu-ray/AVCHD types
+STREAM_TYPES = {
+    0x01: ('video', 'mpeg1video'),
+    0x02: ('video', 'mpeg2video'),
+    0x1B: ('video', 'h264'),
+    0x24: ('video', 'hevc'),
+    0xEA: ('video', 'vc1'),
+    0x03: ('audio', 'mp2'),
+    0x04: ('audio', 'mp2'),
+    0x0F: ('audio', 'aac'),
+    0x11: ('audio', 'aac_latm'),
+    0x80: ('audio', 'pcm_bluray'),
+    0x81: ('audio', 'ac3'),
+    0x82: ('audio', 'dts'),
+    0x83: ('audio', 'truehd'),
+    0x84: ('audio', 'eac3'),
+    0x85: ('audio', 'dts'),
+    0x86: ('audio', 'dts'),
+    0xA1: ('audio', 'eac3'),
+    0xA2: ('audio', 'dts'),
+    0x90: ('subtitle', 'hdmv_pgs_subtitle'),
+    0x92: ('subtitle', 'hdmv_text_subtitle'),
+}
+
+
+class TransportStreamError(ValueError):
+    pass
+
+
+def detect_layout(data, limit=None):
+    """Return (packet_size, first sync byte offset) for TS or M2TS data"""
+    limit = min(len(data), limit or len(data))
+    for packet_size in (M2TS_PACKET_SIZE, TS_PACKET_SIZE):
+        needed = packet_size * (SYNC_CHECK_PACKETS - 1)
+        for start in range(min(packet_size, max(0, limit - needed))):
+            if all(data[start + i * packet_size] == SYNC_BYTE for i in range(SYNC_CHECK_PACKETS)):
+                return packet_size, start
+    raise TransportStreamError("no MPEG transport stream packets found")
+
+
+def parse_timestamp(data, pos):
+    """Decode a 5-byte PES PTS/DTS field"""
+    return (((data[pos] >> 1) & 0x07) << 30 | data[pos + 1] << 22 | (data[pos + 2] >> 1) << 15
+            | data[pos + 3] << 7 | data[pos + 4] >> 1)
+
+
+def parse_pcr(data, pos):
+    """Decode the 33-bit base of a PCR field in 90 kHz units"""
+    return data[pos] << 25 | data[pos + 1] << 17 | data[pos + 2] << 9 | data[pos + 3] << 1 | data[pos + 4] >> 7
+
+
+def unwrap_timestamp(value, reference):
+    """Move a 33-bit timestamp into the wrap period closest to reference"""
+    return value + (reference - value + PTS_WRAP // 2) // PTS_WRAP * PTS_WRAP
+
+
+class TransportStream:
+    """Packet-level view of a memory-mapped TS or M2TS file"""
+
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+        self.packet_size, self.first_sync = detect_layout(data, 64 * 1024)
+
+    @classmethod
+    def open(cls, path):
+        """Map a file read-only and wrap it, the caller must close() it"""
+        with open(path, 'rb') as f:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise TransportStreamError("file is empty") from None
+        try:
+            return cls(data)
+        except TransportStreamError:
+            data.close()
+            raise
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def packet_count(self):
+        return max(0, (self.size - self.first_sync) // self.packet_size)
+
+    def find_sync(self, start, limit=None):
+        """First sync byte at or after start that lines up with the following packets, or None"""
+        data = self.data
+        limit = min(self.size, limit or self.size)
+        needed = self.packet_size * (SYNC_CHECK_PACKETS - 1)
+        pos = data.find(b'\x47', start, limit)
+        while 0 <= pos and pos + needed < self.size:
+            if all(data[pos + i * self.packet_size] == SYNC_BYTE for i in range(1, SYNC_CHECK_PACKETS)):
+                return pos
+            pos = data.find(b'\x47', pos + 1, limit)
+        return None
+
+    def sync_offset(self, index):
+        """Byte offset of the sync byte of packet number index"""
+        return self.first_sync + index * self.packet_size
+
+    def packet_index(self, offset):
+        """Number of the packet containing a byte offset"""
+        return (offset - self.first_sync) // self.packet_size
+
+    def header(self, pos):
+        """Parse the packet at sync offset pos into (pid, pusi, payload offset or None)"""
+        data = self.data
+        if data[pos] != SYNC_BYTE:
+            return None, False, None
+        b1, b3 = data[pos + 1], data[pos + 3]
+        pid = (b1 & 0x1F) << 8 | data[pos + 2]
+        payload = pos + 4
+        if b3 & 0x20:
+            payload += 1 + data[pos + 4]
+        if not b3 & 0x10 or payload >= pos + TS_PACKET_SIZE:
+            payload = None
+        return pid, bool(b1 & 0x40), payload
+
+    def pcr(self, pos):
+        """Return the PCR base of the packet at pos, or None"""
+        data = self.data
+        if data[pos + 3] & 0x20 and data[pos + 4] >= 7 and data[pos + 5] & 0x10:
+            return parse_pcr(data, pos + 6)
+        return None
+
+    def read_section(self, pid, table_id, start=0, limit=None):
+        """Collect the first complete PSI section of a table on pid"""
+        limit = min(self.size, limit or self.size)
+        section = None
+        index = max(0, self.packet_index(start))
+        while self.sync_offset(index) + TS_PACKET_SIZE <= limit:
+            pos = self.sync_offset(index)
+            index += 1
+            packet_pid, pusi, payload = self.header(pos)
+            if packet_pid != pid or payload is None:
+                continue
+            end = pos + TS_PACKET_SIZE
+            if pusi:
+                pointer = self.data[payload]
+                section = bytearray(self.data[payload + 1 + pointer:end])
+                if not section or section[0] != table_id:
+                    section = None
+                    continue
+            elif section is not None:
+                section += self.data[payload:end]
+            else:
+                continue
+
+            if len(section) >= 3:
+                length = 3 + ((section[1] & 0x0F) << 8 | section[2])
+                if len(section) >= length:
+                    return bytes(section[:length])
+        return None
+
+    def program_map_pids(self, limit=None):
+        """Return the PMT PIDs listed in the PAT"""
+        section = self.read_section(PAT_PID, PAT_TABLE_ID, limit=limit)
+        if section is None:
+            return []
+        pids = []
+        # Program loop sits between the 8-byte header and the CRC
+        for pos in range(8, len(section) - 4, 4):
+            program_number = section[pos] << 8 | section[pos + 1]
+            if program_number:
+                pids.append((section[pos + 2] & 0x1F) << 8 | section[pos + 3])
+        return pids
+
+    def streams(self, limit=None):
+        """Return (pcr_pid, [stream dicts]) from the first program's PMT"""
+        for pmt_pid in self.program_map_pids(limit):
+            section = self.read_section(pmt_pid, PMT_TABLE_ID, limit=limit)
+            if section is None:
+                continue
+            pcr_pid = (section[8] & 0x1F) << 8 | section[9]
+            pos = 12 + ((section[10] & 0x0F) << 8 | section[11])
+            streams = []
+            while pos + 5 <= len(section) - 4:
+                stream_type = section[pos]
+                pid = (section[pos + 1] & 0x1F) << 8 | section[pos + 2]
+                codec_type, codec_name = STREAM_TYPES.get(stream_type, ('data', f"0x{stream_type:02x}"))
+                streams.append({'pid': pid, 'stream_type': stream_type,
+                                'codec_type': codec_type, 'codec_name': codec_name})
+                pos += 5 + ((section[pos + 3] & 0x0F) << 8 | section[pos + 4])
+            return pcr_pid, streams
+        return None, []
+
+    def psi_packets(self, limit=None):
+        """Return the raw packets carrying the first PAT and PMT, to put in front of a cut-out range"""
+        pmt_pids = self.program_map_pids(limit)
+        if not pmt_pids:
+            return None
+        limit = min(self.size, limit or self.size)
+        header = self.packet_size - TS_PACKET_SIZE
+        found = {}
+        index = 0
+        while len(found) < 2 and self.sync_offset(index) + TS_PACKET_SIZE <= limit:
+            pos = self.sync_offset(index)
+            index += 1
+            pid, pusi, _ = self.header(pos)
+            if pusi and pid in (PAT_PID, pmt_pids[0]) and pid not in found:
+                found[pid] = bytes(self.data[pos - header:pos + TS_PACKET_SIZE])
+        if len(found) < 2:
+            return None
+        return found[PAT_PID] + found[pmt_pids[0]]
+
+    def pes_header(self, payload):
+        """Return (pts or None, offset of the PES payload) for a PES starting at payload"""
+        data = self.data
+        if data[payload:payload + 3] != b'\x00\x00\x01':
+            return None, None
+        flags = data[payload + 7]
+        header_end = payload + 9 + data[payload + 8]
+        pts = parse_timestamp(data, payload + 9) if flags & 0x80 else None
+        return pts, header_end